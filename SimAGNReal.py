@@ -5,6 +5,7 @@
 # 1. Calc_Tb
 # 2. SimpleSim
 # 3. GenMultiFRs
+# The vectorized python3 version is sim21ps.psFlat
 
 import numpy as np
 import PIL.Image as Image
@@ -10,7 +10,7 @@ import os
 
 from setuptools import setup, find_packages
 
-import fg21sim as pkg
+import sim21ps as pkg
 
 
 def read(fname):
@@ -23,10 +23,9 @@ setup(
     name=pkg.__pkgname__,
     version=pkg.__version__,
     description=pkg.__description__,
-    long_description=read("README.rst"),
+    long_description=read("README.md"),
     author=pkg.__author__,
     author_email=pkg.__author_email__,
-    url=pkg.__url__,
     license=pkg.__license__,
     classifiers=[
         "Development Status :: 2 - Pre-Alpha",
@@ -41,13 +40,11 @@ setup(
         "Topic :: Scientific/Engineering :: Astronomy",
     ],
     packages=find_packages(exclude=["docs", "tests"]),
-    scripts=[
-        "bin/simAGN",
-    ],
     install_requires=[
         "numpy",
         "scipy",
-        "matploglib",
+        "matplotlib",
+        "pandas",
         "astropy",
         "healpy",
         "configobj",
@@ -1,7 +1,36 @@
-"""
-Simulation of radio point sources for 21cm signal detection
-~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-
-:copyright: (c) 2016 Zhixian MA
-: license: MIT
-"""
+"""
+Simulation of radio point sources for 21cm signal detection
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2016 Zhixian MA
+: license: MIT
+
+The modules are imported on their first access, e.g. sim21ps.psDraw, and
+the heavy dependencies of the modules (healpy, pandas and astropy) are
+imported on their first use, so that `import sim21ps` is cheap.
+"""
+
+import importlib
+
+__pkgname__ = "sim21ps"
+__version__ = "0.1.0"
+__description__ = ("Simulation of radio point sources for 21cm signal "
+                   "detection")
+__author__ = "Zhixian MA"
+__author_email__ = "zxma_sjtu@qq.com"
+__license__ = "MIT"
+
+# The submodules
+__all__ = ['basic_params', 'psCatelogue', 'psDraw', 'psBatch', 'psDelta',
+           'psIndex', 'psProfile', 'psProgress', 'psCheckpoint', 'psBench',
+           'psLazy', 'psRender', 'psTable', 'psStats', 'psBeam', 'psSpec',
+           'psInterp', 'psSkyModel', 'psPartition',
+           'psFlat', 'psComponents', 'psWriter', 'psCull',
+           'psSplit', 'psServe', 'psPipeline', 'psMemory']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module '%s' has no attribute '%s'" %
+                         (__name__, name))
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psBatch is designed to draw many ps catelogues at
+many frequencies and nsides in one invocation, so that the modules are
+imported once, each catelogue is read once, and its footprint is
+calculated once per nside and reused for all the frequencies.
+
+Functions
+---------
+expand_catelogues: expand the globs of the csv catelogues.
+
+parse_freqs: parse the frequency lists and ranges.
+
+parse_nsides: parse the nside lists.
+
+plan_jobs: plan the jobs, one job per catelogue.
+
+estimate_job: the rough memory of a job.
+
+run_job: draw one catelogue at all the nsides and frequencies.
+
+run_batch: run the jobs in one process or a worker pool.
+
+The maps are written by psWriter.MapWriter in a background thread while
+the next ones are drawn. Under a memory budget, the number of workers,
+and the chunks and maps of the jobs, are planned by psMemory.
+"""
+
+# Modules
+import os
+import sys
+import glob
+import getopt
+import numpy as np
+from multiprocessing import Pool
+# Cumstom designed modules
+from . import psDraw
+from . import psRender
+from . import psWriter
+from . import psMemory
+from . import psProfile
+from . import psProgress
+
+
+def expand_catelogues(patterns):
+    """
+    Expand the globs of the catelogues, the repeated files are removed.
+
+    Parameters
+    ----------
+    patterns: list of str
+        Names or globs of the csv catelogues, e.g. 'PS_tables/SF_*.csv'
+
+    return
+    ------
+    catelogues: list of str
+    """
+    catelogues = []
+    for pattern in patterns:
+        names = sorted(glob.glob(pattern))
+        if len(names) == 0:
+            print("No catelogue matches %s" % pattern)
+        for name in names:
+            if name not in catelogues:
+                catelogues.append(name)
+
+    return catelogues
+
+
+def parse_freqs(FreqStr):
+    """
+    Parse the frequencies, which are separated by ',', and the ranges
+    are written as 'start:stop:step' including the stop.
+
+    example
+    -------
+    >>> parse_freqs('120:130:5,150')
+    [120.0, 125.0, 130.0, 150.0]
+    """
+    freqs = []
+    for item in FreqStr.split(','):
+        if ':' in item:
+            start, stop, step = [float(x) for x in item.split(':')]
+            if step <= 0:
+                raise ValueError("Illegal step of the frequencies: %s" % item)
+            num = int(np.round((stop - start) / step)) + 1
+            freqs.extend((start + np.arange(num) * step).tolist())
+        elif item != '':
+            freqs.append(float(item))
+
+    return freqs
+
+
+def parse_nsides(NsideStr):
+    """
+    Parse the nsides, which are separated by ','
+    """
+    nsides = [int(item) for item in NsideStr.split(',') if item != '']
+    for nside in nsides:
+        if nside <= 0 or nside & (nside - 1) != 0:
+            raise ValueError("nside %d is not dyadic" % nside)
+
+    return nsides
+
+
+def plan_jobs(catelogues, freqs, nsides, OutFold):
+    """
+    Plan the jobs, each catelogue is a job, which is read once and drawn
+    at all the nsides and frequencies.
+
+    return
+    ------
+    jobs: list of tuple, (catelogue, nsides, freqs, OutFold)
+    """
+    jobs = [(name, list(nsides), list(freqs), OutFold)
+            for name in catelogues]
+
+    return jobs
+
+
+def get_fits_name(catelogue, nside, freq, OutFold):
+    """
+    Name of the output fits, e.g. 'SF_100_20161009_205700_nside_512_150.0.fits'
+    """
+    FileName = os.path.splitext(os.path.basename(catelogue))[0]
+    fits_name = (FileName + '_nside_' + str(nside) + '_' + str(freq) +
+                 '.fits')
+
+    return os.path.join(OutFold, fits_name)
+
+
+def estimate_job(catelogue, nsides, inflight=2):
+    """
+    The rough memory of the job, [B], i.e. the catelogue read from the
+    csv (3 times of its size), and the map drawn and the maps in flight
+    at the largest nside.
+    """
+    npix = 12 * max(nsides)**2
+
+    return 3 * os.path.getsize(catelogue) + 8 * npix * (2 + inflight)
+
+
+def run_job(catelogue, nsides, freqs, OutFold, inflight=2, max_memory=None):
+    """
+    Draw one catelogue at the nsides and frequencies, and save the maps.
+    The maps are written by psWriter.MapWriter in the background, with
+    at most inflight maps waiting, 0 to write them in order.
+
+    If max_memory (e.g. '4G') is provided, the drawing is planned by
+    psMemory.plan_draw with the maps in flight counted, and if the
+    catelogue does not fit in one chunk, or the maps in memory, it is
+    drawn by psDraw.draw_chunked at each frequency instead of reusing
+    the footprint.
+
+    return
+    ------
+    fits_names: list of str
+        Names of the saved fits files.
+    """
+    FoldName, FileName = os.path.split(catelogue)
+    if FoldName == '':
+        FoldName = '.'
+    ClassType, PS_data = psDraw.read_csv(FileName, FoldName)
+    with psWriter.MapWriter(inflight) as writer:
+        for nside in nsides:
+            if max_memory is not None:
+                plan = psMemory.plan_draw(nside, PS_data, ClassType,
+                                          freqs[0], max_memory,
+                                          NumMaps=1 + inflight)
+                if (plan['chunk'] < PS_data.shape[0] or
+                        plan['accumulation'] != 'dense'):
+                    for freq in freqs:
+                        pix_vec = psDraw.draw_chunked(
+                            nside, PS_data, ClassType, freq,
+                            chunk=plan['chunk'], out=psMemory.create_map(
+                                12 * nside**2, plan['accumulation']))
+                        writer.submit(get_fits_name(catelogue, nside, freq,
+                                                    OutFold), pix_vec)
+                        del pix_vec
+                    continue
+            # The footprint is calculated at the first frequency and reused
+            renderer = psRender.SkyRenderer(nside)
+            for freq in freqs:
+                renderer.reset()
+                renderer.add_class(ClassType, PS_data, freq, key=catelogue)
+                fits_name = get_fits_name(catelogue, nside, freq, OutFold)
+                # The map of the renderer is reused by the next frequency
+                writer.submit(fits_name, renderer.result(copy=False),
+                              copy=inflight > 0)
+            del renderer
+
+    return writer.written
+
+
+def _run_job_worker(job, recorded=False, progress=False, inflight=2,
+                    max_memory=None):
+    """
+    Run the job in a worker, with the psProfile report returned if
+    recorded, and the progress printed if progress.
+    """
+    if progress:
+        reporter = psProgress.ConsoleProgress()
+    else:
+        reporter = psProgress.Progress()
+    with psProgress.reporting(reporter):
+        if recorded:
+            with psProfile.recording() as recorder:
+                fits_names = run_job(*job, inflight=inflight,
+                                     max_memory=max_memory)
+            return fits_names, recorder.report()
+        else:
+            return run_job(*job, inflight=inflight,
+                           max_memory=max_memory), None
+
+
+def run_batch(jobs, NumProc=1, progress=False, inflight=2, max_memory=None):
+    """
+    Run the jobs in this process, or in a pool of NumProc workers.
+    If psProfile is recording, the reports of the workers are merged.
+    Each job writes its maps with at most inflight maps waiting.
+    If max_memory (e.g. '4G') is provided, the workers are reduced by
+    psMemory.plan_workers to fit the largest jobs in the budget, and
+    each of them draws under its share of the budget.
+
+    return
+    ------
+    fits_names: list of str
+    """
+    for job in jobs:
+        if os.path.exists(job[3]) == False:
+            os.makedirs(job[3])
+    if max_memory is not None and NumProc > 1 and len(jobs) > 1:
+        NumProc = psMemory.plan_workers(
+            [estimate_job(job[0], job[1], inflight) for job in jobs],
+            max_memory, NumProc)
+        if NumProc > 1:
+            max_memory = psMemory.parse_size(max_memory) // \
+                min(NumProc, len(jobs))
+    if NumProc <= 1 or len(jobs) <= 1:
+        if progress:
+            with psProgress.reporting(psProgress.ConsoleProgress()):
+                results = [run_job(*job, inflight=inflight,
+                                   max_memory=max_memory) for job in jobs]
+        else:
+            results = [run_job(*job, inflight=inflight,
+                               max_memory=max_memory) for job in jobs]
+    else:
+        recorded = psProfile.enabled()
+        tasks = [(job, recorded, progress, inflight, max_memory)
+                 for job in jobs]
+        with Pool(min(NumProc, len(jobs))) as pool:
+            results = []
+            for fits_names, report in pool.starmap(_run_job_worker, tasks):
+                if report is not None:
+                    psProfile.merge(report)
+                results.append(fits_names)
+    fits_names = [name for names in results for name in names]
+
+    return fits_names
+
+
+def main(argv):
+    """
+    A main function for use this module at the command window
+
+    example
+    -------
+    psBatch -i 'PS_tables/SF_*.csv' -i PS_tables/FRI_100_20161009_205700.csv
+    -o PS_maps -n 256,512 -f 120:130:0.5,150 -j 4
+    """
+    usage = ("psBatch -i <PS names or globs (csv)> -o <Output folder> "
+             "-n <nside list> -f <frequency list or start:stop:step> "
+             "-j <number of workers> -t <timing report (json)> "
+             "-p (progress) -w <maps in flight, 0 to write in order> "
+             "-m <memory budget, e.g. 4G>")
+    try:
+        opts, args = getopt.getopt(
+            argv, "hi:o:n:f:j:t:pw:m:",
+            ["infile=", "outfold=", "nside=", "freq=", "jobs=", "timing=",
+             "progress", "inflight=", "max-memory="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    # Default
+    patterns = []
+    OutFold = '.'
+    nsides = [512]
+    freqs = [150]
+    NumProc = 1
+    timing_name = None
+    progress = False
+    inflight = 2
+    max_memory = None
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-i", "--infile"):
+            patterns.extend(arg.split(','))
+        elif opt in ("-o", "--outfold"):
+            OutFold = arg
+        elif opt in ("-n", "--nside"):
+            nsides = parse_nsides(arg)
+        elif opt in ("-f", "--freq"):
+            freqs = parse_freqs(arg)
+        elif opt in ("-j", "--jobs"):
+            NumProc = int(arg)
+        elif opt in ("-t", "--timing"):
+            timing_name = arg
+        elif opt in ("-p", "--progress"):
+            progress = True
+        elif opt in ("-w", "--inflight"):
+            inflight = int(arg)
+        elif opt in ("-m", "--max-memory"):
+            max_memory = arg
+    patterns.extend(args)
+    catelogues = expand_catelogues(patterns)
+    if len(catelogues) == 0:
+        print(usage)
+        sys.exit(2)
+    # print
+    print("Catelogues: ", len(catelogues))
+    print("nsides: ", nsides)
+    print("frequencies: ", freqs)
+    jobs = plan_jobs(catelogues, freqs, nsides, OutFold)
+    if timing_name is None:
+        fits_names = run_batch(jobs, NumProc, progress, inflight,
+                               max_memory)
+    else:
+        with psProfile.recording(FileName=timing_name):
+            fits_names = run_batch(jobs, NumProc, progress, inflight,
+                               max_memory)
+    print("Saved %d maps to %s" % (len(fits_names), OutFold))
+    if max_memory is not None:
+        psMemory.report(max_memory)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psBeam is designed to convolve the drawn maps with
+the instrument beam in the harmonic space, i.e. map2alm, almxfl with the
+beam window function and alm2map. The maps of all the classes are
+summed before, so there is one transform per frequency, and the window
+functions are cached per beam model and lmax.
+
+The transforms of healpy are multithreaded by OpenMP, whose number of
+threads is set by the environment variable OMP_NUM_THREADS.
+
+Classes
+-------
+GaussianBeam: class
+    The Gaussian beam, whose FWHM is constant or scales as 1/Freq.
+
+Functions
+---------
+beam_window: the cached window function of a beam model.
+
+convolve: convolve the map with the beam at a frequency.
+
+example
+-------
+>>> beam = psBeam.GaussianBeam(fwhm=10, Freq0=150e6)  # 10' at 150MHz
+>>> pix_vec = psDraw.draw_sky(512, 120e6, ['SF_100_20161009_205700.csv',
+...                           'FRI_100_20161009_205800.csv'], beam=beam)
+"""
+
+# Modules
+import functools
+import numpy as np
+# Cumstom designed modules
+from . import psProfile
+from .psLazy import LazyModule
+# The heavy modules are imported on the first use
+hp = LazyModule('healpy')
+
+
+class GaussianBeam:
+    """
+    The Gaussian beam.
+
+    Parameters
+    ----------
+    fwhm: float
+        The full width at half maximum, [arcmin]
+    Freq0: float
+        If provided, fwhm is at the frequency Freq0, and the FWHM at
+        the frequency Freq is fwhm * Freq0 / Freq, otherwise the FWHM
+        is the same at all the frequencies.
+    """
+
+    def __init__(self, fwhm, Freq0=None):
+        self.fwhm = fwhm
+        self.Freq0 = Freq0
+
+    def get_fwhm(self, Freq):
+        """
+        The FWHM at the frequency, [rad]
+        """
+        fwhm = self.fwhm
+        if self.Freq0 is not None:
+            fwhm = fwhm * self.Freq0 / Freq
+
+        return np.radians(fwhm / 60)
+
+    def model(self, Freq):
+        """
+        The hashable model of the beam at the frequency, by which the
+        window functions are cached.
+        """
+        return ('gaussian', round(float(self.get_fwhm(Freq)), 15))
+
+    def window(self, Freq, lmax):
+        return beam_window(self.model(Freq), lmax)
+
+
+@functools.lru_cache(maxsize=128)
+def beam_window(model, lmax):
+    """
+    The window function of the beam model, e.g. ('gaussian', fwhm), up
+    to lmax, which is cached and read-only.
+    """
+    kind = model[0]
+    if kind == 'gaussian':
+        bl = hp.gauss_beam(model[1], lmax=lmax)
+    else:
+        raise ValueError("Unknown beam model: %s" % kind)
+    bl.setflags(write=False)
+
+    return bl
+
+
+def convolve(pix_vec, beam, Freq, lmax=None, nest=False, iter=3):
+    """
+    Convolve the map with the beam at the frequency.
+
+    Parameters
+    ----------
+    pix_vec: np.ndarray(12*nside^2,)
+        The map, which is not changed
+    beam: GaussianBeam
+        The beam
+    Freq: float
+        Frequency
+    lmax: int
+        The maximum multipole, default as 3*nside-1
+    nest: bool
+        Whether the map is in NESTED ordering
+    iter: int
+        Number of iterations of map2alm, see healpy.map2alm
+
+    return
+    ------
+    pix_vec: np.ndarray(12*nside^2,)
+        The convolved map, in the same ordering
+    """
+    nside = hp.npix2nside(len(pix_vec))
+    if lmax is None:
+        lmax = 3 * nside - 1
+    if nest:
+        pix_vec = hp.reorder(pix_vec, n2r=True)
+    bl = beam.window(Freq, lmax)
+    with psProfile.stage('map2alm'):
+        alm = hp.map2alm(pix_vec, lmax=lmax, iter=iter)
+    with psProfile.stage('almxfl'):
+        alm = hp.almxfl(alm, bl, inplace=True)
+    with psProfile.stage('alm2map'):
+        pix_vec = hp.alm2map(alm, nside, lmax=lmax)
+    if nest:
+        pix_vec = hp.reorder(pix_vec, r2n=True)
+
+    return pix_vec
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psBench is designed to benchmark the generation of
+the ps catelogues and the drawing of the healpix maps, on a grid of
+numbers of sources, nsides and class types, with seeded synthetic
+catelogues. The wall time, throughput and peak memory are saved into
+a json file, and two json files can be compared to flag regressions.
+
+Functions
+---------
+gen_synthetic: generate a seeded synthetic catelogue quickly.
+
+bench_func: measure wall time and peak memory of a function call.
+
+run_suite: run the benchmarks on the grid.
+
+save_results, load_results: the json results file.
+
+compare_results: flag the regressions between two results files.
+
+bench_import: measure the cold import time of the modules, which is kept
+under IMPORT_BUDGET.
+
+check_resume: check that the catelogue and the map killed partway and
+resumed from the checkpoint are identical to the uninterrupted ones.
+"""
+
+# Modules
+import os
+import sys
+import time
+import json
+import getopt
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+# Cumstom designed modules
+from . import psCatelogue
+from . import psDraw
+from . import psTable
+from . import psCheckpoint
+
+# Names of the classes and their catelogue generators
+ClassList = psTable.ClassList
+ClassGen = {1: psCatelogue.StarForming, 2: psCatelogue.StarBursting,
+            3: psCatelogue.PointSource, 4: psCatelogue.FRI,
+            5: psCatelogue.FRII}
+
+
+def gen_synthetic(ClassType, NumPS, seed=0):
+    """
+    Generate a synthetic catelogue with the same columns as psCatelogue,
+    but vectorized, so that large catelogues can be made in seconds.
+
+    Parameters
+    ----------
+    ClassType: int
+        Class type of the point soruces
+    NumPS: int
+        Number of the point sources
+    seed: int
+        Seed of the random generator
+
+    return
+    ------
+    PS_data: psTable.Catelogue
+    """
+    rng = np.random.RandomState(seed)
+    PS_data = {}
+    PS_data['z'] = rng.uniform(0, 20, NumPS)
+    PS_data['dA (Mpc)'] = rng.uniform(500, 1800, NumPS)
+    # Keep away from the poles, so the extended sources are in range
+    PS_data['Theta (deg)'] = rng.uniform(0.01, np.pi - 0.01, NumPS) * 180
+    PS_data['Phi (deg)'] = rng.uniform(0, np.pi * 2, NumPS) * 180
+    if ClassType == 1 or ClassType == 2:
+        radius = 10**rng.uniform(-7, -5, NumPS)
+        PS_data['Area (sr)'] = np.pi * radius**2
+        PS_data['radius (rad)'] = radius
+    elif ClassType == 3:
+        PS_data['Area (sr)'] = np.full(NumPS, 4 * np.pi / (12 * 512**2))
+    else:
+        lobe_maj = 10**rng.uniform(-6, -4, NumPS)
+        lobe_min = lobe_maj * rng.uniform(0.2, 1, NumPS)
+        PS_data['Area (sr)'] = np.pi * lobe_maj * lobe_min
+        PS_data['lobe_maj (rad)'] = lobe_maj
+        PS_data['lobe_min (rad)'] = lobe_min
+        PS_data['lobe_ang (deg)'] = rng.uniform(0, np.pi, NumPS) * 180
+    PS_data['I_151 (Jy)'] = 10**rng.uniform(-4, -3, NumPS)
+
+    return psTable.Catelogue.from_arrays(PS_data, ClassType=ClassType)
+
+
+def bench_func(func, args=(), kwargs={}, repeat=1, memory=True):
+    """
+    Measure the best wall time of repeat calls of func, and the peak
+    memory of one more call traced by tracemalloc.
+
+    return
+    ------
+    result: dict, {'wall (s)', 'peak_mem (B)'}
+    """
+    wall = np.inf
+    for i in range(repeat):
+        tic = time.perf_counter()
+        func(*args, **kwargs)
+        wall = min(wall, time.perf_counter() - tic)
+    peak_mem = None
+    if memory:
+        tracemalloc.start()
+        func(*args, **kwargs)
+        peak_mem = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    result = {'wall (s)': wall, 'peak_mem (B)': peak_mem}
+
+    return result
+
+
+def _seeded(func, seed):
+    """
+    Wrap func to reset the global random state before each call, the
+    fluxes of psDraw are drawn from np.random.
+    """
+    def wrapper(*args, **kwargs):
+        np.random.seed(seed)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _draw_class(nside, PS_data, ClassType, Freq):
+    # The drawer of each class, as draw_ps does
+    if ClassType == 1 or ClassType == 2:
+        return psDraw.draw_cir(nside, PS_data, ClassType, Freq)
+    elif ClassType == 3:
+        return psDraw.draw_rq(nside, PS_data, Freq)
+    else:
+        return psDraw.draw_lobe(nside, PS_data, ClassType, Freq)
+
+
+def _draw_name(ClassType):
+    if ClassType == 1 or ClassType == 2:
+        return 'draw_cir'
+    elif ClassType == 3:
+        return 'draw_rq'
+    else:
+        return 'draw_lobe'
+
+
+def run_suite(NumList=(1000, 10000, 100000, 1000000),
+              nsides=(64, 256, 1024, 2048), classes=(1, 2, 3, 4, 5),
+              Freq=150e6, seed=0, repeat=1, memory=True, MaxGenPS=1000):
+    """
+    Run the benchmarks of save_as_csv (one by one and in batches),
+    calc_flux, draw_* and draw_ps on the grid of numbers of sources, nsides and class types.
+
+    Parameters
+    ----------
+    NumList: list of int
+        Numbers of the point sources
+    nsides: list of int
+        nsides of the maps
+    classes: list of int
+        Class types
+    Freq: float
+        Frequency
+    seed: int
+        Seed of the synthetic catelogues and the fluxes
+    repeat: int
+        The best wall time of repeat runs is recorded.
+    memory: bool
+        Whether to trace the peak memory, which costs one more run.
+    MaxGenPS: int
+        save_as_csv is slow as one source per call, so it is only
+        benchmarked up to MaxGenPS sources.
+
+    return
+    ------
+    results: list of dict
+    """
+    results = []
+
+    def record(name, ClassType, NumPS, nside, func, args, npix=None):
+        entry = {'name': name, 'ClassType': ClassType, 'NumPS': NumPS,
+                 'nside': nside}
+        try:
+            entry.update(bench_func(_seeded(func, seed), args,
+                                    repeat=repeat, memory=memory))
+            entry['sources_per_s'] = NumPS / entry['wall (s)']
+            if npix is not None:
+                entry['pixels_per_s'] = npix / entry['wall (s)']
+        except Exception as err:
+            entry['error'] = repr(err)
+        print(name, ClassList[ClassType - 1], NumPS, nside,
+              entry.get('wall (s)', entry.get('error')))
+        results.append(entry)
+
+    with tempfile.TemporaryDirectory() as FoldName:
+        for ClassType in classes:
+            for NumPS in NumList:
+                # Catelogue generation
+                if NumPS <= MaxGenPS:
+                    Gen = ClassGen[ClassType]()
+                    record('save_as_csv', ClassType, NumPS, None,
+                           Gen.save_as_csv, (NumPS, FoldName))
+                Gen = ClassGen[ClassType]()
+                record('save_batch', ClassType, NumPS, None,
+                       Gen.save_as_csv, (NumPS, FoldName, None, 0, 10000))
+                PS_data = gen_synthetic(ClassType, NumPS, seed)
+                FileName = '%s_%d_bench.csv' % (ClassList[ClassType - 1],
+                                                NumPS)
+                PS_data.to_csv(os.path.join(FoldName, FileName))
+                record('calc_flux', ClassType, NumPS, None,
+                       psDraw.calc_flux, (ClassType, Freq, PS_data))
+                for nside in nsides:
+                    npix = 12 * nside**2
+                    record(_draw_name(ClassType), ClassType, NumPS, nside,
+                           _draw_class, (nside, PS_data, ClassType, Freq),
+                           npix)
+                    record('draw_ps', ClassType, NumPS, nside,
+                           psDraw.draw_ps, (nside, Freq, FileName, FoldName),
+                           npix)
+
+    return results
+
+
+def save_results(results, FileName, seed=0):
+    """
+    Save the results with the information of the machine into json.
+    """
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+            'seed': seed,
+        },
+        'results': results,
+    }
+    with open(FileName, 'w') as fp:
+        json.dump(report, fp, indent=2)
+
+
+def load_results(FileName):
+    """
+    Load the results from the json file.
+    """
+    with open(FileName) as fp:
+        report = json.load(fp)
+
+    return report['results']
+
+
+def compare_results(OldName, NewName, threshold=0.1):
+    """
+    Compare two results files, the entries whose wall time or peak memory
+    grows by more than threshold are flagged as regressions.
+
+    return
+    ------
+    rows: list of dict
+        The matched entries, with 'speedup', 'mem_ratio' and 'regression'.
+    """
+    def key(entry):
+        return (entry['name'], entry['ClassType'], entry['NumPS'],
+                entry['nside'])
+
+    old = {key(entry): entry for entry in load_results(OldName)}
+    rows = []
+    for entry in load_results(NewName):
+        if key(entry) not in old:
+            continue
+        ref = old[key(entry)]
+        if 'error' in entry or 'error' in ref:
+            continue
+        row = {'name': entry['name'], 'ClassType': entry['ClassType'],
+               'NumPS': entry['NumPS'], 'nside': entry['nside'],
+               'speedup': ref['wall (s)'] / entry['wall (s)'],
+               'mem_ratio': None, 'regression': False}
+        if entry['wall (s)'] > ref['wall (s)'] * (1 + threshold):
+            row['regression'] = True
+        if entry['peak_mem (B)'] and ref['peak_mem (B)']:
+            row['mem_ratio'] = entry['peak_mem (B)'] / ref['peak_mem (B)']
+            if row['mem_ratio'] > 1 + threshold:
+                row['regression'] = True
+        rows.append(row)
+
+    return rows
+
+
+# Budget of the cold import time of the modules, [s], the heavy
+# dependencies are imported on their first use, see psLazy
+IMPORT_BUDGET = {'sim21ps': 0.05, 'sim21ps.psCatelogue': 0.3,
+                 'sim21ps.psDraw': 0.3, 'sim21ps.psBatch': 0.3}
+
+
+def bench_import(modules=None, repeat=5):
+    """
+    Measure the cold import time of the modules, each in a fresh
+    interpreter, and the best of repeat is kept.
+
+    return
+    ------
+    results: list of dict, {'module', 'time', 'budget', 'over'}
+    """
+    if modules is None:
+        modules = list(IMPORT_BUDGET.keys())
+    code = ("import time; tic = time.perf_counter(); import %s; "
+            "print(time.perf_counter() - tic)")
+    results = []
+    for name in modules:
+        times = []
+        for i in range(repeat):
+            out = subprocess.check_output([sys.executable, '-c', code % name])
+            times.append(float(out.decode().split()[-1]))
+        budget = IMPORT_BUDGET.get(name)
+        results.append({'module': name, 'time': min(times),
+                        'budget': budget,
+                        'over': budget is not None and min(times) > budget})
+
+    return results
+
+
+def _resume_job(job, OutName, CkptName, ClassType, NumPS, nside, seed):
+    """
+    The job of check_resume, run in a fresh interpreter, saving the table
+    of the catelogue or the map in OutName.
+    """
+    checkpoint = psCheckpoint.Checkpoint(CkptName, every=1)
+    np.random.seed(seed)
+    if job == 'catelogue':
+        with tempfile.TemporaryDirectory() as FoldName:
+            PS_cat = ClassGen[ClassType]().save_table(
+                NumPS, FoldName, ClassList[ClassType - 1], checkpoint,
+                batch=max(NumPS // 100, 1))
+        result = PS_cat.block
+    else:
+        PS_data = gen_synthetic(ClassType, NumPS, seed)
+        result = psDraw.draw_chunked(nside, PS_data, ClassType, 150e6,
+                                     chunk=max(NumPS // 100, 1),
+                                     checkpoint=checkpoint)
+    np.save(OutName, result)
+
+
+def check_resume(ClassType=4, NumPS=100000, nside=256, seed=0):
+    """
+    Run the catelogue generation and the map drawing with checkpoints,
+    each uninterrupted, and killed once its first checkpoint is saved
+    and then resumed, in fresh interpreters, and compare the results.
+
+    return
+    ------
+    results: list of dict, {'job', 'offset', 'identical'}
+        offset is the number of sources done when killed.
+    """
+    code = ("import sys; from sim21ps import psBench; "
+            "psBench._resume_job(*sys.argv[1:4], *map(int, sys.argv[4:]))")
+    results = []
+    with tempfile.TemporaryDirectory() as TmpFold:
+        for job in ('catelogue', 'draw'):
+            names = [os.path.join(TmpFold, job + name)
+                     for name in ('_full.npy', '_resumed.npy', '.ckpt.npz')]
+
+            def command(OutName):
+                return [sys.executable, '-c', code, job, OutName, names[2],
+                        str(ClassType), str(NumPS), str(nside), str(seed)]
+
+            subprocess.check_call(command(names[0]))
+            proc = subprocess.Popen(command(names[1]))
+            while not os.path.exists(names[2]) and proc.poll() is None:
+                time.sleep(0.005)
+            proc.kill()
+            proc.wait()
+            if not os.path.exists(names[2]):
+                raise RuntimeError("The %s job finished before it was "
+                                   "killed, increase NumPS" % job)
+            with np.load(names[2]) as data:
+                offset = int(data['offset'])
+            subprocess.check_call(command(names[1]))
+            results.append({'job': job, 'offset': offset,
+                            'identical': np.array_equal(
+                                np.load(names[0]), np.load(names[1]))})
+
+    return results
+
+
+def _parse_ints(Str):
+    return [int(float(item)) for item in Str.split(',') if item != '']
+
+
+def main(argv):
+    """
+    A main function for use this module at the command window
+
+    example
+    -------
+    psBench -n 1e3,1e4 -s 64,256 -c 1,3,4 -o bench.json
+    psBench -C old.json new.json
+    psBench -I
+    psBench -R -c 4 -n 1e5 -s 256
+    """
+    usage = ("psBench -n <numbers of ps> -s <nsides> -c <class types> "
+             "-f <frequency> -r <repeat> -o <Output json>\n"
+             "psBench -C <Old json> <New json> -t <threshold>\n"
+             "psBench -I\n"
+             "psBench -R -c <class type> -n <number of ps> -s <nside>")
+    try:
+        opts, args = getopt.getopt(
+            argv, "hn:s:c:f:r:o:Ct:IR",
+            ["num=", "nside=", "classes=", "freq=", "repeat=",
+             "outfile=", "compare", "threshold=", "seed=", "no-memory",
+             "imports", "resume"])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    # Default
+    NumList = [1000, 10000, 100000, 1000000]
+    nsides = [64, 256, 1024, 2048]
+    classes = [1, 2, 3, 4, 5]
+    Freq = 150e6
+    repeat = 1
+    OutName = 'bench_' + time.strftime('%Y%m%d_%H%M%S') + '.json'
+    compare = False
+    imports = False
+    resume = False
+    threshold = 0.1
+    seed = 0
+    memory = True
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-n", "--num"):
+            NumList = _parse_ints(arg)
+        elif opt in ("-s", "--nside"):
+            nsides = _parse_ints(arg)
+        elif opt in ("-c", "--classes"):
+            classes = _parse_ints(arg)
+        elif opt in ("-f", "--freq"):
+            Freq = float(arg)
+        elif opt in ("-r", "--repeat"):
+            repeat = int(arg)
+        elif opt in ("-o", "--outfile"):
+            OutName = arg
+        elif opt in ("-C", "--compare"):
+            compare = True
+        elif opt in ("-I", "--imports"):
+            imports = True
+        elif opt in ("-R", "--resume"):
+            resume = True
+        elif opt in ("-t", "--threshold"):
+            threshold = float(arg)
+        elif opt == "--seed":
+            seed = int(arg)
+        elif opt == "--no-memory":
+            memory = False
+
+    if imports:
+        rows = bench_import()
+        for row in rows:
+            print("%-24s %8.3f s budget %s %s" % (
+                row['module'], row['time'],
+                '-' if row['budget'] is None else '%.3f s' % row['budget'],
+                'OVER BUDGET' if row['over'] else ''))
+        sys.exit(1 if any(row['over'] for row in rows) else 0)
+
+    if resume:
+        rows = check_resume(classes[0], NumList[0], nsides[0], seed)
+        for row in rows:
+            print("%-10s killed at %8d %s" % (
+                row['job'], row['offset'],
+                'identical' if row['identical'] else 'DIFFERENT'))
+        sys.exit(0 if all(row['identical'] for row in rows) else 1)
+
+    if compare:
+        if len(args) != 2:
+            print(usage)
+            sys.exit(2)
+        rows = compare_results(args[0], args[1], threshold)
+        NumReg = 0
+        for row in rows:
+            flag = 'REGRESSION' if row['regression'] else ''
+            print("%-12s %-4s %8d %6s speedup %6.2f mem %s %s" % (
+                row['name'], ClassList[row['ClassType'] - 1], row['NumPS'],
+                row['nside'], row['speedup'],
+                '-' if row['mem_ratio'] is None else
+                '%.2f' % row['mem_ratio'], flag))
+            NumReg += row['regression']
+        print("%d regressions in %d entries" % (NumReg, len(rows)))
+        sys.exit(1 if NumReg > 0 else 0)
+
+    results = run_suite(NumList, nsides, classes, Freq, seed, repeat, memory)
+    save_results(results, OutName, seed)
+    print("Saved the results to %s" % OutName)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
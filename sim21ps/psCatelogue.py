@@ -28,10 +28,15 @@ import os
 # import healpy as hp  # healpy
 import numpy as np
 import time
-from pandas import DataFrame
-import astropy.units as au
 # Custom module
-import basic_params
+from . import psProfile
+from . import psProgress
+from . import psTable
+from .psLazy import LazyModule
+# The heavy modules are imported on the first use
+au = LazyModule('astropy.units')
+basic_params = LazyModule('.basic_params', __package__)
+psMemory = LazyModule('.psMemory', __package__)
 
 # Defination of classes
 class PointSource:
@@ -56,15 +61,17 @@ class PointSource:
     ---------
     gen_sgl_ps
         Generate single ps
+    gen_batch
+        Generate a batch of ps at once, vectorized
     save_as_csv
 
     """
-    # Init
+    # Init, the units are assigned in __init__ and gen_sgl_ps
     z = 0
-    dA = 0 * au.Mpc * 0
-    theta = au.deg * 0
-    phi = au.deg * 0
-    area = au.sr * 0
+    dA = 0
+    theta = 0
+    phi = 0
+    area = 0
     Columns = []
     nCols = 0
 
@@ -75,7 +82,7 @@ class PointSource:
         self.Param = basic_params.PixelParams( self.z)
         self.dA = self.Param.dA
         # Area
-        self.area = 4*np.pi/(12*nside**2)
+        self.area = 4*np.pi/(12*nside**2) * au.sr
         # PS_list information
         self.Columns = ['z', 'dA (Mpc)', 'Theta (deg)',
                         'Phi (deg)', 'Area (sr)']
@@ -99,27 +106,133 @@ class PointSource:
             [self.z, self.dA.value, self.theta.value, self.phi.value, self.area.value])
         return PS_list
 
-    def save_as_csv(self, NumPS=100, folder_name='PS_tables/'):
+    def gen_position(self, NumPS):
+        """
+        Generate the redshifts and positions of NumPS point sources.
+
+        return
+        ------
+        z, Param, theta, phi: the Param is basic_params.PixelParams of z
+        """
+        z = np.random.uniform(0, 20, NumPS)
+        Param = basic_params.PixelParams(z)
+        theta = np.random.uniform(0, np.pi, NumPS) * 180
+        phi = np.random.uniform(0, np.pi * 2, NumPS) * 180
+
+        return z, Param, theta, phi
+
+    def gen_batch(self, NumPS):
+        """
+        Generate NumPS of point sources at once, and return their data as
+        a (NumPS, nCols) array, the rows are as gen_sgl_ps. The instance
+        is not changed.
+        """
+        z, Param, theta, phi = self.gen_position(NumPS)
+        area = np.full(NumPS, self.area.value)
+
+        return np.column_stack([z, Param.dA.value, theta, phi, area])
+
+    def save_as_csv(self, NumPS=100, folder_name='PS_tables/', checkpoint=None,
+                    StartID=0, batch=None, max_memory=None):
         """
         Generae NumPS of point sources and save them into a csv file.
         """
-        # Init
-        PS_Table = np.zeros((NumPS, self.nCols))
-        for x in range(NumPS):
-            PS_Table[x, :] = self.gen_sgl_ps()
+        return self.save_table(NumPS, folder_name, 'PS', checkpoint,
+                               StartID, batch, max_memory)
 
-        # Transform into Dataframe
-        PS_frame = DataFrame(PS_Table, columns=self.Columns,
-                             index=list(range(NumPS)))
+    def save_table(self, NumPS, folder_name, prefix, checkpoint=None,
+                   StartID=0, batch=None, max_memory=None):
+        """
+        Generate NumPS of point sources, and save them into the csv file
+        named as prefix_NumPS_YYYYMMDD_HHMMSS.csv in folder_name.
+
+        The sources are labeled by the stable IDs from StartID, which is
+        the index of the csv, and their reference flux at 151MHz is saved
+        as 'I_151 (Jy)', so that the fluxes are reproducible.
+
+        If batch is provided, the sources are generated by gen_batch in
+        batches of this number, which is much faster, but the sources
+        differ from the ones generated one by one with the same seed.
+
+        If checkpoint (psCheckpoint.Checkpoint) is provided, the rows
+        generated and the state of np.random are saved every 1000 rows
+        (or every batch), and the generation is resumed from the
+        checkpoint if exists. Only the rows generated since the last
+        save are written into the checkpoint.
+
+        If max_memory (e.g. '4G') is provided, the table and the batch are
+        checked to fit in the budget before the generation by
+        psMemory.plan_catelogue, which raises MemoryError otherwise.
+
+        return
+        ------
+        PS_cat: psTable.Catelogue
+        """
+        if max_memory is not None:
+            psMemory.plan_catelogue(self, NumPS, max_memory, batch)
+        # Init
+        PS_Table = np.zeros((NumPS, self.nCols + 1))
+        offset = 0
+        key = {'job': 'catelogue', 'prefix': prefix, 'NumPS': NumPS,
+               'Columns': self.Columns}
+        if batch is not None:
+            key['batch'] = batch
+        if checkpoint is not None:
+            state = checkpoint.load(key)
+            if state is not None:
+                offset = state['offset']
+                PS_Table[:offset, :] = state['PS_Table']
+        psProgress.start(NumPS - offset, 'catelogue ' + prefix)
+        with psProfile.stage('gen_catelogue'):
+            if batch is not None:
+                for x in range(offset, NumPS, batch):
+                    stop = min(x + batch, NumPS)
+                    PS_Table[x:stop, :-1] = self.gen_batch(stop - x)
+                    PS_Table[x:stop, -1] = 10**(
+                        np.random.uniform(-4, -3, stop - x))
+                    psProgress.update(stop - x)
+                    if checkpoint is not None:
+                        checkpoint.update(
+                            key, stop, rows={'PS_Table': PS_Table[:stop, :]})
+            else:
+                for x in range(offset, NumPS):
+                    PS_Table[x, :-1] = self.gen_sgl_ps()
+                    # reference flux at 151MHz, see Willman et al's work
+                    PS_Table[x, -1] = 10**(np.random.uniform(-4, -3))
+                    if x % 100 == 99:
+                        psProgress.update(100)
+                    if checkpoint is not None and x % 1000 == 999:
+                        checkpoint.update(
+                            key, x + 1,
+                            rows={'PS_Table': PS_Table[:x + 1, :]})
+                psProgress.update((NumPS - offset) % 100)
+        psProgress.finish()
+        psProfile.count('sources_generated', NumPS)
+
+        # Transform into the columnar catelogue
+        ClassType = None
+        if prefix in psTable.ClassList:
+            ClassType = psTable.ClassList.index(prefix) + 1
+        PS_cat = psTable.Catelogue(self.Columns + ['I_151 (Jy)'],
+                                   np.ascontiguousarray(PS_Table.T),
+                                   ids=np.arange(StartID, StartID + NumPS),
+                                   ClassType=ClassType)
 
         # Save to csv
         if os.path.exists(folder_name) == False:
             os.mkdir(folder_name)
 
-        file_name = 'PS_' + str(NumPS) + '_' + \
+        file_name = prefix + '_' + str(NumPS) + '_' + \
             time.strftime('%Y%m%d_%H%M%S') + '.csv'
-        PS_frame.to_csv(folder_name + '/' + file_name)
-        return PS_frame
+        with psProfile.stage('write_csv'):
+            PS_cat.to_csv(folder_name + '/' + file_name)
+        if psProfile.enabled():
+            psProfile.count('bytes_written',
+                            os.path.getsize(folder_name + '/' + file_name))
+        if checkpoint is not None:
+            checkpoint.remove()
+
+        return PS_cat
 
 
 class StarForming(PointSource):
@@ -127,7 +240,7 @@ class StarForming(PointSource):
     Generate star forming point sources, inheritate from PointSource class.
     """
     # Init
-    radius = 0 * au.rad
+    radius = 0
     Lumo_1400 = 0
 
     def __init__(self, nside = 512,Lumo_1400=1500):
@@ -136,7 +249,14 @@ class StarForming(PointSource):
         self.Columns.append('radius (rad)')
         self.nCols += 1
 
-    def get_radius(self):
+    def get_radius(self, z=None):
+        """
+        The radius at the redshift of the source, or at z if provided,
+        which may be an array, and then self.radius is not changed.
+        """
+        if z is not None:
+            Temp = 0.22 * np.log10(self.Lumo_1400) - np.log10(1 + z) - 3.32
+            return 10 ** Temp / 2 * au.Mpc
         Temp = 0.22 * np.log10(self.Lumo_1400) - np.log10(1 + self.z) - 3.32
         self.radius = 10 ** Temp / 2 * au.Mpc
 
@@ -163,27 +283,24 @@ class StarForming(PointSource):
             [self.z, self.dA.value, self.theta.value, self.phi.value, self.area.value, self.radius.value])
         return PS_list
 
-    def save_as_csv(self, NumPS=100, folder_name='PS_tables'):
+    def gen_batch(self, NumPS):
         """
-        Generae NumPS of point sources and save them into a csv file.
+        Generate NumPS of point sources at once, the rows are as
+        gen_sgl_ps.
         """
-        # Init
-        PS_Table = np.zeros((NumPS, self.nCols))
-        for x in range(NumPS):
-            PS_Table[x, :] = self.gen_sgl_ps()
+        z, Param, theta, phi = self.gen_position(NumPS)
+        radius = Param.get_angle(self.get_radius(z)).value  # [rad]
+        area = np.pi * radius**2
 
-        # Transform into Dataframe
-        PS_frame = DataFrame(PS_Table, columns=self.Columns,
-                             index=list(range(NumPS)))
-
-        # Save to csv
-        if os.path.exists(folder_name) == False:
-            os.mkdir(folder_name)
+        return np.column_stack([z, Param.dA.value, theta, phi, area, radius])
 
-        file_name = 'SF_' + str(NumPS) + '_' + \
-            time.strftime('%Y%m%d_%H%M%S') + '.csv'
-        PS_frame.to_csv(folder_name + '/' + file_name)
-        return PS_frame
+    def save_as_csv(self, NumPS=100, folder_name='PS_tables', checkpoint=None,
+                    StartID=0, batch=None, max_memory=None):
+        """
+        Generae NumPS of point sources and save them into a csv file.
+        """
+        return self.save_table(NumPS, folder_name, 'SF', checkpoint,
+                               StartID, batch, max_memory)
 
 
 class StarBursting(PointSource):
@@ -198,7 +315,13 @@ class StarBursting(PointSource):
         self.Columns.append('radius (rad)')
         self.nCols += 1
 
-    def get_radius(self):
+    def get_radius(self, z=None):
+        """
+        The radius at the redshift of the source, or at z if provided,
+        which may be an array, and then self.radius is not changed.
+        """
+        if z is not None:
+            return np.where(z <= 1.5, (1 + z)**2.5 * 1e-3, 10 * 1e-3)
         if self.z <= 1.5:
             self.radius = (1 + self.z)**2.5 * 1e-3
         else:
@@ -227,28 +350,24 @@ class StarBursting(PointSource):
             [self.z, self.dA.value, self.theta.value, self.phi.value, self.area.value, self.radius.value])
         return PS_list
 
-    def save_as_csv(self, NumPS=100, folder_name='PS_tables'):
+    def gen_batch(self, NumPS):
         """
-        Generae NumPS of point sources and save them into a csv file.
+        Generate NumPS of point sources at once, the rows are as
+        gen_sgl_ps.
         """
-        # Init
-        PS_Table = np.zeros((NumPS, self.nCols))
-        for x in range(NumPS):
-            PS_Table[x, :] = self.gen_sgl_ps()
+        z, Param, theta, phi = self.gen_position(NumPS)
+        radius = Param.get_angle(self.get_radius(z)).value
+        area = np.pi * radius**2
 
-        # Transform into Dataframe
-        PS_frame = DataFrame(PS_Table, columns=self.Columns,
-                             index=list(range(NumPS)))
+        return np.column_stack([z, Param.dA.value, theta, phi, area, radius])
 
-        # Save to csv
-        if os.path.exists(folder_name) == False:
-            os.mkdir(folder_name)
-
-        file_name = 'SB_' + str(NumPS) + '_' + \
-            time.strftime('%Y%m%d_%H%M%S') + '.csv'
-        PS_frame.to_csv(folder_name + '/' + file_name)
-
-        return PS_frame
+    def save_as_csv(self, NumPS=100, folder_name='PS_tables', checkpoint=None,
+                    StartID=0, batch=None, max_memory=None):
+        """
+        Generae NumPS of point sources and save them into a csv file.
+        """
+        return self.save_table(NumPS, folder_name, 'SB', checkpoint,
+                               StartID, batch, max_memory)
 
 
 class FRI(PointSource):
@@ -266,9 +385,11 @@ class FRI(PointSource):
 
     """
     # New parameters
-    lobe_maj = 0 * au.rad
-    lobe_min = 0 * au.rad
-    lobe_ang = 0 * au.deg
+    lobe_maj = 0
+    lobe_min = 0
+    lobe_ang = 0
+    # Upper limit of the rotation angle, [rad]
+    lobe_ang_max = np.pi
 
     def __init__(self,nside=512):
         PointSource.__init__(self, nside)
@@ -307,40 +428,43 @@ class FRI(PointSource):
         self.theta = np.random.uniform(0,np.pi) * 180 * au.deg
         self.phi = np.random.uniform(0,np.pi*2) * 180 * au.deg
 
-        # Area
-        self.area = np.pi * self.lobe_maj * self.lobe_min
-
         # lobe
         lobe = self.gen_lobe()
 
+        # Area
+        self.area = np.pi * self.lobe_maj * self.lobe_min
+
         PS_list = [self.z, self.dA.value, self.theta.value, self.phi.value, self.area.value]
         PS_list.extend(lobe)
 
         PS_list = np.array(PS_list)
         return PS_list
 
-    def save_as_csv(self, NumPS=100, folder_name='PS_tables'):
+    def gen_batch(self, NumPS):
+        """
+        Generate NumPS of point sources at once, the rows are as
+        gen_sgl_ps.
+        """
+        z, Param, theta, phi = self.gen_position(NumPS)
+        # lobe, see gen_lobe
+        D0 = 1
+        lobe_maj = 0.5 * np.random.uniform(0, D0 * (1 + z)**(-1.4))
+        lobe_min = lobe_maj * np.random.uniform(0.2, 1, NumPS)
+        lobe_ang = np.random.uniform(0, self.lobe_ang_max, NumPS) * 180
+        lobe_maj = Param.get_angle(lobe_maj * au.Mpc).value
+        lobe_min = Param.get_angle(lobe_min * au.Mpc).value
+        area = np.pi * lobe_maj * lobe_min
+
+        return np.column_stack([z, Param.dA.value, theta, phi, area,
+                                lobe_maj, lobe_min, lobe_ang])
+
+    def save_as_csv(self, NumPS=100, folder_name='PS_tables', checkpoint=None,
+                    StartID=0, batch=None, max_memory=None):
         """
         Generae NumPS of point sources and save them into a csv file.
         """
-        # Init
-        PS_Table = np.zeros((NumPS, self.nCols))
-        for x in range(NumPS):
-            PS_Table[x, :] = self.gen_sgl_ps()
-
-        # Transform into Dataframe
-        PS_frame = DataFrame(PS_Table, columns=self.Columns,
-                             index=list(range(NumPS)))
-
-        # Save to csv
-        if os.path.exists(folder_name) == False:
-            os.mkdir(folder_name)
-
-        file_name = 'FRI_' + str(NumPS) + '_' + \
-            time.strftime('%Y%m%d_%H%M%S') + '.csv'
-        PS_frame.to_csv(folder_name + '/' + file_name)
-
-        return PS_frame
+        return self.save_table(NumPS, folder_name, 'FRI', checkpoint,
+                               StartID, batch, max_memory)
 
 
 class FRII(FRI):
@@ -348,6 +472,9 @@ class FRII(FRI):
     Generate Faranoff-Riley I (FRI) AGN, a class inherit from FRI
     """
 
+    # Upper limit of the rotation angle, [rad], different from FRI
+    lobe_ang_max = np.pi / 3
+
     def __init__(self,nside = 512):
         FRI.__init__(self,nside)
 
@@ -366,3 +493,12 @@ class FRII(FRI):
         lobe = [self.lobe_maj.value, self.lobe_min.value, self.lobe_ang.value]
 
         return lobe
+
+    def save_as_csv(self, NumPS=100, folder_name='PS_tables', checkpoint=None,
+                    StartID=0, batch=None, max_memory=None):
+        """
+        Generae NumPS of point sources and save them into a csv file,
+        named with the prefix 'FRII' to be drawn with the hotspots.
+        """
+        return self.save_table(NumPS, folder_name, 'FRII', checkpoint,
+                               StartID, batch, max_memory)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psCheckpoint is designed to save the progress of the
+long catelogue generation and map drawing periodically, i.e. the partial
+table or map, the offset of the next source and the state of np.random,
+so that an interrupted job can be resumed from the last checkpoint and
+give the same result as an uninterrupted one. The growing arrays, e.g.
+the rows of a table, are saved as rows, where only the rows added since
+the last save are written into a block file beside the checkpoint.
+
+Classes
+-------
+Checkpoint: class
+    Save and load the checkpoint file in npz.
+
+example
+-------
+>>> ckpt = psCheckpoint.Checkpoint('SF_512.ckpt.npz', every=10)
+>>> pix_vec = psDraw.draw_ps(512, 150e6, 'SF_100_20161009_205700.csv',
+...                          checkpoint=ckpt)
+"""
+
+# Modules
+import os
+import glob
+import json
+import time
+import numpy as np
+
+
+class Checkpoint:
+    """
+    The checkpoint of a job, identified by its key, which is a json
+    serializable dict, e.g. the catelogue, nside and frequency. A
+    checkpoint of another job is refused to be resumed.
+
+    Parameters
+    ----------
+    FileName: str
+        Name of the checkpoint file, in npz.
+    every: int
+        Save every this number of updates, i.e. chunks.
+    interval: float
+        Also save if this number of seconds passed since the last save,
+        default as None.
+    """
+
+    def __init__(self, FileName, every=10, interval=None):
+        self.FileName = FileName
+        self.every = every
+        self.interval = interval
+        self.NumUpdate = 0
+        self.last = time.monotonic()
+        # The numbers of the rows in the saved blocks, {name: [int]}
+        self._blocks = {}
+
+    def _block_name(self, name, i):
+        return '%s.%s.%d.npy' % (self.FileName, name, i)
+
+    def load(self, key):
+        """
+        Load the checkpoint of the job, and restore the state of
+        np.random.
+
+        return
+        ------
+        state: dict or None
+            The arrays saved, and 'offset', None if no checkpoint.
+        """
+        if os.path.exists(self.FileName) == False:
+            return None
+        with np.load(self.FileName, allow_pickle=False) as data:
+            state = {name: data[name] for name in data.files}
+        saved_key = json.loads(str(state.pop('key')))
+        if saved_key != json.loads(json.dumps(key)):
+            raise ValueError("Checkpoint %s is of another job: %s" %
+                             (self.FileName, saved_key))
+        np.random.set_state(('MT19937', state.pop('rng_keys'),
+                             int(state.pop('rng_pos')),
+                             int(state.pop('rng_has_gauss')),
+                             float(state.pop('rng_gauss'))))
+        state['offset'] = int(state['offset'])
+        for name in [name for name in state if name.startswith('rows_')]:
+            lengths = state.pop(name).tolist()
+            name = name[len('rows_'):]
+            self._blocks[name] = lengths
+            state[name] = np.concatenate(
+                [np.load(self._block_name(name, i))
+                 for i in range(len(lengths))])
+
+        return state
+
+    def save(self, key, offset, rows=None, **arrays):
+        """
+        Save the arrays, the offset and the state of np.random, the file
+        is replaced atomically. rows, {name: array}, are the arrays
+        growing along the first axis, of which only the rows not saved
+        yet are written, and which are loaded concatenated.
+        """
+        for name, array in ({} if rows is None else rows).items():
+            lengths = self._blocks.setdefault(name, [])
+            NumSaved = sum(lengths)
+            if array.shape[0] > NumSaved:
+                BlockName = self._block_name(name, len(lengths))
+                with open(BlockName + '.tmp', 'wb') as fp:
+                    np.save(fp, array[NumSaved:])
+                os.replace(BlockName + '.tmp', BlockName)
+                lengths.append(array.shape[0] - NumSaved)
+            arrays['rows_' + name] = np.array(lengths, dtype=np.int64)
+        name, keys, pos, has_gauss, gauss = np.random.get_state()
+        TmpName = self.FileName + '.tmp'
+        with open(TmpName, 'wb') as fp:
+            np.savez(fp, key=json.dumps(key), offset=offset,
+                     rng_keys=keys, rng_pos=pos, rng_has_gauss=has_gauss,
+                     rng_gauss=gauss, **arrays)
+        os.replace(TmpName, self.FileName)
+        self.last = time.monotonic()
+
+    def update(self, key, offset, rows=None, **arrays):
+        """
+        Called after each chunk, and save if it is due.
+        """
+        self.NumUpdate += 1
+        due = self.NumUpdate % self.every == 0
+        if self.interval is not None:
+            due = due or time.monotonic() - self.last >= self.interval
+        if due:
+            self.save(key, offset, rows, **arrays)
+
+    def remove(self):
+        """
+        Remove the checkpoint after the job is done.
+        """
+        if os.path.exists(self.FileName):
+            os.remove(self.FileName)
+        for BlockName in glob.glob(glob.escape(self.FileName) + '.*.npy'):
+            os.remove(BlockName)
+        self._blocks.clear()
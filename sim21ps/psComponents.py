@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psComponents is designed to describe the point
+sources as the components, e.g. the point core, the elliptical lobes and
+the hotspots, each with its geometry and spectrum. Each class declares
+its components in ClassComponents as (name, kernel), where the name is
+the component of the spectrum in psSpec.SpecModels, and the kernel is
+the type of the geometry in Kernels, which samples the component of all
+the sources of a batch at once.
+
+A new type of component, e.g. the jets, is added by registering its
+kernel and declaring it in the classes, together with its spectrum in
+psSpec.SpecModels, without another loop over the sources.
+
+Functions
+---------
+ang2pix: hp.ang2pix of the samples, wrapped over the poles.
+
+register_kernel: add a kernel of a component type.
+
+get_components: the components of a class.
+
+footprint: the samples of the components of the sources.
+
+sample_counts: the number of the samples of the components, without
+the pixels.
+
+example
+-------
+>>> def jets(nside, PS_data, nest=False):
+...     return pix, idx  # the pixels of the samples and their sources
+>>> psComponents.register_kernel('jets', jets)
+>>> psComponents.ClassComponents[5].append(('jet', 'jets'))
+>>> psSpec.SpecModels[5].append(('jet', (-0.6, 0.1), (0.0, 0.0)))
+"""
+
+# Modules
+import numpy as np
+# Cumstom designed modules
+from . import psProfile
+from .psLazy import LazyModule
+# The heavy modules are imported on the first use
+hp = LazyModule('healpy')
+
+
+def ang2pix(nside, theta, phi, nest=False):
+    """
+    hp.ang2pix, timed and counted by psProfile. The samples beyond the
+    poles, i.e. theta out of [0, pi], are wrapped to the other side.
+    """
+    with psProfile.stage('ang2pix'):
+        beyond = (theta < 0) | (theta > np.pi)
+        if np.any(beyond):
+            theta = np.where(theta < 0, -theta, theta)
+            theta = np.where(theta > np.pi, 2 * np.pi - theta, theta)
+            phi = np.where(beyond, phi + np.pi, phi)
+        pix = hp.ang2pix(nside, theta, phi, nest=nest)
+    psProfile.count('samples', len(pix))
+
+    return pix
+
+
+def kernel_point(nside, PS_data, nest=False):
+    """
+    The point at the center of the sources, e.g. the core.
+    """
+    theta = PS_data['Theta (deg)']
+    phi = PS_data['Phi (deg)']
+    pix = ang2pix(nside, theta / 180, phi / 180, nest=nest)
+
+    return pix, np.arange(len(pix))
+
+
+def _disk_grid(PS_data):
+    """
+    The grid of the disks, x (NumPS, 22), and the samples inside the
+    circles, inside (NumPS, 22, 22).
+    """
+    radius = PS_data['radius (rad)']
+    # Grid, the same as np.arange(-radius, radius + step, step)
+    step = radius / 10
+    k = np.arange(22)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        num_x = np.ceil((2 * radius + step) / step)
+    delta = (-radius + step) + radius
+    x = -radius[:, np.newaxis] + k * delta[:, np.newaxis]
+    valid = k[np.newaxis, :] < num_x[:, np.newaxis]
+    inside = (valid[:, :, np.newaxis] & valid[:, np.newaxis, :] &
+              (np.sqrt(x[:, :, np.newaxis]**2 + x[:, np.newaxis, :]**2) <=
+               radius[:, np.newaxis, np.newaxis]))
+
+    return x, inside
+
+
+def kernel_disk(nside, PS_data, nest=False):
+    """
+    The circular star forming and star bursting sources.
+
+    Each source is sampled on the grid of step radius / 10, and the
+    samples inside the circle are kept.
+    """
+    theta = PS_data['Theta (deg)']
+    phi = PS_data['Phi (deg)']
+    x, inside = _disk_grid(PS_data)
+    idx, p, q = np.nonzero(inside)
+    # x and y are the differencial angles to the core point at the theta
+    # and phi directions, [deg]
+    x_ang = x[idx, p] * 180 / np.pi + theta[idx]
+    y_ang = x[idx, q] * 180 / np.pi + phi[idx]
+    pix = ang2pix(nside, x_ang / 180, y_ang / 180, nest=nest)
+
+    return pix, idx
+
+
+def _lobe_centers(PS_data, scale=1):
+    """
+    The points at scale * lobe_maj from the core along lobe_ang, on both
+    sides, i.e. the centers of the lobes if scale is 1, and their tips
+    if scale is 2, in the units of the columns 'Theta (deg)'.
+    """
+    theta = PS_data['Theta (deg)']
+    phi = PS_data['Phi (deg)']
+    lobe_maj = PS_data['lobe_maj (rad)']
+    lobe_ang = PS_data['lobe_ang (deg)'] / 180
+    centers = []
+    for rot in (0, np.pi):
+        ang = lobe_ang + rot
+        centers.append((theta + scale * lobe_maj * np.cos(ang) * 180 / np.pi,
+                        phi + scale * lobe_maj * np.sin(ang) * 180 / np.pi,
+                        ang))
+
+    return centers
+
+
+def _lobe_grid(PS_data):
+    """
+    The grids of the lobes along the major and minor axes, x and y
+    (NumPS, 22), and the samples inside the ellipses, inside
+    (NumPS, 22, 22).
+    """
+    lobe_maj = PS_data['lobe_maj (rad)']
+    lobe_min = PS_data['lobe_min (rad)']
+    # Grid, the same as np.arange(-lobe_maj, lobe_maj + step, step)
+    step = lobe_maj / 10
+    k = np.arange(22)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        num_x = np.ceil((2 * lobe_maj + step) / step)
+        num_y = np.ceil((2 * lobe_min + step) / step)
+    delta_x = (-lobe_maj + step) + lobe_maj
+    delta_y = (-lobe_min + step) + lobe_min
+    x = -lobe_maj[:, np.newaxis] + k * delta_x[:, np.newaxis]
+    y = -lobe_min[:, np.newaxis] + k * delta_y[:, np.newaxis]
+    # Focuses
+    lobe_c = np.sqrt(lobe_maj**2 - lobe_min**2)[:, np.newaxis, np.newaxis]
+    X = x[:, :, np.newaxis]
+    Y = y[:, np.newaxis, :]
+    DistFocus1 = np.sqrt((X - lobe_c)**2 + Y**2)
+    DistFocus2 = np.sqrt((X + lobe_c)**2 + Y**2)
+    inside = ((k[np.newaxis, :, np.newaxis] < num_x[:, np.newaxis, np.newaxis]) &
+              (k[np.newaxis, np.newaxis, :] < num_y[:, np.newaxis, np.newaxis]) &
+              (DistFocus1 + DistFocus2 <= 2 * lobe_maj[:, np.newaxis, np.newaxis]))
+
+    return x, y, inside
+
+
+def kernel_lobes(nside, PS_data, nest=False):
+    """
+    The two elliptical lobes of FRI and FRII.
+
+    Each lobe is sampled on the grid of step lobe_maj / 10 along both
+    axes, and the samples inside the ellipse are rotated by lobe_ang.
+    """
+    x, y, inside = _lobe_grid(PS_data)
+    src, p, q = np.nonzero(inside)
+    x_ang = x[src, p] * 180 / np.pi
+    y_ang = y[src, q] * 180 / np.pi
+    # Lobe1 and Lobe2
+    pix_list = []
+    for cen_theta, cen_phi, ang in _lobe_centers(PS_data):
+        ang = ang[src]
+        x_r = x_ang * np.cos(ang) - y_ang * np.sin(ang)
+        y_r = x_ang * np.sin(ang) + y_ang * np.cos(ang)
+        pix_list.append(ang2pix(nside, (cen_theta[src] + x_r) / 180,
+                                (cen_phi[src] + y_r) / 180, nest=nest))
+
+    return np.concatenate(pix_list), np.concatenate([src, src])
+
+
+def kernel_hotspots(nside, PS_data, nest=False):
+    """
+    The two hotspots of FRII, i.e. the points at the outer tips of the
+    lobes.
+    """
+    pix_list = []
+    for tip_theta, tip_phi, ang in _lobe_centers(PS_data, scale=2):
+        pix_list.append(ang2pix(nside, tip_theta / 180, tip_phi / 180,
+                                nest=nest))
+    idx = np.arange(PS_data.shape[0])
+
+    return np.concatenate(pix_list), np.concatenate([idx, idx])
+
+
+# The kernels of the component types, which return the pixels of the
+# samples and the rows of their sources, (pix, idx)
+Kernels = {'point': kernel_point, 'disk': kernel_disk,
+           'lobes': kernel_lobes, 'hotspots': kernel_hotspots}
+
+
+def count_point(PS_data):
+    return np.ones(PS_data.shape[0], dtype=np.int64)
+
+
+def count_disk(PS_data):
+    return _disk_grid(PS_data)[1].sum(axis=(1, 2))
+
+
+def count_lobes(PS_data):
+    return 2 * _lobe_grid(PS_data)[2].sum(axis=(1, 2))
+
+
+def count_hotspots(PS_data):
+    return np.full(PS_data.shape[0], 2, dtype=np.int64)
+
+
+# The numbers of the samples of the sources of the kernels, (NumPS,),
+# which are the same as the kernels but skip ang2pix
+Counts = {'point': count_point, 'disk': count_disk,
+          'lobes': count_lobes, 'hotspots': count_hotspots}
+
+# The components of the classes, [(name, kernel), ...], whose names are
+# the components of psSpec.SpecModels in the same order
+ClassComponents = {1: [('', 'disk')], 2: [('', 'disk')], 3: [('', 'point')],
+                   4: [('core', 'point'), ('lobe', 'lobes')],
+                   5: [('core', 'point'), ('lobe', 'lobes'),
+                       ('hotspot', 'hotspots')]}
+
+
+def register_kernel(name, kernel, count=None):
+    """
+    Add the kernel of a component type, kernel(nside, PS_data, nest)
+    returns the pixels of the samples and the rows of their sources.
+    count(PS_data) returns the number of the samples of the sources, if
+    not provided, they are counted from the kernel.
+    """
+    Kernels[name] = kernel
+    if count is not None:
+        Counts[name] = count
+    else:
+        Counts.pop(name, None)
+
+
+def get_components(ClassType):
+    """
+    Names of the components of the class.
+    """
+    return [name for name, kernel in ClassComponents[ClassType]]
+
+
+def footprint(nside, PS_data, ClassType, nest=False):
+    """
+    The samples of all the components of the sources, each component is
+    sampled by its kernel for all the sources at once.
+
+    return
+    ------
+    pix, idx, comp: np.ndarray
+        The pixels of the samples, the rows of their sources, and the
+        index of their components in ClassComponents[ClassType]
+    """
+    pix_list = []
+    idx_list = []
+    comp_list = []
+    for c, (name, kernel) in enumerate(ClassComponents[ClassType]):
+        pix, idx = Kernels[kernel](nside, PS_data, nest)
+        pix_list.append(pix)
+        idx_list.append(idx)
+        comp_list.append(np.full(len(pix), c, dtype=np.int8))
+
+    return (np.concatenate(pix_list), np.concatenate(idx_list),
+            np.concatenate(comp_list))
+
+
+def sample_counts(PS_data, ClassType):
+    """
+    The number of the samples of the components of the sources, i.e.
+    the sum of nhit of their footprints, at the cost of the grids only.
+
+    return
+    ------
+    counts: np.ndarray(NumPS, NumComp)
+    """
+    NumPS = PS_data.shape[0]
+    counts = np.zeros((NumPS, len(ClassComponents[ClassType])),
+                      dtype=np.int64)
+    for c, (name, kernel) in enumerate(ClassComponents[ClassType]):
+        if kernel in Counts:
+            counts[:, c] = Counts[kernel](PS_data)
+        else:
+            pix, idx = Kernels[kernel](1, PS_data)
+            counts[:, c] = np.bincount(idx, minlength=NumPS)
+
+    return counts
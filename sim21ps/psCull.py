@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psCull is designed to skip the footprints of the
+faint sources, which are most of the sources of psCatelogue but add a
+nearly smooth background to the map. The sources fainter than the
+threshold at the drawing frequency are not sampled, and their
+brightness times their numbers of samples, i.e. their total in the map,
+is added at their core pixels, so the total of the map is kept.
+
+If nside_faint is coarser than the map, the faint sources are summed in
+the coarse pixels and spread evenly over their sub pixels, as a smooth
+background, which keeps the total and the power at the scales larger
+than the coarse pixels. At the nside of the map, the power of the faint
+sources, i.e. their shot noise, is kept up to the scale of the pixels,
+except the faint sources spanning many pixels.
+
+Classes
+-------
+FluxCut: class
+    The threshold and the totals of the culled sources.
+
+Functions
+---------
+compare: the errors of the total and the power of a culled map.
+
+example
+-------
+>>> cull = psCull.FluxCut(1e-3)
+>>> pix_vec = psDraw.draw_ps(512, 150e6, 'SF_100_spec.csv', cull=cull)
+>>> cull.report()
+"""
+
+# Modules
+import os
+import sys
+import time
+import getopt
+import numpy as np
+# Cumstom designed modules
+from . import psDraw
+from . import psStats
+from . import psComponents
+from . import psProfile
+from . import psProgress
+from .psLazy import LazyModule
+# The heavy modules are imported on the first use
+hp = LazyModule('healpy')
+
+
+class FluxCut:
+    """
+    Cull the sources fainter than the threshold.
+
+    Parameters
+    ----------
+    threshold: float
+        The flux density at the drawing frequency, [Jy], under which the
+        sources are culled
+    nside_faint: int and dyadic
+        nside of the pixels the culled sources are summed in, default as
+        the nside of the map
+
+    Attributes
+    ----------
+    totals: dict
+        The numbers and fluxes of the sources and the culled sources,
+        and the samples skipped
+    """
+
+    def __init__(self, threshold, nside_faint=None):
+        self.threshold = threshold
+        self.nside_faint = nside_faint
+        self.totals = {'NumPS': 0, 'NumCulled': 0, 'flux (Jy)': 0.0,
+                       'flux culled (Jy)': 0.0, 'samples culled': 0}
+
+    def key(self):
+        """
+        Identity of the culling, e.g. in the keys of the checkpoints.
+        """
+        return {'threshold': self.threshold, 'nside_faint': self.nside_faint}
+
+    def split(self, Freq, PS_data, PS_flux_list):
+        """
+        The sources bright enough to be sampled.
+
+        return
+        ------
+        bright: np.ndarray(NumPS,) of bool
+        """
+        with psProfile.stage('cull'):
+            S = psStats.calc_S(Freq, PS_data['Area (sr)'], PS_flux_list)
+            bright = S >= self.threshold
+        self.totals['NumPS'] += len(S)
+        self.totals['NumCulled'] += int(len(S) - bright.sum())
+        self.totals['flux (Jy)'] += float(S.sum())
+        self.totals['flux culled (Jy)'] += float(S[~bright].sum())
+        psProfile.count('sources_culled', int(len(S) - bright.sum()))
+
+        return bright
+
+    def add_faint(self, pix_vec, nside, PS_data, ClassType, PS_flux_list,
+                  nest=False):
+        """
+        Add the culled sources into pix_vec in place, at their core
+        pixels, or spread over the coarse pixels of nside_faint.
+
+        Parameters
+        ----------
+        pix_vec: np.ndarray(12*nside^2,)
+            The map to be added to
+        PS_data: psTable.Catelogue
+            The culled sources
+        PS_flux_list: np.ndarray
+            Fluxes of the culled sources, as psDraw.calc_flux
+        """
+        NumPS = PS_data.shape[0]
+        if NumPS == 0:
+            return pix_vec
+        nside_faint = nside if self.nside_faint is None else \
+            min(self.nside_faint, nside)
+        coarse = nside_faint < nside
+        with psProfile.stage('render_faint'):
+            counts = psComponents.sample_counts(PS_data, ClassType)
+            weights = (PS_flux_list.reshape(NumPS, -1) * counts).sum(axis=1)
+            pix, idx = psComponents.kernel_point(nside_faint, PS_data,
+                                                 nest=nest or coarse)
+            if not coarse:
+                upix, inverse = np.unique(pix, return_inverse=True)
+                pix_vec[upix] += np.bincount(inverse, weights=weights,
+                                             minlength=len(upix))
+            else:
+                # The sub pixels of a NESTED pixel are consecutive
+                ratio = (nside // nside_faint)**2
+                pix_faint = np.bincount(pix, weights=weights,
+                                        minlength=12 * nside_faint**2)
+                pix_fine = np.repeat(pix_faint / ratio, ratio)
+                if not nest:
+                    pix_fine = hp.reorder(pix_fine, n2r=True)
+                pix_vec += pix_fine
+        self.totals['samples culled'] += int(counts.sum())
+        psProgress.update(NumPS, len(pix))
+
+        return pix_vec
+
+    def report(self):
+        """
+        The totals, with the fractions of the culled sources and flux.
+        """
+        totals = dict(self.totals, threshold=self.threshold,
+                      nside_faint=self.nside_faint)
+        if totals['NumPS'] > 0:
+            totals['fraction culled'] = totals['NumCulled'] / totals['NumPS']
+        if totals['flux (Jy)'] > 0:
+            totals['flux fraction culled'] = (totals['flux culled (Jy)'] /
+                                              totals['flux (Jy)'])
+
+        return totals
+
+
+def compare(pix_ref, pix_vec, ell=0, lmax=None):
+    """
+    The errors of the culled map to the map of all the sources drawn.
+
+    Parameters
+    ----------
+    pix_ref, pix_vec: np.ndarray(12*nside^2,)
+        The reference and culled maps, in RING ordering
+    ell: int
+        The power of the multipoles from ell to lmax is compared
+    lmax: int
+        Default as 3*nside-1
+
+    return
+    ------
+    errors: dict
+        The relative errors of the total, 'total', of the pixels, 'max',
+        and of the power of the multipoles from ell, 'power'.
+    """
+    with psProfile.stage('compare'):
+        cl_ref = hp.anafast(pix_ref, lmax=lmax)
+        cl_vec = hp.anafast(pix_vec, lmax=lmax)
+    total = pix_ref.sum()
+    power = cl_ref[ell:].sum()
+
+    return {'total': abs(pix_vec.sum() - total) / abs(total),
+            'max': np.abs(pix_vec - pix_ref).max() / np.abs(pix_ref).max(),
+            'power': abs(cl_vec[ell:].sum() - power) / power,
+            'ell': ell}
+
+
+def main(argv):
+    """
+    A main function for use this module at the command window, which
+    draws the catelogue with and without culling, and prints the speedup
+    and the errors of each threshold.
+
+    example
+    -------
+    psCull -i PS_tables/SF_100_spec.csv -n 512 -f 150e6 -c 1e-4,3e-4,1e-3
+    -l 100
+    """
+    usage = ("psCull -i <PS name (csv)> -n <nside> -f <frequency> "
+             "-c <thresholds (Jy)> -s <nside of the culled sources> "
+             "-l <minimum multipole of the power>")
+    try:
+        opts, args = getopt.getopt(
+            argv, "hi:n:f:c:s:l:",
+            ["infile=", "nside=", "freq=", "cut=", "nside-faint=", "ell="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    # Default
+    ps_name = None
+    nside = 512
+    freq = 150e6
+    thresholds = [1e-3]
+    nside_faint = None
+    ell = 0
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-i", "--infile"):
+            ps_name = arg
+        elif opt in ("-n", "--nside"):
+            nside = int(arg)
+        elif opt in ("-f", "--freq"):
+            freq = float(arg)
+        elif opt in ("-c", "--cut"):
+            thresholds = [float(value) for value in arg.split(',')]
+        elif opt in ("-s", "--nside-faint"):
+            nside_faint = int(arg)
+        elif opt in ("-l", "--ell"):
+            ell = int(arg)
+    if ps_name is None:
+        print(usage)
+        sys.exit(2)
+    FoldName, FileName = os.path.split(ps_name)
+    ClassType, PS_data = psDraw.read_csv(FileName, FoldName or '.')
+    # Import the heavy modules before timing
+    psDraw.draw_chunked(nside, PS_data[:1], ClassType, freq)
+    tic = time.perf_counter()
+    pix_ref = psDraw.draw_chunked(nside, PS_data, ClassType, freq)
+    time_ref = time.perf_counter() - tic
+    print("All %d sources: %.3f s" % (PS_data.shape[0], time_ref))
+    print("%10s %8s %8s %8s %10s %10s %10s" % (
+        'threshold', 'culled', 'flux', 'speedup', 'total', 'max', 'power'))
+    for threshold in thresholds:
+        cull = FluxCut(threshold, nside_faint)
+        tic = time.perf_counter()
+        pix_vec = psDraw.draw_chunked(nside, PS_data, ClassType, freq,
+                                      cull=cull)
+        speedup = time_ref / (time.perf_counter() - tic)
+        totals = cull.report()
+        errors = compare(pix_ref, pix_vec, ell)
+        print("%10.3g %8.3f %8.3f %8.2f %10.3e %10.3e %10.3e" % (
+            threshold, totals['fraction culled'],
+            totals['flux fraction culled'], speedup, errors['total'],
+            errors['max'], errors['power']))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psDelta is designed to update a drawn map when the
+catelogue is changed, e.g. a population is added, a flux range is cut or
+some bright sources are replaced. Only the footprints of the added and
+removed sources are drawn, so the cost is proportional to the size of
+the change rather than the size of the sky.
+
+The sources are matched by their IDs, i.e. the index of the csv, and
+their fluxes must be reproducible, i.e. the catelogues provide the
+column 'I_151 (Jy)', see psCatelogue.
+
+Functions
+---------
+diff_catelogues: find the IDs added and removed between two catelogues.
+
+update_map: add and subtract the changed sources to the map in place.
+
+update_ps: update the map of a catelogue to another catelogue.
+"""
+
+# Modules
+import os
+import sys
+import getopt
+import numpy as np
+# Cumstom designed modules
+from . import psDraw
+from . import psTable
+from .psLazy import LazyModule
+# The heavy modules are imported on the first use
+hp = LazyModule('healpy')
+
+
+def diff_catelogues(PS_old, PS_new):
+    """
+    Find the sources added and removed from PS_old to PS_new, the
+    sources with the same ID but changed values are both removed and
+    added.
+
+    Parameters
+    ----------
+    PS_old, PS_new: psTable.Catelogue or pandas.core.frame.DataFrame
+        The catelogues, indexed by the IDs of the sources.
+
+    return
+    ------
+    added: np.ndarray
+        IDs of the sources in PS_new to be added
+    removed: np.ndarray
+        IDs of the sources in PS_old to be removed
+    """
+    PS_old = psTable.as_catelogue(PS_old)
+    PS_new = psTable.as_catelogue(PS_new)
+    old_ids = PS_old.ids
+    new_ids = PS_new.ids
+    added = np.setdiff1d(new_ids, old_ids)
+    removed = np.setdiff1d(old_ids, new_ids)
+    # The changed sources
+    common = np.intersect1d(old_ids, new_ids)
+    if len(common) > 0:
+        columns = [col for col in PS_new.columns if col in PS_old.columns]
+        old_values = PS_old.take(PS_old.positions(common)).values(columns)
+        new_values = PS_new.take(PS_new.positions(common)).values(columns)
+        changed = common[np.any(old_values != new_values, axis=1)]
+        added = np.union1d(added, changed)
+        removed = np.union1d(removed, changed)
+
+    return added, removed
+
+
+def update_map(pix_vec, nside, Freq, ClassType, added=None, removed=None,
+               nest=False):
+    """
+    Update the map in place, the added sources are drawn and the
+    removed ones are subtracted.
+
+    Parameters
+    ----------
+    pix_vec: np.ndarray(12*nside^2,)
+        The map drawn from the old catelogue
+    nside: int and dyadic
+        Number of subpixel in a healpix cell
+    Freq: float
+        Frequency
+    ClassType: int
+        Class type of the point soruces
+    added: psTable.Catelogue or pandas.core.frame.DataFrame
+        Rows of the sources to be added
+    removed: psTable.Catelogue or pandas.core.frame.DataFrame
+        Rows of the sources to be removed
+    nest: bool
+        Whether the map is in NESTED ordering
+
+    return
+    ------
+    pix_vec: np.ndarray(12*nside^2,)
+    """
+    for PS_data, sign in ((removed, -1), (added, 1)):
+        if PS_data is None or PS_data.shape[0] == 0:
+            continue
+        if 'I_151 (Jy)' not in PS_data:
+            raise ValueError("The fluxes are not reproducible without "
+                             "the column 'I_151 (Jy)'")
+        PS_flux_list = psDraw.calc_flux(ClassType, Freq, PS_data)
+        footprint = psDraw.calc_footprint(nside, PS_data, ClassType, nest)
+        psDraw.accumulate_footprint(pix_vec, footprint, sign * PS_flux_list)
+
+    return pix_vec
+
+
+def update_ps(pix_vec, nside, Freq, OldName, NewName, FoldName='PS_tables'):
+    """
+    Update the map drawn from the catelogue OldName to the one of the
+    catelogue NewName, both of the same class.
+
+    return
+    ------
+    pix_vec: np.ndarray(12*nside^2,)
+    added, removed: np.ndarray
+        IDs of the added and removed sources
+    """
+    ClassType, PS_old = psDraw.read_csv(OldName, FoldName)
+    NewType, PS_new = psDraw.read_csv(NewName, FoldName)
+    if NewType != ClassType:
+        raise ValueError("The catelogues are of different classes")
+    added, removed = diff_catelogues(PS_old, PS_new)
+    update_map(pix_vec, nside, Freq, ClassType,
+               added=PS_new.select(added), removed=PS_old.select(removed))
+
+    return pix_vec, added, removed
+
+
+def main(argv):
+    """
+    A main function for use this module at the command window
+
+    example
+    -------
+    psDelta -m PS_tables/SF_nside_512.fits -a PS_tables/SF_100_20161009_205700.csv
+    -b PS_tables/SF_120_20161010_101500.csv -o PS_tables/SF_new_nside_512.fits -f 150
+    """
+    usage = ("psDelta -m <Old map (fits)> -a <Old PS name (csv)> "
+             "-b <New PS name (csv)> -o <Output fits name> -f <frequency>")
+    try:
+        opts, args = getopt.getopt(argv, "hm:a:b:o:f:",
+                                   ["map=", "old=", "new=", "outfile=",
+                                    "freq="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    # Default
+    freq = 150
+    map_name = old_name = new_name = fits_name = None
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-m", "--map"):
+            map_name = arg
+        elif opt in ("-a", "--old"):
+            old_name = arg
+        elif opt in ("-b", "--new"):
+            new_name = arg
+        elif opt in ("-o", "--outfile"):
+            fits_name = arg
+        elif opt in ("-f", "--freq"):
+            freq = float(arg)
+    if None in (map_name, old_name, new_name, fits_name):
+        print(usage)
+        sys.exit(2)
+    FoldName, OldName = os.path.split(old_name)
+    NewFold, NewName = os.path.split(new_name)
+    if FoldName != NewFold:
+        print("The catelogues should be in the same folder")
+        sys.exit(2)
+    if FoldName == '':
+        FoldName = '.'
+    pix_vec = hp.read_map(map_name, dtype=np.float64)
+    nside = hp.npix2nside(len(pix_vec))
+    pix_vec, added, removed = update_ps(pix_vec, nside, freq, OldName,
+                                        NewName, FoldName)
+    print("Added: ", len(added))
+    print("Removed: ", len(removed))
+    psDraw.write_map(fits_name, pix_vec)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -26,26 +26,44 @@ transformed to be iterable numpy.ndarray.
 
 calc_flux: calculate the flux and surface brightness of the ps.
 
+calc_footprint: calculate the pixels covered by the ps, which is
+reusable at different frequencies.
+
+render_footprint: fill the footprint with the flux of the ps.
+
+draw_channels: draw the ps at many frequencies with one footprint.
+
 draw_elp: processing on the elliptical and circular core or lobes.
 
 draw_ps: draw the ps on the image map.
 """
 
 # Modules
+import os
 import sys
 import getopt
 import numpy as np
-import astropy.units as au
-import healpy as hp
-# from pandas import DataFrame
-import pandas as pd
 # Cumstom designed modules
-from fg21sim.utils import write_fits_healpix
+from . import psProfile
+from . import psProgress
+from . import psCheckpoint
+from . import psIndex
+from . import psTable
+from . import psStats
+from . import psBeam
+from . import psSpec
+from . import psComponents
+from . import psCull
+from . import psMemory
+from .psLazy import LazyModule
+# The heavy modules are imported on the first use
+fg21sim_utils = LazyModule('fg21sim.utils')
 # import basic_params
 # import psCatelogue
 
 # Init
 # Params = basic_params.PixelParams(img_size)
+ClassList = psTable.ClassList
 
 
 class Flux:
@@ -84,11 +102,15 @@ class Flux:
         # ClassType = ClassType
         self.ClassType = ClassType
 
-    def genSpec(self):
+    def genSpec(self, I_151=None):
         # generate the spectrum
         # Use IF-THEN to replace SWITCH-CASE
-        # reference flux at 151MHz, see Willman et al's work
-        self.I_151 = 10**(np.random.uniform(-4, -3))
+        # reference flux at 151MHz, see Willman et al's work, which is
+        # random if not provided by the catelogue
+        if I_151 is None:
+            self.I_151 = 10**(np.random.uniform(-4, -3))
+        else:
+            self.I_151 = I_151
         # Clac flux
         if self.ClassType == 1:
             Spec = (self.Freq / 151e6)**(-0.7) * self.I_151
@@ -98,32 +120,33 @@ class Flux:
             Spec = (self.Freq / 151e6)**(-0.7) * self.I_151
         elif self.ClassType == 4:
             Spec_lobe = (self.Freq / 151e6)**-0.75 * self.I_151
-            a0 = np.log10(self.I_151) - 0.7 * np.log10(151e6) + \
-                0.29 * np.log10(151e6) * np.log10(151e6)
-            lgs = a0 + 0.7 * np.log10(self.Freq) - 0.29 * \
-                np.log10(self.Freq) * np.log10(self.Freq)
-            Spec_core = 10**lgs
+            Spec_core = self.genCore()
             Spec = np.array([Spec_core, Spec_lobe])
         elif self.ClassType == 5:
             Spec_lobe = (self.Freq / 151e6)**-0.75 * self.I_151
             Spec_hotspot = (self.Freq / 151e6)**-0.75 * self.I_151
-            a0 = np.log10(self.I_151) - 0.7 * np.log10(151e6) + \
-                0.29 * np.log10(151e6) * np.log10(151e6)
-            lgs = a0 + 0.7 * np.log10(self.Freq) - 0.29 * \
-                np.log10(self.Freq) * np.log10(self.Freq)
-            Spec_core = 10**lgs
+            Spec_core = self.genCore()
             Spec = np.array([Spec_core, Spec_lobe, Spec_hotspot])
 
         return Spec
 
+    def genCore(self):
+        # the curved spectrum of the core, in log space about 151MHz,
+        # i.e. psSpec with alpha = 0.7 - 0.58 * L and beta = -0.29
+        x = np.log10(self.Freq) - psSpec.LOG_FREQ0
+        lgs = np.log10(self.I_151) + (0.7 - 0.58 * psSpec.LOG_FREQ0) * x - \
+            0.29 * x * x
+
+        return 10**lgs
+
     # calc_Tb
-    def calc_Tb(self, area):
+    def calc_Tb(self, area, I_151=None):
         # light speed
         c = 2.99792458e8
         # ?
         kb = 1.38e-23
         # flux in Jy
-        flux_in_Jy = self.genSpec()
+        flux_in_Jy = self.genSpec(I_151)
         Omegab = area  # [sr]
 
         Sb = flux_in_Jy * 1e-26 / Omegab
@@ -144,14 +167,23 @@ def read_csv(FileName, FoldName='PS_tables'):
     FileName: str
         Name of the file.
 
+    return
+    ------
+    ClassType: int
+    PS_data: psTable.Catelogue
     """
 
     # Split and judge point source type
-    ClassList = ['SF', 'SB', 'RQ', 'FRI', 'FRII']
     ClassName = FileName.split('_')[0]
     ClassType = ClassList.index(ClassName) + 1
-    # Read csv
-    PS_data = pd.read_csv(FoldName + '/' + FileName)
+    # Read csv, the index is the ID of the sources
+    with psProfile.stage('read_csv'):
+        PS_data = psTable.Catelogue.read_csv(FoldName + '/' + FileName,
+                                             ClassType)
+    if psProfile.enabled():
+        psProfile.count('sources_read', PS_data.shape[0])
+        psProfile.count('bytes_read',
+                        os.path.getsize(FoldName + '/' + FileName))
 
     return ClassType, PS_data
 
@@ -166,56 +198,344 @@ def calc_flux(ClassType, Freq, PS_data):
         Type of point source
     Freq: float
         Frequency
-    PS_data: pandas.core.frame.DataFrame
+    PS_data: psTable.Catelogue or pandas.core.frame.DataFrame
         Data of the point sources
+
+    return
+    ------
+    PS_flux_list: np.ndarray
+        (NumPS,) for SF, SB and RQ, (NumPS, 2) for FRI with the core and
+        lobe, and (NumPS, 3) for FRII with the core, lobe and hotspot.
+        If the catelogue provides 'I_151 (Jy)', the fluxes are calculated
+        at once and reproducible by psSpec, with the spectral indices of
+        the columns 'alpha', 'alpha_core', ... if provided, otherwise
+        I_151 is drawn randomly.
     """
+    PS_data = psTable.as_catelogue(PS_data, ClassType)
     # init flux
     PS_flux = Flux(Freq=Freq, ClassType=ClassType)
     # PS_flux_list
     NumPS = PS_data.shape[0]
-    if ClassType <= 3:
-        PS_flux_list = np.zeros((NumPS,))
-        # Iteratively calculate flux
-        for i in range(NumPS):
-            PS_area = PS_data['Area (sr)'][i]
-            PS_flux_list[i] = PS_flux.calc_Tb(PS_area)
-    else:
-        PS_flux_list = np.zeros((NumPS, 2))
-# Iteratively calculate flux
-        for i in range(NumPS):
-            PS_area = PS_data['Area (sr)'][i]
-            PS_flux_list[i, :] = PS_flux.calc_Tb(PS_area)
+    PS_area = PS_data['Area (sr)']
+    with psProfile.stage('calc_flux'):
+        if 'I_151 (Jy)' in PS_data:
+            PS_flux_list = psSpec.SpecEngine(Freq).calc_Tb(
+                PS_data, ClassType)[:, :, 0]
+            if ClassType <= 3:
+                PS_flux_list = PS_flux_list[:, 0]
+            PS_flux_list = np.ascontiguousarray(PS_flux_list)
+        elif ClassType <= 3:
+            PS_flux_list = np.zeros((NumPS,))
+            # Iteratively calculate flux
+            for i in range(NumPS):
+                PS_flux_list[i] = PS_flux.calc_Tb(PS_area[i])
+        else:
+            NumComp = 2 if ClassType == 4 else 3
+            PS_flux_list = np.zeros((NumPS, NumComp))
+            # Iteratively calculate flux
+            for i in range(NumPS):
+                PS_flux_list[i, :] = PS_flux.calc_Tb(PS_area[i])
+    psProfile.count('sources_flux', NumPS)
 
     return PS_flux_list
 
 
-def draw_rq(nside, PS_data, Freq):
+def calc_footprint(nside, PS_data, ClassType, nest=False, chunk=10000):
+    """
+    Calculate the footprint of the point sources on the healpix map,
+    which is independent of the frequency, so it can be reused to draw
+    the same catelogue at different frequencies.
+
+    Parameters
+    ----------
+    nside: int and dyadic
+        Number of subpixel in a healpix cell
+    PS_data: psTable.Catelogue or pandas.core.frame.DataFrame
+        Data of the point sources
+    ClassType: int
+        Class type of the point soruces
+    nest: bool
+        Whether the pixels are in NESTED ordering, default as False.
+    chunk: int
+        Number of sources processed at a time, to limit the memory.
+
+    return
+    ------
+    footprint: tuple of np.ndarray, (pix, idx, comp, nhit)
+        The pixel indices, the row indices of the sources, the
+        components (as psComponents.ClassComponents, e.g. 0 for core,
+        1 for lobes and 2 for hotspots) and the number of samples of the
+        source component hitting the pixel.
+    """
+    PS_data = psTable.as_catelogue(PS_data, ClassType)
+    npix = 12 * nside**2
+    NumComp = len(psComponents.ClassComponents[ClassType])
+    NumPS = PS_data.shape[0]
+    pix_list = []
+    idx_list = []
+    comp_list = []
+    nhit_list = []
+    psProgress.start(NumPS, 'footprint ' + ClassList[ClassType - 1])
+    for start in range(0, NumPS, chunk):
+        with psProfile.stage('footprint'):
+            pix, idx, comp = psComponents.footprint(
+                nside, PS_data[start:start + chunk], ClassType, nest)
+        # Merge the samples of one source falling in the same pixel
+        with psProfile.stage('merge_samples'):
+            key = (idx.astype(np.int64) * NumComp + comp) * npix + pix
+            key, nhit = np.unique(key, return_counts=True)
+        psProfile.count('sources_footprint', min(chunk, NumPS - start))
+        psProgress.update(min(chunk, NumPS - start), len(pix))
+        pix_list.append(key % npix)
+        idx_list.append(key // npix // NumComp + start)
+        comp_list.append((key // npix % NumComp).astype(np.int8))
+        nhit_list.append(nhit)
+    psProgress.finish()
+    if len(pix_list) == 0:
+        return (np.zeros((0,), dtype=np.int64), np.zeros((0,), dtype=np.int64),
+                np.zeros((0,), dtype=np.int8), np.zeros((0,), dtype=np.int64))
+
+    return (np.concatenate(pix_list), np.concatenate(idx_list),
+            np.concatenate(comp_list), np.concatenate(nhit_list))
+
+
+def render_footprint(nside, footprint, PS_flux_list):
+    """
+    Fill the footprint of the point sources with their fluxes.
+
+    Parameters
+    ----------
+    nside: int and dyadic
+        Number of subpixel in a healpix cell
+    footprint: tuple
+        The footprint calculated by calc_footprint
+    PS_flux_list: np.ndarray
+        Fluxes of the sources, (NumPS,) or (NumPS, NumComp) for the
+        sources with core and lobes.
+
+    return
+    ------
+    pix_vec: np.ndarray(12*nside^2,)
+    """
+    pix, idx, comp, nhit = footprint
+    with psProfile.stage('render'):
+        if PS_flux_list.ndim == 1:
+            weights = PS_flux_list[idx] * nhit
+        else:
+            weights = PS_flux_list[idx, comp] * nhit
+        pix_vec = np.bincount(pix, weights=weights, minlength=12 * nside**2)
+    psProfile.count('pixels_touched', len(pix))
+
+    return pix_vec
+
+
+def accumulate_footprint(pix_vec, footprint, PS_flux_list):
+    """
+    Add the footprint filled with the fluxes into pix_vec in place, the
+    cost is proportional to the size of the footprint rather than the
+    size of the map.
+
+    Parameters
+    ----------
+    pix_vec: np.ndarray(12*nside^2,)
+        The map to be added to
+    footprint: tuple
+        The footprint calculated by calc_footprint
+    PS_flux_list: np.ndarray
+        Fluxes of the sources, as render_footprint
+    """
+    pix, idx, comp, nhit = footprint
+    with psProfile.stage('render'):
+        if PS_flux_list.ndim == 1:
+            weights = PS_flux_list[idx] * nhit
+        else:
+            weights = PS_flux_list[idx, comp] * nhit
+        upix, inverse = np.unique(pix, return_inverse=True)
+        pix_vec[upix] += np.bincount(inverse, weights=weights,
+                                     minlength=len(upix))
+    psProfile.count('pixels_touched', len(pix))
+
+    return pix_vec
+
+
+def draw_chunked(nside, PS_data, ClassType, Freq, chunk=10000,
+                 checkpoint=None, key=None, stats=None, cull=None, out=None):
+    """
+    Draw the point sources chunk by chunk, the fluxes of the sources are
+    drawn in the same order as calc_flux. If checkpoint is provided, the
+    partial map, the offset and the state of np.random are saved after
+    the chunks, and the job is resumed from the checkpoint if exists,
+    so that the result is identical to an uninterrupted run.
+
+    Prameters
+    ---------
+    nside: int and dyadic
+        Number of subpixel in a healpix cell
+    PS_data: psTable.Catelogue or pandas.core.frame.DataFrame
+        Data of the point sources
+    ClassType: int
+        Class type of the point soruces
+    Freq: float
+        Frequency
+    chunk: int
+        Number of sources drawn at a time, the one in the checkpoint
+        if resumed
+    checkpoint: psCheckpoint.Checkpoint
+        The checkpoint, default as None.
+    key: dict
+        Identity of the job saved in the checkpoint.
+    stats: psStats.MapStats
+        If provided, the fluxes of the sources are added to it, and the
+        histograms are saved in the checkpoint too.
+    cull: psCull.FluxCut
+        If provided, the sources fainter than its threshold are not
+        sampled but added at their core pixels, see psCull.
+    out: np.ndarray(12*nside^2,)
+        The zero map to be drawn on, e.g. a memmap, default as a new
+        map in memory.
+    """
+    PS_data = psTable.as_catelogue(PS_data, ClassType)
+    NumPS = PS_data.shape[0]
+    if key is None:
+        key = {}
+    # The chunk is saved with the offset instead of in the key, so a job
+    # planned with another chunk, e.g. by psMemory, is resumed with the
+    # chunk it was started with
+    key = dict(key, job='draw', ClassType=ClassType, NumPS=NumPS,
+               nside=nside, Freq=Freq)
+    if cull is not None:
+        key['cull'] = cull.key()
+    state = None
+    if checkpoint is not None:
+        state = checkpoint.load(key)
+    ClassName = ClassList[ClassType - 1]
+    if stats is not None:
+        # The statistics of this job, which are checkpointed
+        job_stats = psStats.MapStats(bins=stats.bins, lmax=False)
+    pix_vec = np.zeros((12 * nside**2,)) if out is None else out
+    if state is None:
+        offset = 0
+    else:
+        pix_vec[:] = state['pix_vec']
+        offset = state['offset']
+        chunk = int(state.get('chunk', chunk))
+        if stats is not None and 'stats_counts' in state:
+            job_stats.counts[ClassName] = state['stats_counts']
+            job_stats.totals[ClassName] = {
+                'NumPS': int(state['stats_totals'][0]),
+                'flux (Jy)': float(state['stats_totals'][1]), 'Freq': Freq}
+    psProgress.start(NumPS - offset, 'draw ' + ClassName)
+    for start in range(offset, NumPS, chunk):
+        PS_chunk = PS_data[start:start + chunk]
+        PS_flux_list = calc_flux(ClassType, Freq, PS_chunk)
+        if cull is None:
+            footprint = calc_footprint(nside, PS_chunk, ClassType,
+                                       chunk=chunk)
+            accumulate_footprint(pix_vec, footprint, PS_flux_list)
+        else:
+            bright = cull.split(Freq, PS_chunk, PS_flux_list)
+            cull.add_faint(pix_vec, nside, PS_chunk.take(~bright), ClassType,
+                           PS_flux_list[~bright])
+            footprint = calc_footprint(nside, PS_chunk.take(bright),
+                                       ClassType, chunk=chunk)
+            accumulate_footprint(pix_vec, footprint, PS_flux_list[bright])
+        if stats is not None:
+            job_stats.add(ClassType, Freq, PS_chunk, PS_flux_list)
+        if checkpoint is not None:
+            arrays = {'pix_vec': pix_vec, 'chunk': chunk}
+            if stats is not None:
+                totals = job_stats.totals[ClassName]
+                arrays['stats_counts'] = job_stats.counts[ClassName]
+                arrays['stats_totals'] = np.array([totals['NumPS'],
+                                                   totals['flux (Jy)']])
+            checkpoint.update(key, min(start + chunk, NumPS), **arrays)
+    psProgress.finish()
+    if stats is not None:
+        stats.merge(job_stats)
+    if checkpoint is not None:
+        checkpoint.remove()
+
+    return pix_vec
+
+
+def draw_channels(nside, PS_data, ClassType, Freqs, chunk=10000, nest=False):
+    """
+    Draw the point sources at many frequencies at once, the footprint of
+    a chunk is calculated once and filled with the brightness of all the
+    frequencies evaluated by psSpec.SpecEngine. The catelogue should
+    provide 'I_151 (Jy)'.
+
+    Parameters
+    ----------
+    nside: int and dyadic
+        Number of subpixel in a healpix cell
+    PS_data: psTable.Catelogue or pandas.core.frame.DataFrame
+        Data of the point sources
+    ClassType: int
+        Class type of the point soruces
+    Freqs: np.ndarray(NumFreq,)
+        The frequencies
+    chunk: int
+        Number of sources drawn at a time
+    nest: bool
+        Whether the maps are in NESTED ordering
+
+    return
+    ------
+    pix_cube: np.ndarray(NumFreq, 12*nside^2)
+    """
+    PS_data = psTable.as_catelogue(PS_data, ClassType)
+    if 'I_151 (Jy)' not in PS_data:
+        raise ValueError("The catelogue should provide 'I_151 (Jy)'")
+    engine = psSpec.SpecEngine(Freqs, chunk=chunk)
+    npix = 12 * nside**2
+    pix_cube = np.zeros((len(engine.Freqs), npix))
+    psProgress.start(PS_data.shape[0], 'channels ' + ClassList[ClassType - 1])
+    for start, stop, Tb in engine.iter_Tb(PS_data, ClassType):
+        footprint = calc_footprint(nside, PS_data[start:stop], ClassType,
+                                   nest=nest, chunk=chunk)
+        pix, idx, comp, nhit = footprint
+        with psProfile.stage('render'):
+            upix, inverse = np.unique(pix, return_inverse=True)
+            for i in range(len(engine.Freqs)):
+                weights = Tb[idx, comp, i] * nhit
+                pix_cube[i, upix] += np.bincount(inverse, weights=weights,
+                                                 minlength=len(upix))
+        psProfile.count('pixels_touched', len(pix) * len(engine.Freqs))
+    psProgress.finish()
+
+    return pix_cube
+
+
+def draw_rq(nside, PS_data, Freq, stats=None):
     """
     Designed to draw the radio quiet AGN
 
     Parameters
     ----------
-    ImgMat: np.ndarray
-        Two dimensional matrix, to describe the image
-    PS_data: pandas.core.frame.DataFrame
+    nside: int and dyadic
+        number of sub pixel in a cell of the healpix structure
+    PS_data: psTable.Catelogue or pandas.core.frame.DataFrame
         Data of the point sources
     Freq: float
         Frequency
+    stats: psStats.MapStats
+        If provided, the fluxes of the sources are added to it.
     """
-    # Init
-    pix_vec = np.zeros((12*nside**2,))
+    PS_data = psTable.as_catelogue(PS_data, 3)
     # Gen flux list
     PS_flux_list = calc_flux(3, Freq, PS_data)
     # Angle to pix
-    pix = hp.ang2pix(nside, PS_data['Theta (deg)'] /
-                     180, PS_data['Phi (deg)'] / 180)
+    footprint = calc_footprint(nside, PS_data, 3)
     # Gen pix_vec
-    pix_vec[pix] += PS_flux_list
+    pix_vec = render_footprint(nside, footprint, PS_flux_list)
+    if stats is not None:
+        stats.add(3, Freq, PS_data, PS_flux_list)
 
     return pix_vec
 
 
-def draw_cir(nside, PS_data, ClassType, Freq):
+def draw_cir(nside, PS_data, ClassType, Freq, stats=None):
     """
     Designed to draw the circular  star forming  and star bursting PS.
 
@@ -223,148 +543,59 @@ def draw_cir(nside, PS_data, ClassType, Freq):
     ---------
     nside: int and dyadic
         number of sub pixel in a cell of the healpix structure
-    PS_data: pandas.core.frame.DataFrame
+    PS_data: psTable.Catelogue or pandas.core.frame.DataFrame
         Data of the point sources
     ClassType: int
         Class type of the point soruces
     Freq: float
         Frequency
+    stats: psStats.MapStats
+        If provided, the fluxes of the sources are added to it.
     """
-    # Init
-    pix_vec = np.zeros((12*nside**2,))
+    PS_data = psTable.as_catelogue(PS_data, ClassType)
     # Gen flux list
     PS_flux_list = calc_flux(ClassType, Freq, PS_data)
-    #  Iteratively draw the ps
-    NumPS = PS_data.shape[0]
-    for i in range(NumPS):
-        # grid
-        PS_radius = PS_data['radius (rad)'][i]  # radius[rad]
-        theta = PS_data['Theta (deg)'][i] * au.deg   # theta
-        phi = PS_data['Phi (deg)'][i] * au.deg  # phi
-        # Fill with circle
-        step = PS_radius / 10  # Should be fixed
-        # x and y are the differencial rad to the core point at the theta and
-        # phi directions.
-        x = np.arange(-PS_radius, PS_radius + step, step) * au.rad
-        y = np.arange(- PS_radius,  PS_radius + step, step) * au.rad
-        for p in range(len(x)):
-            for q in range(len(y)):
-                if np.sqrt(x[p].value**2 + y[q].value**2) <= PS_radius:
-                    x_ang = x[p].to(au.deg) + theta
-                    y_ang = y[q].to(au.deg) + phi
-                    pix_tmp = hp.ang2pix(
-                        nside, x_ang.value / 180, y_ang.value / 180)
-                    pix_vec[pix_tmp] += PS_flux_list[i]
+    # Fill with circle
+    footprint = calc_footprint(nside, PS_data, ClassType)
+    pix_vec = render_footprint(nside, footprint, PS_flux_list)
+    if stats is not None:
+        stats.add(ClassType, Freq, PS_data, PS_flux_list)
 
     return pix_vec
 
 
-def draw_lobe(nside, PS_data, ClassType, Freq):
+def draw_lobe(nside, PS_data, ClassType, Freq, stats=None):
     """
-    Designed to draw the elliptical lobes of FRI and FRII
+    Designed to draw the cores, elliptical lobes and hotspots of FRI and
+    FRII
 
     Prameters
     ---------
     nside: int and dyadic
-    PS_data: pandas.core.frame.DataFrame
+    PS_data: psTable.Catelogue or pandas.core.frame.DataFrame
         Data of the point sources
     ClassType: int
         Class type of the point soruces
     Freq: float
         Frequency
+    stats: psStats.MapStats
+        If provided, the fluxes of the sources are added to it.
 
     """
-    # Init
-    pix_vec = np.zeros((12*nside**2,))
-    NumPS = PS_data.shape[0]
+    PS_data = psTable.as_catelogue(PS_data, ClassType)
     # Gen flux list
     PS_flux_list = calc_flux(ClassType, Freq, PS_data)
-    PS_lobe = PS_flux_list[:,1]
-    # Iteratively draw ps
-    for i in range(NumPS):
-        # Parameters
-        theta = PS_data['Theta (deg)'][i] * au.deg
-        phi = PS_data['Phi (deg)'][i] * au.deg
-        lobe_maj = PS_data['lobe_maj (rad)'][i]
-        lobe_min = PS_data['lobe_min (rad)'][i]
-        lobe_ang = PS_data['lobe_ang (deg)'][i] / 180
-
-        # Lobe1
-        lobe1_theta = lobe_maj * np.cos(lobe_ang) * au.rad
-        lobe1_theta = theta + lobe1_theta.to(au.deg)
-        lobe1_phi = lobe_maj * np.sin(lobe_ang) * au.rad
-        lobe1_phi = phi + lobe1_phi.to(au.deg)
-        # Focuses
-        lobe_c = np.sqrt(lobe_maj**2 - lobe_min**2)  # focus distance
-        F1_core_x = lobe_c
-        F1_core_y = 0
-        F2_core_x = -lobe_c
-        F2_core_y = 0
-        # draw
-        step = lobe_maj / 10
-        x = np.arange(-lobe_maj, lobe_maj + step, step)
-        y = np.arange(-lobe_min, lobe_min + step, step)
-        # Ellipse
-        for p in range(len(x)):
-            for q in range(len(y)):
-                DistFocus1 = np.sqrt(
-                    (x[p] - F1_core_x)**2 + (y[q] - F1_core_y)**2)
-                DistFocus2 = np.sqrt(
-                    (x[p] - F2_core_x)**2 + (y[q] - F2_core_y)**2)
-                if (DistFocus1 + DistFocus2 <= 2 * lobe_maj):
-                    # rotation
-                    x_ang = (x[p] * au.rad).to(au.deg)
-                    y_ang = (y[q] * au.rad).to(au.deg)
-                    x_r = x_ang * np.cos(lobe_ang) - y_ang * np.sin(lobe_ang)
-                    y_r = x_ang * np.sin(lobe_ang) + y_ang * np.cos(lobe_ang)
-                    # Judge and Fill
-                    pix_tmp = hp.ang2pix(
-                        nside, (theta + x_r).value / 180, (phi + y_r).value / 180)
-                    pix_vec[pix_tmp] += PS_lobe[i]
-
-        # Lobe2
-        lobe2_theta = lobe_maj * np.cos(lobe_ang + np.pi) * au.rad
-        lobe2_theta = theta + lobe2_theta.to(au.deg)
-        lobe2_phi = lobe_maj * np.sin(lobe_ang + np.pi) * au.rad
-        lobe2_phi = phi + lobe2_phi.to(au.deg)
-        # Focuses
-        lobe_c = np.sqrt(lobe_maj**2 - lobe_min**2)  # focus distance
-        F1_core_x = lobe_c
-        F1_core_y = 0
-        F2_core_x = -lobe_c
-        F2_core_y = 0
-        # draw
-        step = lobe_maj / 10
-        x = np.arange(-lobe_maj, lobe_maj + step, step)
-        y = np.arange(-lobe_min, lobe_min + step, step)
-        # Ellipse
-        for p in range(len(x)):
-            for q in range(len(y)):
-                DistFocus1 = np.sqrt(
-                    (x[p] - F1_core_x)**2 + (y[q] - F1_core_y)**2)
-                DistFocus2 = np.sqrt(
-                    (x[p] - F2_core_x)**2 + (y[q] - F2_core_y)**2)
-                if (DistFocus1 + DistFocus2 <= 2 * lobe_maj):
-                    # rotation
-                    x_ang = (x[p] * au.rad).to(au.deg)
-                    y_ang = (y[q] * au.rad).to(au.deg)
-                    x_r = x_ang * np.cos(lobe_ang + np.pi) - \
-                        y_ang * np.sin(lobe_ang + np.pi)
-                    y_r = x_ang * np.sin(lobe_ang + np.pi) + \
-                        y_ang * np.cos(lobe_ang + np.pi)
-                    # Judge and Fill
-                    pix_tmp = hp.ang2pix(
-                        nside, (lobe2_theta + x_r).value / 180, (lobe2_phi + y_r).value / 180)
-                    pix_vec[pix_tmp] += PS_lobe[i]
-        # Core
-        pix_tmp = hp.ang2pix(nside, PS_data['Theta (deg)']/ 180, PS_data['Phi (deg)'] / 180)
-        PS_core = PS_flux_list[:,0]
-        pix_vec[pix_tmp] += PS_core
+    # Lobes and cores
+    footprint = calc_footprint(nside, PS_data, ClassType)
+    pix_vec = render_footprint(nside, footprint, PS_flux_list)
+    if stats is not None:
+        stats.add(ClassType, Freq, PS_data, PS_flux_list)
 
     return pix_vec
 
 
-def draw_ps(nside, Freq, FileName, FoldName='PS_tables'):
+def draw_ps(nside, Freq, FileName, FoldName='PS_tables', checkpoint=None,
+            region=None, stats=None, cull=None, max_memory=None, NumMaps=1):
     """
     Read csv ps list file, and generate the healpix structure vector
     with the respect frequency.
@@ -379,20 +610,117 @@ def draw_ps(nside, Freq, FileName, FoldName='PS_tables'):
         Name of the ps list catelogue
     FoldName: str
         Name of the folder saving ps lists, which is 'PS_tables' as default.
+    checkpoint: psCheckpoint.Checkpoint
+        If provided, the sources are drawn chunk by chunk with the
+        checkpoint saved, see draw_chunked.
+    region: list of int
+        If provided, only the sources in these coarse NESTED pixels (and
+        their neighbours) of the sorted catelogue are read and drawn,
+        see psIndex.write_sorted.
+    stats: psStats.MapStats
+        If provided, the histogram and total of the source fluxes, and
+        the statistics and power spectrum of the map are added to it,
+        named by the class, e.g. 'SF'.
+    cull: psCull.FluxCut
+        If provided, the sources fainter than its threshold are not
+        sampled, see draw_chunked.
+    max_memory: int or str
+        If provided, e.g. '4G', the sources are drawn in the chunks and
+        onto the map (in memory or memmap) planned by psMemory.plan_draw
+        to keep the process under the budget.
+    NumMaps: int
+        Number of the maps held at the same time under max_memory, with
+        the one drawn, e.g. 2 in draw_sky for the sum.
     """
 
     # Init
     pix_vec = np.zeros((12 * nside**2,))
     # load csv
-    ClassType, PS_data = read_csv(FileName, FoldName)
+    if region is None:
+        ClassType, PS_data = read_csv(FileName, FoldName)
+    else:
+        ClassType = ClassList.index(FileName.split('_')[0]) + 1
+        with psProfile.stage('read_csv'):
+            PS_data = psTable.as_catelogue(
+                psIndex.read_region(FileName, FoldName, region), ClassType)
+        psProfile.count('sources_read', PS_data.shape[0])
+
+    # Identity of the job in the checkpoint
+    key = {'catelogue': FileName}
+    if region is not None:
+        key['region'] = np.unique(np.asarray(region, dtype=np.int64)).tolist()
 
     # get sparsed matrix
-    if ClassType == 1 or ClassType == 2:
-        pix_vec = draw_cir(nside, PS_data, ClassType, Freq)
+    if max_memory is not None:
+        plan = psMemory.plan_draw(nside, PS_data, ClassType, Freq,
+                                  max_memory, NumMaps)
+        pix_vec = draw_chunked(nside, PS_data, ClassType, Freq,
+                               chunk=plan['chunk'], checkpoint=checkpoint,
+                               key=key, stats=stats,
+                               cull=cull, out=psMemory.create_map(
+                                   12 * nside**2, plan['accumulation']))
+    elif checkpoint is not None or region is not None or cull is not None:
+        pix_vec = draw_chunked(nside, PS_data, ClassType, Freq,
+                               checkpoint=checkpoint,
+                               key=key, stats=stats,
+                               cull=cull)
+    elif ClassType == 1 or ClassType == 2:
+        pix_vec = draw_cir(nside, PS_data, ClassType, Freq, stats)
     elif ClassType == 3:
-        pix_vec = draw_rq(nside, PS_data, Freq)
+        pix_vec = draw_rq(nside, PS_data, Freq, stats)
+    else:
+        pix_vec = draw_lobe(nside, PS_data, ClassType, Freq, stats)
+    if stats is not None:
+        with psProfile.stage('stats'):
+            stats.add_map(pix_vec, ClassList[ClassType - 1])
+
+    return pix_vec
+
+
+def draw_sky(nside, Freq, FileNames, FoldName='PS_tables', beam=None,
+             lmax=None, stats=None, cull=None, max_memory=None):
+    """
+    Draw the catelogues of all the classes, sum them up, and then
+    convolve the sum with the beam, so that there is one harmonic
+    transform per frequency.
+
+    Prameters
+    ---------
+    nside: int and dyadic
+        Number of subpixel in a healpix cell
+    Freq: float
+        Frequency
+    FileNames: list of str
+        Names of the ps list catelogues
+    FoldName: str
+        Name of the folder saving ps lists
+    beam: psBeam.GaussianBeam
+        The beam, default as None, i.e. not convolved.
+    lmax: int
+        The maximum multipole of the convolution, default as 3*nside-1
+    stats: psStats.MapStats
+        If provided, the statistics of the classes and of the sum,
+        named 'total', are added to it.
+    cull: psCull.FluxCut
+        If provided, the faint sources of all the classes are culled.
+    max_memory: int or str
+        If provided, the catelogues are drawn under the budget, with
+        the sum counted in it, which is in memmap if the two maps do not
+        fit, see draw_ps.
+    """
+    if max_memory is None:
+        pix_vec = np.zeros((12 * nside**2,))
     else:
-        pix_vec = draw_lobe(nside, PS_data, ClassType, Freq)
+        pix_vec = psMemory.create_map(
+            12 * nside**2, psMemory.plan_map(nside, max_memory, NumMaps=2))
+    for FileName in FileNames:
+        pix_vec += draw_ps(nside, Freq, FileName, FoldName, stats=stats,
+                           cull=cull, max_memory=max_memory, NumMaps=2)
+    if beam is not None:
+        pix_vec = psBeam.convolve(pix_vec, beam, Freq, lmax=lmax)
+    if stats is not None:
+        with psProfile.stage('stats'):
+            stats.add_map(pix_vec, 'total')
 
     return pix_vec
 
@@ -423,6 +751,16 @@ def sparse2full(nside, sparse_mat):
         pix_vec[sparse_mat[:, 0].tolist()] += sparse_mat[:, 1].tolist()
         return pix_vec
 
+def write_map(fits_name, pix_vec):
+    """
+    Write the healpix vector into fits, timed and counted by psProfile.
+    """
+    with psProfile.stage('write_fits'):
+        fg21sim_utils.write_fits_healpix(fits_name, pix_vec)
+    if psProfile.enabled() and os.path.exists(fits_name):
+        psProfile.count('bytes_written', os.path.getsize(fits_name))
+
+
 def main(argv):
     """
     A main function for use this module at the command window
@@ -436,16 +774,38 @@ def main(argv):
     example
     -------
     psDraw_new -i PS_tables/SF_100_20161009_205700.csv -o PS_tables/SF_nside_512.fits
-    -n 512 -f 150
+    -n 512 -f 150 -t timing.json -s PS_tables/SF_nside_512.stats.json
     """
+    usage = ("pyDraw -i <PS name (csv)> -o <Outpur fits name> -n <nside> "
+             "-f <frequency> -t <timing report (json)> -p (progress) "
+             "-c <checkpoint (npz), one catelogue without -b> "
+             "-s <statistics (json or npz)> "
+             "-b <beam FWHM (arcmin)> --beam-freq <frequency of the FWHM> "
+             "--cull <flux threshold (Jy)> -m <memory budget, e.g. 4G>\n"
+             "The PS names separated by ',' are summed, and then convolved "
+             "with the beam if -b is provided.")
     try:
-        opts,args = getopt.getopt(argv,"hi:o:n:f:",["infile=","outfile=","nside","freq"])
+        opts,args = getopt.getopt(argv,"hi:o:n:f:t:pc:s:b:m:",["infile=","outfile=","nside=","freq=","timing=","progress","checkpoint=","stats=","beam=","beam-freq=","cull=","max-memory="])
     except getopt.GetoptError:
-        print("pyDraw -i <PS name (csv)> -o <Outpur fits name> -n <nside> -f <frequency>")
+        print(usage)
         sys.exit(2)
+    # Default
+    nside = 512
+    freq = 150
+    fits_name = None
+    timing_name = None
+    progress = False
+    checkpoint = None
+    stats = None
+    stats_name = None
+    fwhm = None
+    beam_freq = None
+    cull = None
+    max_memory = None
     for opt,arg in opts:
         if opt == '-h':
-            print("pyDraw -i <PS name (csv)> -o <Outpur fits name> -n <nside> -f <frequency>")
+            print(usage)
+            sys.exit()
         elif opt in ("-i","--infile"):
             ps_name = arg
         elif opt in ("-o","--outfile"):
@@ -454,33 +814,71 @@ def main(argv):
             nside = int(arg)
         elif opt in ("-f","--freq"):
             freq = float(arg)
-    # Split to get folder name and file name
-    Str_split = ps_name.split('/')
-    if len(Str_split) == 1:
-        FileName = Str_split
-        FoldName = "./"
-    else:
-        FileName = Str_split[-1]
-        FoldName = ''
-        for i in range(len(Str_split)-1):
-            FoldName = FoldName + Str_split[i]
+        elif opt in ("-t","--timing"):
+            timing_name = arg
+        elif opt in ("-p","--progress"):
+            progress = True
+        elif opt in ("-c","--checkpoint"):
+            checkpoint = psCheckpoint.Checkpoint(arg)
+        elif opt in ("-s","--stats"):
+            stats_name = arg
+            stats = psStats.MapStats()
+        elif opt in ("-b","--beam"):
+            fwhm = float(arg)
+        elif opt == "--beam-freq":
+            beam_freq = float(arg)
+        elif opt == "--cull":
+            cull = psCull.FluxCut(float(arg))
+        elif opt in ("-m","--max-memory"):
+            max_memory = arg
+    # Split to get folder name and file names, the catelogues separated
+    # by ',' should be in the same folder
+    ps_names = ps_name.split(',')
+    FoldName, FileName = os.path.split(ps_names[0])
+    FileNames = [os.path.basename(name) for name in ps_names]
+    if FoldName == '':
+        FoldName = "."
     # print
     print("FoldName: ",FoldName)
-    print("FileName: ",FileName)
+    print("FileName: ",', '.join(FileNames))
     print("nside: ",nside)
     print("frequency: ",freq)
-    # get pix_vec
-    if 'nside' not in dir():
-        nside = 512
-    if 'freq' not in dir():
-        freq = 150
-    pix_vec = draw_ps(nside,freq,FileName,FoldName)
-    # save
-    if 'fits_name' in dir():
-        write_fits_healpix(fits_name,pix_vec)
-    else:
+    if fits_name is None:
         fits_name = FoldName + '/PS_nside_' + str(nside) +'_'+str(freq)+ '.fits'
-        write_fits_healpix(fits_name,pix_vec)
+    beam = None if fwhm is None else psBeam.GaussianBeam(fwhm, beam_freq)
+    if checkpoint is not None and (len(FileNames) > 1 or beam is not None):
+        # draw_sky is not checkpointed
+        print("The checkpoint -c is only for one catelogue without -b")
+        print(usage)
+        sys.exit(2)
+
+    def draw():
+        if len(FileNames) == 1 and beam is None:
+            return draw_ps(nside,freq,FileName,FoldName,checkpoint,
+                           stats=stats,cull=cull,max_memory=max_memory)
+        return draw_sky(nside,freq,FileNames,FoldName,beam,stats=stats,
+                        cull=cull,max_memory=max_memory)
+
+    reporter = psProgress.ConsoleProgress() if progress else psProgress.Progress()
+    with psProgress.reporting(reporter):
+        if timing_name is None:
+            # get pix_vec
+            pix_vec = draw()
+            # save
+            write_map(fits_name,pix_vec)
+        else:
+            with psProfile.recording(FileName=timing_name):
+                pix_vec = draw()
+                write_map(fits_name,pix_vec)
+    if stats is not None:
+        stats.save(stats_name)
+    if cull is not None:
+        totals = cull.report()
+        print("Culled %d of %d sources, %.3g of the flux" % (
+            totals['NumCulled'], totals['NumPS'],
+            totals.get('flux fraction culled', 0)))
+    if max_memory is not None:
+        psMemory.report(max_memory)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
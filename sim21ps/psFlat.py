@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psFlat is designed to draw many FR radio galaxies on
+a flat-sky image, which is the vectorized version of SimAGNReal. The
+sources are rasterized as the SimAGNReal.Elp, i.e. the integer grid of
+the ellipse rotated and rounded to the pixels, but many sources at
+once over their own bounding boxes, and the sources of the same grid
+size are processed together. The brightness of the components is
+calculated once per component by psSpec, and the pixels are added to
+the image by scatter-add, so that the overlapping sources are summed
+rather than overwritten.
+
+The core is the ellipse of (core_maj, core_min, core_ang) at (x, y),
+and the two lobes are the ellipses of (lobe_maj, lobe_min) centered at
+lobe_maj from the core along lobe_ang + core_ang, in pixels and 1-based
+as SimAGNReal, i.e. the pixel (x, y) is image[y - 1, x - 1].
+
+Functions
+---------
+gen_frs: generate the catelogue of FRs as SimAGNReal.GenMultiFRs.
+
+raster_ellipses: the pixels of many ellipses.
+
+calc_brightness: the brightness of the components.
+
+draw_frs: draw the FRs onto the image.
+
+bin_sources: bin the sources to the tiles of the image.
+
+draw_tiled: draw the FRs onto the large image tile by tile in parallel.
+
+write_image: save the image into fits or npy.
+"""
+
+# Modules
+import sys
+import getopt
+import numpy as np
+from multiprocessing import Pool
+# Cumstom designed modules
+from . import psSpec
+from . import psTable
+from . import psProfile
+from . import psProgress
+from .psLazy import LazyModule
+# The heavy modules are imported on the first use
+fits = LazyModule('astropy.io.fits')
+
+# Names of the components, whose pixels are drawn by draw_frs
+Components = ['core', 'lobe']
+
+
+def gen_frs(NumFR, Rows=512, Cols=512, seed=None):
+    """
+    Generate the FRs with the distributions of SimAGNReal.GenMultiFRs,
+    and I_151 of each source, [Jy].
+
+    return
+    ------
+    PS_data: psTable.Catelogue
+    """
+    rng = np.random.RandomState(seed)
+    data = {'x': rng.uniform(1, Cols, NumFR),
+            'y': rng.uniform(1, Rows, NumFR),
+            'core_maj': rng.uniform(0, 1, NumFR),
+            'core_min': rng.uniform(0, 1, NumFR),
+            'core_ang': rng.uniform(-np.pi, np.pi, NumFR),
+            'lobe_maj': rng.uniform(0, 5, NumFR),
+            'lobe_min': rng.uniform(0, 2, NumFR),
+            'lobe_ang': rng.uniform(-np.pi, np.pi, NumFR),
+            'I_151 (Jy)': 10**rng.uniform(-4, -3, NumFR)}
+
+    return psTable.Catelogue.from_arrays(data, ClassType=4)
+
+
+def _grid_inside(maj, min_, a, b):
+    """
+    The integer grid of the bounding box of size (a, b), and the mask of
+    the grid points inside the ellipses of the sources, (NumPS, NumGrid).
+    """
+    x, y = np.meshgrid(np.arange(-a, a + 1), np.arange(-b, b + 1),
+                       indexing='ij')
+    x = x.ravel()
+    y = y.ravel()
+    # Focuses on the major axis, which is x unless min_ > maj
+    axis_max = np.maximum(maj, min_)[:, np.newaxis]
+    c = np.sqrt(np.abs(maj**2 - min_**2))[:, np.newaxis]
+    on_x = (maj >= min_)[:, np.newaxis]
+    fx = np.where(on_x, c, 0)
+    fy = np.where(on_x, 0, c)
+    dist = (np.sqrt((x - fx)**2 + (y - fy)**2) +
+            np.sqrt((x + fx)**2 + (y + fy)**2))
+
+    return x, y, dist <= 2 * axis_max
+
+
+def raster_ellipses(cx, cy, maj, min_, ang, Rows, Cols, chunk=100000,
+                    window=None):
+    """
+    Rasterize the ellipses, as SimAGNReal.Elp.genCore.
+
+    Parameters
+    ----------
+    cx, cy: np.ndarray(NumPS,)
+        The centers, 1-based pixels
+    maj, min_, ang: np.ndarray(NumPS,)
+        The semi-axes, [pixel], and the rotation angles, [rad]
+    Rows, Cols: int
+        Size of the image
+    chunk: int
+        Number of grid points processed at a time, to limit the memory
+    window: tuple
+        (row0, col0, rows, cols), the part of the image drawn, default
+        as the whole image
+
+    return
+    ------
+    pix, idx: np.ndarray
+        The flat pixels in the image, or in the window, and the sources
+        covering them
+    """
+    if window is None:
+        window = (0, 0, Rows, Cols)
+    row0, col0, rows, cols = window
+    if len(maj) == 0:
+        return np.zeros((0,), dtype=np.int64), np.zeros((0,), dtype=np.int64)
+    # The pixels in both the image and the window, 1-based
+    x_lo, x_hi = max(1, col0 + 1), min(Cols, col0 + cols)
+    y_lo, y_hi = max(1, row0 + 1), min(Rows, row0 + rows)
+    a = np.round(maj).astype(np.int64)
+    b = np.round(min_).astype(np.int64)
+    pix_list = []
+    idx_list = []
+    # The sources of the same bounding box are rasterized together
+    sizes, group = np.unique(a * (b.max() + 1) + b, return_inverse=True)
+    for g, size in enumerate(sizes):
+        a_g, b_g = divmod(int(size), int(b.max()) + 1)
+        members = np.flatnonzero(group == g)
+        step = max(1, chunk // ((2 * a_g + 1) * (2 * b_g + 1)))
+        for start in range(0, len(members), step):
+            src = members[start:start + step]
+            x, y, inside = _grid_inside(maj[src], min_[src], a_g, b_g)
+            i, k = np.nonzero(inside)
+            src = src[i]
+            cos, sin = np.cos(ang[src]), np.sin(ang[src])
+            x_r = np.round(x[k] * cos - y[k] * sin + cx[src]).astype(np.int64)
+            y_r = np.round(x[k] * sin + y[k] * cos + cy[src]).astype(np.int64)
+            valid = (x_r >= x_lo) & (x_r <= x_hi) & (y_r >= y_lo) & \
+                (y_r <= y_hi)
+            pix_list.append((y_r[valid] - 1 - row0) * cols +
+                            x_r[valid] - 1 - col0)
+            idx_list.append(src[valid])
+    if len(pix_list) == 0:
+        return np.zeros((0,), dtype=np.int64), np.zeros((0,), dtype=np.int64)
+
+    return np.concatenate(pix_list), np.concatenate(idx_list)
+
+
+def calc_brightness(PS_data, Freq, pixel_size=1.0, ClassType=4):
+    """
+    The brightness of the core and lobe of the FRs, i.e. the flux of the
+    component over the area of its ellipse, as SimAGNReal.Flux.Calc_Tb.
+
+    Parameters
+    ----------
+    PS_data: psTable.Catelogue
+        The FRs, see gen_frs
+    Freq: float
+        Frequency
+    pixel_size: float
+        Size of the pixels, [arcsec]
+
+    return
+    ------
+    Tb: np.ndarray(NumPS, 2)
+        The brightness of the core and lobe
+    """
+    engine = psSpec.SpecEngine(Freq)
+    alpha, beta = psSpec.get_params(PS_data, ClassType)
+    names = psSpec.get_components(ClassType)
+    arcsec = np.radians(pixel_size / 3600)
+    Tb = np.zeros((PS_data.shape[0], len(Components)))
+    for i, name in enumerate(Components):
+        c = names.index(name)
+        area = np.pi * PS_data[name + '_maj'] * PS_data[name + '_min'] * \
+            arcsec**2
+        Tb[:, i] = engine.Tb(area, PS_data['I_151 (Jy)'],
+                             alpha[:, c:c + 1], beta[:, c:c + 1])[:, 0, 0]
+
+    return Tb
+
+
+def footprint_frs(PS_data, Rows, Cols, window=None):
+    """
+    The pixels of the core (component 0) and lobes (component 1) of the
+    FRs in the image or the window, see raster_ellipses, each pixel is
+    counted once per component as SimAGNReal.
+
+    return
+    ------
+    pix, idx, comp: np.ndarray
+    """
+    npix = Rows * Cols if window is None else window[2] * window[3]
+    cx, cy = PS_data['x'], PS_data['y']
+    # Core
+    pix, idx = raster_ellipses(cx, cy, PS_data['core_maj'],
+                               PS_data['core_min'], PS_data['core_ang'],
+                               Rows, Cols, window=window)
+    pix_list = [pix]
+    idx_list = [idx]
+    comp_list = [np.zeros(len(pix), dtype=np.int8)]
+    # Lobes, on both sides of the core
+    maj = PS_data['lobe_maj']
+    ang = PS_data['lobe_ang'] + PS_data['core_ang']
+    for sign in (1, -1):
+        pix, idx = raster_ellipses(cx + sign * maj * np.cos(ang),
+                                   cy + sign * maj * np.sin(ang), maj,
+                                   PS_data['lobe_min'], ang, Rows, Cols,
+                                   window=window)
+        pix_list.append(pix)
+        idx_list.append(idx)
+        comp_list.append(np.ones(len(pix), dtype=np.int8))
+    pix = np.concatenate(pix_list)
+    idx = np.concatenate(idx_list)
+    comp = np.concatenate(comp_list)
+    # A pixel is filled once by a component of a source
+    key = np.unique((idx * 2 + comp) * npix + pix)
+
+    return key % npix, key // npix // 2, (key // npix % 2).astype(np.int8)
+
+
+def draw_frs(PS_data, Rows, Cols, Freq, pixel_size=1.0, image=None,
+             chunk=100000, window=None):
+    """
+    Draw the FRs onto the image.
+
+    Parameters
+    ----------
+    PS_data: psTable.Catelogue
+        The FRs, see gen_frs
+    Rows, Cols: int
+        Size of the image
+    Freq: float
+        Frequency
+    pixel_size: float
+        Size of the pixels, [arcsec]
+    image: np.ndarray(Rows, Cols)
+        The image to be added to, e.g. a np.memmap, or None for a new one
+    chunk: int
+        Number of sources drawn at a time
+    window: tuple
+        (row0, col0, rows, cols), if provided, only this part of the
+        image is drawn, and image is of (rows, cols)
+
+    return
+    ------
+    image: np.ndarray(Rows, Cols) or (rows, cols) of the window
+    """
+    if image is None:
+        shape = (Rows, Cols) if window is None else window[2:]
+        image = np.zeros(shape)
+    flat = image.reshape(-1)
+    NumPS = PS_data.shape[0]
+    psProgress.start(NumPS, 'draw FRs')
+    for start in range(0, NumPS, chunk):
+        PS_chunk = PS_data[start:start + chunk]
+        with psProfile.stage('calc_flux'):
+            Tb = calc_brightness(PS_chunk, Freq, pixel_size)
+        with psProfile.stage('footprint'):
+            pix, idx, comp = footprint_frs(PS_chunk, Rows, Cols, window)
+        with psProfile.stage('render'):
+            upix, inverse = np.unique(pix, return_inverse=True)
+            flat[upix] += np.bincount(inverse, weights=Tb[idx, comp],
+                                      minlength=len(upix))
+        psProfile.count('pixels_touched', len(pix))
+        psProgress.update(PS_chunk.shape[0], len(pix))
+    psProgress.finish()
+
+    return image
+
+
+def source_reach(PS_data):
+    """
+    The largest distance from the core center to the pixels of the
+    sources, [pixel], i.e. the half size of their bounding boxes.
+    """
+    core = np.hypot(np.round(PS_data['core_maj']),
+                    np.round(PS_data['core_min']))
+    lobe = PS_data['lobe_maj'] + np.hypot(np.round(PS_data['lobe_maj']),
+                                          np.round(PS_data['lobe_min']))
+
+    return np.maximum(core, lobe) + 1
+
+
+def plan_tiles(Rows, Cols, tile=4096):
+    """
+    The tiles of the image, [(row0, col0, rows, cols), ...]
+    """
+    return [(row0, col0, min(tile, Rows - row0), min(tile, Cols - col0))
+            for row0 in range(0, Rows, tile)
+            for col0 in range(0, Cols, tile)]
+
+
+def bin_sources(PS_data, Rows, Cols, tile=4096):
+    """
+    Bin the sources to the tiles overlapped by their bounding boxes, so
+    a source near the edges is drawn by the neighbouring tiles too, each
+    of which draws its own pixels.
+
+    return
+    ------
+    bins: list of np.ndarray
+        The rows of the sources of the tiles, in the order of plan_tiles
+    """
+    NumRow = (Rows + tile - 1) // tile
+    NumCol = (Cols + tile - 1) // tile
+    reach = source_reach(PS_data)
+    x = PS_data['x'] - 1
+    y = PS_data['y'] - 1
+    r0 = np.clip(np.floor((y - reach) / tile), 0, NumRow - 1).astype(int)
+    r1 = np.clip(np.floor((y + reach) / tile), 0, NumRow - 1).astype(int)
+    c0 = np.clip(np.floor((x - reach) / tile), 0, NumCol - 1).astype(int)
+    c1 = np.clip(np.floor((x + reach) / tile), 0, NumCol - 1).astype(int)
+    # Expand each source to the tiles of its bounding box
+    width = c1 - c0 + 1
+    count = (r1 - r0 + 1) * width
+    src = np.repeat(np.arange(len(count)), count)
+    k = np.arange(len(src)) - np.repeat(np.cumsum(count) - count, count)
+    tiles = (r0[src] + k // width[src]) * NumCol + c0[src] + k % width[src]
+    order = np.argsort(tiles, kind='stable')
+    offsets = np.searchsorted(tiles[order], np.arange(NumRow * NumCol + 1))
+
+    return [src[order[offsets[t]:offsets[t + 1]]]
+            for t in range(NumRow * NumCol)]
+
+
+def create_output(FileName, Rows, Cols, dtype=np.float64):
+    """
+    Create the output image of zeros on the disk, in fits or npy if
+    FileName ends with '.npy', without holding it in the memory.
+    """
+    dtype = np.dtype(dtype)
+    if FileName.endswith('.npy'):
+        image = np.lib.format.open_memmap(FileName, mode='w+', dtype=dtype,
+                                          shape=(Rows, Cols))
+        del image
+        return
+    header = fits.Header()
+    header['SIMPLE'] = True
+    header['BITPIX'] = -8 * dtype.itemsize
+    header['NAXIS'] = 2
+    header['NAXIS1'] = Cols
+    header['NAXIS2'] = Rows
+    header['EXTEND'] = True
+    header = header.tostring().encode('ascii')
+    size = Rows * Cols * dtype.itemsize
+    with open(FileName, 'wb') as fp:
+        fp.write(header)
+        # The data is padded to the blocks of 2880 bytes, and the file
+        # is sparse until the tiles are written
+        fp.truncate(len(header) + (size + 2879) // 2880 * 2880)
+
+
+def open_output(FileName):
+    """
+    Open the output image created by create_output as np.memmap.
+    """
+    if FileName.endswith('.npy'):
+        return np.lib.format.open_memmap(FileName, mode='r+')
+    with fits.open(FileName) as hdul:
+        offset = hdul.fileinfo(0)['datLoc']
+        header = hdul[0].header
+        shape = (header['NAXIS2'], header['NAXIS1'])
+        dtype = np.dtype('>f%d' % (abs(header['BITPIX']) // 8))
+
+    return np.memmap(FileName, dtype=dtype, mode='r+', offset=offset,
+                     shape=shape)
+
+
+def render_tile(OutName, Rows, Cols, window, PS_tile, Freq, pixel_size=1.0):
+    """
+    Draw the sources of the tile, and write the tile into the output,
+    the tiles are disjoint, so the workers write without locking.
+    """
+    row0, col0, rows, cols = window
+    image = draw_frs(PS_tile, Rows, Cols, Freq, pixel_size, window=window)
+    with psProfile.stage('write_tile'):
+        output = open_output(OutName)
+        output[row0:row0 + rows, col0:col0 + cols] = image
+        output.flush()
+        del output
+
+    return window
+
+
+def _render_tile_worker(args, recorded=False):
+    """
+    Draw the tile in a worker, with the psProfile report returned if
+    recorded.
+    """
+    if recorded:
+        with psProfile.recording() as recorder:
+            window = render_tile(*args)
+        return window, recorder.report()
+
+    return render_tile(*args), None
+
+
+def draw_tiled(PS_data, Rows, Cols, Freq, OutName, tile=4096, NumProc=1,
+               pixel_size=1.0, dtype=np.float64):
+    """
+    Draw the FRs onto the large image tile by tile, the tiles are drawn
+    in a pool of NumProc workers and written into the output fits or
+    npy file, so that neither the image nor the cost of a source scale
+    with the size of the image.
+
+    Parameters
+    ----------
+    PS_data: psTable.Catelogue
+        The FRs, see gen_frs
+    Rows, Cols: int
+        Size of the image
+    Freq: float
+        Frequency
+    OutName: str
+        Name of the output fits, or npy
+    tile: int
+        Size of the tiles, [pixel]
+    NumProc: int
+        Number of the workers
+    pixel_size: float
+        Size of the pixels, [arcsec]
+    dtype: np.dtype
+        Type of the output image
+
+    return
+    ------
+    OutName: str
+    """
+    create_output(OutName, Rows, Cols, dtype)
+    windows = plan_tiles(Rows, Cols, tile)
+    with psProfile.stage('bin_sources'):
+        bins = bin_sources(PS_data, Rows, Cols, tile)
+    tasks = [(OutName, Rows, Cols, window, PS_data.take(rows), Freq,
+              pixel_size) for window, rows in zip(windows, bins)
+             if len(rows) > 0]
+    if NumProc <= 1 or len(tasks) <= 1:
+        for args in tasks:
+            render_tile(*args)
+    else:
+        recorded = psProfile.enabled()
+        with Pool(min(NumProc, len(tasks))) as pool:
+            for window, report in pool.starmap(
+                    _render_tile_worker, [(args, recorded) for args in tasks]):
+                if report is not None:
+                    psProfile.merge(report)
+
+    return OutName
+
+
+def write_image(FileName, image):
+    """
+    Save the image into the fits, or npy if FileName ends with '.npy'.
+    """
+    if FileName.endswith('.npy'):
+        np.save(FileName, image)
+    else:
+        fits.writeto(FileName, np.asarray(image), overwrite=True)
+
+
+def main(argv):
+    """
+    A main function for use this module at the command window
+
+    example
+    -------
+    psFlat -n 100000 -r 4096 -c 4096 -f 150e6 -o FRs_150.fits
+    psFlat -n 10000000 -r 32768 -c 32768 -f 150e6 -o FRs_150.fits -t 4096
+    -j 8
+    """
+    usage = ("psFlat -n <number of FRs> -r <rows> -c <cols> "
+             "-f <frequency> -a <pixel size (arcsec)> -s <seed> "
+             "-o <Output fits or npy name> -t <tile size> "
+             "-j <number of workers>\n"
+             "The image is drawn tile by tile into the output if -t is "
+             "provided.")
+    try:
+        opts, args = getopt.getopt(
+            argv, "hn:r:c:f:a:s:o:t:j:",
+            ["number=", "rows=", "cols=", "freq=", "arcsec=", "seed=",
+             "outfile=", "tile=", "jobs="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    # Default
+    NumFR = 100
+    Rows = Cols = 512
+    Freq = 150e6
+    pixel_size = 1.0
+    seed = None
+    OutName = None
+    tile = None
+    NumProc = 1
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-n", "--number"):
+            NumFR = int(arg)
+        elif opt in ("-r", "--rows"):
+            Rows = int(arg)
+        elif opt in ("-c", "--cols"):
+            Cols = int(arg)
+        elif opt in ("-f", "--freq"):
+            Freq = float(arg)
+        elif opt in ("-a", "--arcsec"):
+            pixel_size = float(arg)
+        elif opt in ("-s", "--seed"):
+            seed = int(arg)
+        elif opt in ("-o", "--outfile"):
+            OutName = arg
+        elif opt in ("-t", "--tile"):
+            tile = int(arg)
+        elif opt in ("-j", "--jobs"):
+            NumProc = int(arg)
+    if OutName is None:
+        OutName = 'Img_' + str(Freq) + '.fits'
+    PS_data = gen_frs(NumFR, Rows, Cols, seed)
+    if tile is None:
+        image = draw_frs(PS_data, Rows, Cols, Freq, pixel_size)
+        write_image(OutName, image)
+    else:
+        draw_tiled(PS_data, Rows, Cols, Freq, OutName, tile, NumProc,
+                   pixel_size)
+    print("Saved %d FRs to %s" % (NumFR, OutName))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
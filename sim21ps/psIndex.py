@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psIndex is designed to sort the ps catelogues by the
+NESTED healpix pixels of the sources at a coarse nside, and to index the
+rows of each coarse pixel. Since the NESTED pixels close in number are
+close on the sky, the sorted sources are drawn with good locality, and a
+region of the sky maps to a few contiguous row ranges, which are read
+from the csv directly without scanning the whole file.
+
+Functions
+---------
+source_pix: the coarse NESTED pixels of the sources.
+
+build_index: sort the sources and get the row offsets of the pixels.
+
+region_pixels: the coarse pixels of a region with a halo margin.
+
+pixel_ranges: the row ranges of the coarse pixels.
+
+write_sorted: write the sorted catelogue and its index file.
+
+load_index, read_rows, read_region: read the rows of a region.
+"""
+
+# Modules
+import io
+import os
+import sys
+import getopt
+import numpy as np
+# Cumstom designed modules
+from .psLazy import LazyModule
+# The heavy modules are imported on the first use
+hp = LazyModule('healpy')
+pd = LazyModule('pandas')
+
+
+def source_pix(PS_data, nside_index=16):
+    """
+    The NESTED pixels of the centers of the sources at nside_index.
+    """
+    theta = np.asarray(PS_data['Theta (deg)']) / 180
+    phi = np.asarray(PS_data['Phi (deg)']) / 180
+
+    return hp.ang2pix(nside_index, theta, phi, nest=True)
+
+
+def build_index(PS_data, nside_index=16):
+    """
+    Sort the sources by their coarse NESTED pixels.
+
+    Parameters
+    ----------
+    PS_data: pandas.core.frame.DataFrame
+        Data of the point sources
+    nside_index: int and dyadic
+        nside of the coarse pixels, default as 16 (~3.7 deg)
+
+    return
+    ------
+    PS_sorted: pandas.core.frame.DataFrame
+        The sorted sources, the IDs are kept.
+    offsets: np.ndarray(12*nside_index^2+1,)
+        The rows of the coarse pixel p are offsets[p]:offsets[p+1].
+    """
+    pix = source_pix(PS_data, nside_index)
+    order = np.argsort(pix, kind='stable')
+    PS_sorted = PS_data.iloc[order]
+    offsets = np.searchsorted(pix[order], np.arange(12 * nside_index**2 + 1))
+
+    return PS_sorted, offsets
+
+
+def region_pixels(nside_index, pixels, halo=1):
+    """
+    The coarse pixels of the region, with halo rings of the neighbours,
+    so that the extended sources centered outside the region but
+    overlapping it are included.
+    """
+    pixels = np.unique(np.asarray(pixels, dtype=np.int64))
+    for i in range(halo):
+        neighbours = hp.get_all_neighbours(nside_index, pixels, nest=True)
+        neighbours = neighbours[neighbours >= 0]
+        pixels = np.union1d(pixels, neighbours)
+
+    return pixels
+
+
+def pixel_ranges(offsets, pixels):
+    """
+    The row (or byte) ranges of the coarse pixels, the adjacent ranges
+    are merged.
+
+    return
+    ------
+    ranges: list of tuple, [(start, stop), ...]
+    """
+    ranges = []
+    for p in np.unique(pixels):
+        start, stop = offsets[p], offsets[p + 1]
+        if start == stop:
+            continue
+        if len(ranges) > 0 and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], stop)
+        else:
+            ranges.append((start, stop))
+
+    return ranges
+
+
+def write_sorted(FileName, FoldName='PS_tables', nside_index=16,
+                 OutName=None):
+    """
+    Sort the csv catelogue, and save it with its index file, i.e.
+    OutName + '.idx.npz' with the row offsets and the byte offsets of
+    the coarse pixels.
+
+    Parameters
+    ----------
+    FileName: str
+        Name of the csv catelogue
+    FoldName: str
+        Name of the folder of the catelogues
+    nside_index: int and dyadic
+        nside of the coarse pixels
+    OutName: str
+        Name of the sorted catelogue, default as FileName with
+        '_sorted' appended, e.g. 'SF_100_20161009_205700_sorted.csv'
+
+    return
+    ------
+    OutName: str
+    """
+    if OutName is None:
+        OutName = os.path.splitext(FileName)[0] + '_sorted.csv'
+    # Parsed exactly, so the rows are written as the same text
+    PS_data = pd.read_csv(os.path.join(FoldName, FileName), index_col=0,
+                          float_precision='round_trip')
+    PS_sorted, offsets = build_index(PS_data, nside_index)
+    PathName = os.path.join(FoldName, OutName)
+    PS_sorted.to_csv(PathName)
+    # Byte offsets of the rows, the first line is the header
+    with open(PathName, 'rb') as fp:
+        content = np.frombuffer(fp.read(), dtype=np.uint8)
+    row_start = np.flatnonzero(content == ord('\n')) + 1
+    row_start = row_start[:len(PS_sorted) + 1]
+    np.savez(PathName + '.idx.npz', nside_index=nside_index,
+             offsets=offsets, byte_offsets=row_start[offsets])
+
+    return OutName
+
+
+def load_index(FileName, FoldName='PS_tables'):
+    """
+    Load the index file of the sorted catelogue.
+
+    return
+    ------
+    index: dict, {'nside_index', 'offsets', 'byte_offsets'}
+    """
+    PathName = os.path.join(FoldName, FileName) + '.idx.npz'
+    with np.load(PathName) as data:
+        index = {'nside_index': int(data['nside_index']),
+                 'offsets': data['offsets'],
+                 'byte_offsets': data['byte_offsets']}
+
+    return index
+
+
+def read_rows(FileName, FoldName, index, pixels):
+    """
+    Read the rows of the coarse pixels from the sorted catelogue, only
+    the bytes of the rows are read.
+
+    return
+    ------
+    PS_data: pandas.core.frame.DataFrame
+    """
+    PathName = os.path.join(FoldName, FileName)
+    byte_ranges = pixel_ranges(index['byte_offsets'], pixels)
+    with open(PathName, 'rb') as fp:
+        chunks = [fp.readline()]
+        for start, stop in byte_ranges:
+            fp.seek(start)
+            chunks.append(fp.read(stop - start))
+    PS_data = pd.read_csv(io.BytesIO(b''.join(chunks)), index_col=0)
+
+    return PS_data
+
+
+def read_region(FileName, FoldName, pixels, halo=1):
+    """
+    Read the sources of the region, i.e. the coarse pixels at the
+    nside_index of the index file, with halo rings of neighbours.
+    """
+    index = load_index(FileName, FoldName)
+    pixels = region_pixels(index['nside_index'], pixels, halo)
+
+    return read_rows(FileName, FoldName, index, pixels)
+
+
+def main(argv):
+    """
+    A main function for use this module at the command window
+
+    example
+    -------
+    psIndex -i PS_tables/SF_100_20161009_205700.csv -n 16
+    """
+    usage = ("psIndex -i <PS name (csv)> -o <Output sorted csv name> "
+             "-n <nside of the index>")
+    try:
+        opts, args = getopt.getopt(argv, "hi:o:n:",
+                                   ["infile=", "outfile=", "nside="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    ps_name = None
+    OutName = None
+    nside_index = 16
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-i", "--infile"):
+            ps_name = arg
+        elif opt in ("-o", "--outfile"):
+            OutName = os.path.basename(arg)
+        elif opt in ("-n", "--nside"):
+            nside_index = int(arg)
+    if ps_name is None:
+        print(usage)
+        sys.exit(2)
+    FoldName, FileName = os.path.split(ps_name)
+    if FoldName == '':
+        FoldName = '.'
+    OutName = write_sorted(FileName, FoldName, nside_index, OutName)
+    print("Sorted catelogue: ", os.path.join(FoldName, OutName))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psInterp is designed to draw the point sources at
+many fine frequency channels, by rendering the exact maps at a few
+anchor frequencies and interpolating every channel from them.
+
+The sources are grouped by their component and the bins of the spectral
+index alpha and curvature beta, and the anchor maps of each group are
+kept on the pixels touched by the group. Since the spectra are smooth
+in log space, a channel is interpolated per pixel linearly in log10 Tb
+and x = log10(Freq / 151MHz) between the two adjacent anchors, with the
+curvature of the group taken out. A group of one spectrum is exact, and
+for a group whose alpha spans a and beta spans b, the error of log10 Tb
+is bounded by (x - x_k) * (x_k+1 - x) / 2 * max|f''| with
+
+    max|f''| = b + ln(10) * (a + 2 * b * X)^2 / 4,
+
+where X is the largest |x| of the anchors, which is reported by
+error_bound and can be checked against the exact maps by measure_error.
+
+Classes
+-------
+AnchorRenderer: class
+    The anchor maps of the groups and the interpolation of channels.
+
+Functions
+---------
+measure_error: the error of the interpolated channels versus the exact
+rendering.
+
+example
+-------
+>>> renderer = AnchorRenderer(512, [120e6, 150e6, 180e6])
+>>> renderer.add('PS_tables/SF_100_spec.csv')
+>>> for Freq, pix_vec in renderer.iter_channels(np.arange(120e6, 180e6, 1e5)):
+...     pass
+"""
+
+# Modules
+import os
+import sys
+import getopt
+import numpy as np
+# Cumstom designed modules
+from . import psDraw
+from . import psBatch
+from . import psSpec
+from . import psTable
+from . import psProfile
+from . import psProgress
+from . import psWriter
+
+
+class AnchorRenderer:
+    """
+    Render the point sources at the anchor frequencies and interpolate
+    the channels in between.
+
+    Parameters
+    ----------
+    nside: int and dyadic
+        Number of subpixel in a healpix cell
+    anchors: list of float
+        The anchor frequencies, at least two, [Hz]
+    dalpha: float
+        Width of the bins of alpha, or None to group the sources by the
+        components only.
+    dbeta: float
+        Width of the bins of beta, or None as dalpha
+    nest: bool
+        Whether the maps are in NESTED ordering
+    chunk: int
+        Number of sources processed at a time
+
+    Attributes
+    ----------
+    groups: dict
+        The groups of the sources, {(component, alpha bin, beta bin):
+        {'pix', 'maps', 'alpha', 'beta', 'NumPS'}}, where maps are the
+        (NumAnchor, len(pix)) brightness on the pixels pix, and alpha
+        and beta are the [min, max] of the group.
+    """
+
+    def __init__(self, nside, anchors, dalpha=0.05, dbeta=0.05, nest=False,
+                 chunk=10000):
+        anchors = np.unique(np.asarray(anchors, dtype=np.float64))
+        if len(anchors) < 2:
+            raise ValueError("At least two distinct anchor frequencies "
+                             "are needed")
+        self.nside = nside
+        self.npix = 12 * nside**2
+        self.nest = nest
+        self.chunk = chunk
+        self.dalpha = dalpha
+        self.dbeta = dbeta
+        self.engine = psSpec.SpecEngine(anchors, chunk=chunk)
+        self.anchors = self.engine.Freqs
+        self.x = self.engine.x
+        self.groups = {}
+        # Samples of the groups not merged yet, {key: [(pix, weights)]}
+        self._pending = {}
+        # The groups flattened for the interpolation
+        self._flat = None
+
+    def _bins(self, values, width):
+        if width is None:
+            return np.zeros(values.shape, dtype=np.int64)
+
+        return np.floor(values / width).astype(np.int64)
+
+    def add_class(self, ClassType, PS_data):
+        """
+        Add the sources of ClassType, whose catelogue should provide
+        'I_151 (Jy)', to the anchor maps of their groups.
+        """
+        PS_data = psTable.as_catelogue(PS_data, ClassType)
+        if 'I_151 (Jy)' not in PS_data:
+            raise ValueError("The catelogue should provide 'I_151 (Jy)'")
+        names = psSpec.get_components(ClassType)
+        dbeta = self.dalpha if self.dbeta is None else self.dbeta
+        psProgress.start(PS_data.shape[0],
+                         'anchors ' + psTable.ClassList[ClassType - 1])
+        for start, stop, Tb in self.engine.iter_Tb(PS_data, ClassType):
+            PS_chunk = PS_data[start:stop]
+            alpha, beta = psSpec.get_params(PS_chunk, ClassType)
+            pix, idx, comp, nhit = psDraw.calc_footprint(
+                self.nside, PS_chunk, ClassType, nest=self.nest,
+                chunk=self.chunk)
+            with psProfile.stage('anchors'):
+                alpha_bin = self._bins(alpha, self.dalpha)
+                beta_bin = self._bins(beta, None if self.dalpha is None
+                                      else dbeta)
+                for c, name in enumerate(names):
+                    for a, b in set(zip(alpha_bin[:, c], beta_bin[:, c])):
+                        members = (alpha_bin[:, c] == a) & \
+                            (beta_bin[:, c] == b)
+                        self._add_members(
+                            (name, a, b), members, alpha[:, c], beta[:, c])
+                        hit = (comp == c) & members[idx]
+                        weights = Tb[idx[hit], c, :] * nhit[hit, np.newaxis]
+                        self._pending[(name, a, b)].append(
+                            (pix[hit], weights))
+        psProgress.finish()
+        self._merge()
+
+        return self
+
+    def _add_members(self, key, members, alpha, beta):
+        if key not in self.groups:
+            self.groups[key] = {'pix': np.zeros((0,), dtype=np.int64),
+                                'maps': np.zeros((len(self.anchors), 0)),
+                                'alpha': [np.inf, -np.inf],
+                                'beta': [np.inf, -np.inf], 'NumPS': 0}
+            self._pending[key] = []
+        group = self.groups[key]
+        group['alpha'] = [min(group['alpha'][0], alpha[members].min()),
+                          max(group['alpha'][1], alpha[members].max())]
+        group['beta'] = [min(group['beta'][0], beta[members].min()),
+                         max(group['beta'][1], beta[members].max())]
+        group['NumPS'] += int(members.sum())
+
+    def _merge(self):
+        """
+        Merge the pending samples of the groups onto their pixels.
+        """
+        with psProfile.stage('merge_anchors'):
+            for key, samples in self._pending.items():
+                if len(samples) == 0:
+                    continue
+                group = self.groups[key]
+                pix = np.concatenate([group['pix']] +
+                                     [s[0] for s in samples])
+                weights = np.concatenate([group['maps'].T] +
+                                         [s[1] for s in samples])
+                upix, inverse = np.unique(pix, return_inverse=True)
+                maps = np.zeros((len(self.anchors), len(upix)))
+                for i in range(len(self.anchors)):
+                    maps[i] = np.bincount(inverse, weights=weights[:, i],
+                                          minlength=len(upix))
+                group['pix'] = upix
+                group['maps'] = maps
+                samples.clear()
+        self._flat = None
+
+    def _flatten(self):
+        """
+        The log10 anchor maps of all the groups concatenated, with the
+        curvature of their groups, and the pixels they are added to.
+        """
+        if self._flat is None:
+            groups = [group for group in self.groups.values()
+                      if len(group['pix']) > 0]
+            pix = np.concatenate([group['pix'] for group in groups])
+            log_maps = np.log10(np.concatenate(
+                [group['maps'] for group in groups], axis=1))
+            beta = np.concatenate([
+                np.full(len(group['pix']), sum(group['beta']) / 2)
+                for group in groups])
+            upix, inverse = np.unique(pix, return_inverse=True)
+            self._flat = (upix, inverse, log_maps, beta)
+
+        return self._flat
+
+    def add(self, catelogue, FoldName=None):
+        """
+        Add the csv catelogue, see psRender.SkyRenderer.add
+        """
+        if FoldName is None:
+            FoldName, FileName = os.path.split(catelogue)
+            if FoldName == '':
+                FoldName = '.'
+        else:
+            FileName = catelogue
+        ClassType, PS_data = psDraw.read_csv(FileName, FoldName)
+
+        return self.add_class(ClassType, PS_data)
+
+    def _interval(self, Freq):
+        """
+        The index k of the anchors, such that x_k <= x <= x_k+1, x and t
+        with x = x_k + t * (x_k+1 - x_k).
+        """
+        if Freq < self.anchors[0] or Freq > self.anchors[-1]:
+            raise ValueError("Frequency %g is out of the anchors [%g, %g]" %
+                             (Freq, self.anchors[0], self.anchors[-1]))
+        x = np.log10(Freq) - psSpec.LOG_FREQ0
+        k = min(np.searchsorted(self.x, x, side='right') - 1,
+                len(self.x) - 2)
+        h = self.x[k + 1] - self.x[k]
+
+        return k, x, (x - self.x[k]) / h
+
+    def channel(self, Freq, out=None):
+        """
+        The map at the frequency Freq interpolated from the anchor maps.
+
+        Parameters
+        ----------
+        Freq: float
+            The frequency, within the anchor frequencies
+        out: np.ndarray(12*nside^2,)
+            The map to be filled, or None for a new one
+
+        return
+        ------
+        pix_vec: np.ndarray(12*nside^2,)
+        """
+        k, x, t = self._interval(Freq)
+        h = self.x[k + 1] - self.x[k]
+        if out is None:
+            out = np.zeros((self.npix,))
+        else:
+            out[:] = 0
+        if len(self.groups) == 0:
+            return out
+        upix, inverse, log_maps, beta = self._flatten()
+        with psProfile.stage('interp'):
+            # The linear part of log10 Tb is interpolated exactly, and the
+            # curvature of the groups is added back
+            log_Tb = (1 - t) * log_maps[k] + t * log_maps[k + 1]
+            log_Tb -= beta * (t * (1 - t) * h * h)
+            out[upix] = np.bincount(inverse, weights=10**log_Tb,
+                                    minlength=len(upix))
+        psProfile.count('channels', 1)
+
+        return out
+
+    def iter_channels(self, Freqs):
+        """
+        Iterate the interpolated channels.
+
+        yield
+        -----
+        Freq, pix_vec: the map is reused by the following channel
+        """
+        pix_vec = np.zeros((self.npix,))
+        for Freq in Freqs:
+            yield Freq, self.channel(Freq, out=pix_vec)
+
+    def error_bound(self, Freq):
+        """
+        The bound of the relative error of the pixels of the channel
+        versus the exact rendering, see the module document.
+        """
+        k, x, t = self._interval(Freq)
+        h = self.x[k + 1] - self.x[k]
+        X = np.abs(self.x).max()
+        bound = 0.0
+        for group in self.groups.values():
+            a = group['alpha'][1] - group['alpha'][0]
+            b = group['beta'][1] - group['beta'][0]
+            d2f = b + np.log(10) * (a + 2 * b * X)**2 / 4
+            bound = max(bound, t * (1 - t) * h * h / 2 * d2f)
+
+        return 10**bound - 1
+
+
+def measure_error(renderer, catelogues, Freqs):
+    """
+    The error of the interpolated channels versus the exact rendering of
+    psDraw.draw_channels.
+
+    Parameters
+    ----------
+    renderer: AnchorRenderer
+        The renderer with the catelogues added
+    catelogues: list of tuple
+        The (ClassType, PS_data) added to the renderer
+    Freqs: list of float
+        The frequencies to check, e.g. the midpoints of the anchors
+
+    return
+    ------
+    errors: list of dict
+        The maximum relative error of the pixels, the relative error of
+        the total and the bound of each frequency.
+    """
+    exact = np.zeros((len(Freqs), renderer.npix))
+    for ClassType, PS_data in catelogues:
+        exact += psDraw.draw_channels(renderer.nside, PS_data, ClassType,
+                                      Freqs, chunk=renderer.chunk,
+                                      nest=renderer.nest)
+    errors = []
+    for i, Freq in enumerate(Freqs):
+        pix_vec = renderer.channel(Freq)
+        nonzero = exact[i] > 0
+        rel = np.abs(pix_vec[nonzero] / exact[i][nonzero] - 1)
+        errors.append({'Freq': float(Freq),
+                       'max': float(rel.max()) if rel.size else 0.0,
+                       'total': float(abs(pix_vec.sum() / exact[i].sum() - 1))
+                       if nonzero.any() else 0.0,
+                       'bound': float(renderer.error_bound(Freq))})
+
+    return errors
+
+
+def main(argv):
+    """
+    A main function for use this module at the command window
+
+    example
+    -------
+    psInterp -i PS_tables/SF_100_spec.csv,PS_tables/FRI_100_spec.csv
+    -o PS_maps -n 512 -a 120e6,150e6,180e6 -f 120e6:180e6:0.1e6 -e
+    """
+    usage = ("psInterp -i <PS names (csv)> -o <Output folder> "
+             "-n <nside> -a <anchor frequencies> "
+             "-f <frequency list or start:stop:step> "
+             "-d <width of the alpha bins> -e (check the errors)")
+    try:
+        opts, args = getopt.getopt(
+            argv, "hi:o:n:a:f:d:e",
+            ["infile=", "outfold=", "nside=", "anchors=", "freq=",
+             "dalpha=", "errors"])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    # Default
+    ps_names = []
+    OutFold = '.'
+    nside = 512
+    anchors = None
+    freqs = None
+    dalpha = 0.05
+    check = False
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-i", "--infile"):
+            ps_names.extend(arg.split(','))
+        elif opt in ("-o", "--outfold"):
+            OutFold = arg
+        elif opt in ("-n", "--nside"):
+            nside = int(arg)
+        elif opt in ("-a", "--anchors"):
+            anchors = psBatch.parse_freqs(arg)
+        elif opt in ("-f", "--freq"):
+            freqs = psBatch.parse_freqs(arg)
+        elif opt in ("-d", "--dalpha"):
+            dalpha = None if arg == 'none' else float(arg)
+        elif opt in ("-e", "--errors"):
+            check = True
+    if len(ps_names) == 0 or freqs is None:
+        print(usage)
+        sys.exit(2)
+    if os.path.exists(OutFold) == False:
+        os.makedirs(OutFold)
+    if anchors is None and min(freqs) == max(freqs):
+        # Nothing to interpolate, the frequency is drawn directly
+        for Freq in freqs:
+            pix_vec = np.zeros((12 * nside**2,))
+            for name in ps_names:
+                FoldName, FileName = os.path.split(name)
+                ClassType, PS_data = psDraw.read_csv(FileName,
+                                                     FoldName or '.')
+                pix_vec += psDraw.draw_channels(nside, PS_data, ClassType,
+                                                [Freq])[0]
+            psDraw.write_map(os.path.join(
+                OutFold, 'PS_nside_' + str(nside) + '_' + str(Freq) +
+                '.fits'), pix_vec)
+        print("Saved %d maps to %s" % (len(freqs), OutFold))
+        return
+    if anchors is None:
+        anchors = [min(freqs), (min(freqs) + max(freqs)) / 2, max(freqs)]
+    renderer = AnchorRenderer(nside, anchors, dalpha=dalpha)
+    catelogues = []
+    for name in ps_names:
+        FoldName, FileName = os.path.split(name)
+        ClassType, PS_data = psDraw.read_csv(FileName, FoldName or '.')
+        renderer.add_class(ClassType, PS_data)
+        catelogues.append((ClassType, PS_data))
+    print("Groups: ", len(renderer.groups))
+    print("Anchors: ", renderer.anchors.tolist())
+    # The channels of iter_channels share one buffer, so they are copied
+    with psWriter.MapWriter() as writer:
+        for Freq, pix_vec in renderer.iter_channels(freqs):
+            writer.submit(os.path.join(
+                OutFold, 'PS_nside_' + str(nside) + '_' + str(Freq) +
+                '.fits'), pix_vec, copy=True)
+    print("Saved %d maps to %s" % (len(freqs), OutFold))
+    if check:
+        mids = np.sqrt(renderer.anchors[:-1] * renderer.anchors[1:])
+        for error in measure_error(renderer, catelogues, mids):
+            print("Freq %g: max %.3e total %.3e bound %.3e" % (
+                error['Freq'], error['max'], error['total'], error['bound']))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
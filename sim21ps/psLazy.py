@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psLazy is designed to import the heavy dependencies,
+e.g. healpy, pandas and astropy, on their first use rather than at the
+import of the sim21ps modules, so that importing sim21ps and printing
+the usage of the scripts are cheap. They are imported once, and then
+used as the modules themselves.
+
+Classes
+-------
+LazyModule: class
+    A module imported on the first access of its attributes.
+
+example
+-------
+>>> hp = LazyModule('healpy')
+>>> npix = hp.nside2npix(512)  # healpy is imported here
+"""
+
+# Modules
+import importlib
+
+
+class LazyModule:
+    """
+    A proxy of the module, which is imported by importlib.import_module
+    on the first access of its attributes.
+
+    Parameters
+    ----------
+    name: str
+        Name of the module, e.g. 'healpy' or '.basic_params'
+    package: str
+        The package to resolve the relative name, e.g. __package__
+    """
+
+    def __init__(self, name, package=None):
+        self._name = name
+        self._package = package
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name, self._package)
+
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return "<lazy module '%s' (%s)>" % (self._name, state)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psMemory is designed to keep the generation of the
+catelogues and the drawing of the maps under a memory budget, e.g. the
+memory request of a batch job. The memory per source is calibrated on a
+small sample of the sources traced by tracemalloc, and the memory per
+pixel is 8 bytes per map, from which the chunk of the sources, the
+accumulation of the map (dense in memory, or memmap in a temporary file
+if the map itself does not fit), and the number of workers are chosen.
+The peak RSS is reported against the budget at the end.
+
+The pages of a memmap are counted in the RSS while they are dirty, but
+they are written back and reclaimed by the system under pressure, unlike
+the dense maps.
+
+Functions
+---------
+parse_size: parse the sizes, e.g. '4G' or '512M'.
+
+current_rss: the resident memory of this process.
+
+peak_rss: the peak resident memory of this process and the workers.
+
+calibrate: the peak memory per item of a function.
+
+plan_draw: the chunk and accumulation of drawing a catelogue.
+
+plan_map: the accumulation of a map.
+
+plan_catelogue: check the generation of a catelogue.
+
+plan_workers: the number of workers of the jobs.
+
+report: the peak RSS against the budget.
+
+example
+-------
+>>> pix_vec = psDraw.draw_ps(1024, 150e6, 'SF_1000000_spec.csv',
+...                          max_memory='2G')
+>>> psMemory.report('2G')
+"""
+
+# Modules
+import os
+import sys
+import tempfile
+import tracemalloc
+import numpy as np
+# Cumstom designed modules
+from . import psDraw
+from . import psProfile
+
+# The fraction of the budget kept free for the interpreter and the
+# errors of the estimates
+MARGIN = 0.1
+# The smallest chunk of sources
+MIN_CHUNK = 100
+
+_units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+
+
+def parse_size(SizeStr):
+    """
+    Parse the size in bytes, e.g. '4G', '512M', '1.5e9' or 2**30.
+    """
+    if not isinstance(SizeStr, str):
+        return int(SizeStr)
+    SizeStr = SizeStr.strip().upper().rstrip('B')
+    if SizeStr[-1:] in _units:
+        return int(float(SizeStr[:-1]) * _units[SizeStr[-1]])
+
+    return int(float(SizeStr))
+
+
+def format_size(size):
+    for unit in ('T', 'G', 'M', 'K'):
+        if size >= _units[unit]:
+            return '%.2f%s' % (size / _units[unit], unit)
+
+    return '%dB' % size
+
+
+def peak_rss(children=False):
+    """
+    The peak resident memory of this process, or of the largest of the
+    terminated workers if children, [B].
+    """
+    import resource
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    maxrss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in KB on Linux
+
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def current_rss():
+    """
+    The resident memory of this process, [B], the peak if unknown.
+    """
+    try:
+        with open('/proc/self/statm') as fp:
+            pages = int(fp.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def calibrate(func, NumItem):
+    """
+    The peak memory allocated by func(NumItem) per item, traced by
+    tracemalloc, [B]. func(1) is run first untraced, so the lazy imports
+    are not counted. The state of np.random is restored, so the results
+    drawn later are not changed.
+    """
+    state = np.random.get_state()
+    try:
+        func(1)
+    finally:
+        np.random.set_state(state)
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    elif hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        with psProfile.stage('calibrate_memory'):
+            func(NumItem)
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+        np.random.set_state(state)
+
+    return max(peak, 0) / max(NumItem, 1)
+
+
+def _draw_cost(nside, PS_data, ClassType, Freq, NumSample):
+    """
+    The peak memory per source of calc_flux, calc_footprint and the
+    accumulation, calibrated on the sources sampled evenly.
+    """
+    NumPS = PS_data.shape[0]
+    rows = np.linspace(0, NumPS - 1, min(NumSample, NumPS)).astype(np.int64)
+    PS_sample = PS_data.take(rows)
+
+    def draw(NumItem):
+        PS_chunk = PS_sample[:NumItem]
+        PS_flux_list = psDraw.calc_flux(ClassType, Freq, PS_chunk)
+        footprint = psDraw.calc_footprint(nside, PS_chunk, ClassType,
+                                          chunk=NumItem)
+        # The temporaries of accumulate_footprint, i.e. the weights and
+        # the unique pixels
+        pix = footprint[0]
+        np.unique(pix, return_inverse=True)
+        PS_flux_list.reshape(NumItem, -1)[footprint[1], 0] * footprint[3]
+
+    return calibrate(draw, len(rows))
+
+
+def plan_draw(nside, PS_data, ClassType, Freq, max_memory, NumMaps=1,
+              NumSample=256):
+    """
+    Plan the drawing of the catelogue under the budget.
+
+    Parameters
+    ----------
+    max_memory: int or str
+        The budget of the process, e.g. '4G'
+    NumMaps: int
+        Number of the maps accumulated
+
+    return
+    ------
+    plan: dict
+        'chunk', 'accumulation' ('dense' or 'memmap') and the estimates
+        of the memory, [B]
+    """
+    budget = parse_size(max_memory)
+    NumPS = PS_data.shape[0]
+    base = current_rss()
+    map_bytes = 8 * 12 * nside**2 * NumMaps
+    per_source = _draw_cost(nside, PS_data, ClassType, Freq, NumSample) \
+        if NumPS > 0 else 0
+    free = budget * (1 - MARGIN) - base
+    min_bytes = min(MIN_CHUNK, max(NumPS, 1)) * per_source
+    if free >= map_bytes + min_bytes:
+        accumulation = 'dense'
+        free -= map_bytes
+    else:
+        accumulation = 'memmap'
+    if free < min_bytes:
+        raise MemoryError(
+            "The budget %s is too small, %s used and %s per source" % (
+                format_size(budget), format_size(base),
+                format_size(per_source)))
+    chunk = NumPS if per_source == 0 else int(free // per_source)
+    chunk = max(min(chunk, NumPS), min(MIN_CHUNK, NumPS), 1)
+
+    return {'chunk': chunk, 'accumulation': accumulation,
+            'max_memory (B)': budget, 'base (B)': base,
+            'per_source (B)': per_source, 'maps (B)': map_bytes,
+            'estimate (B)': base + chunk * per_source +
+            (map_bytes if accumulation == 'dense' else 0)}
+
+
+def plan_map(nside, max_memory, NumMaps=1):
+    """
+    The accumulation of a map, 'dense' if NumMaps maps fit in the budget
+    with this process, or 'memmap'.
+    """
+    free = parse_size(max_memory) * (1 - MARGIN) - current_rss()
+    if free >= 8 * 12 * nside**2 * NumMaps:
+        return 'dense'
+
+    return 'memmap'
+
+
+def create_map(npix, accumulation='dense', FoldName=None):
+    """
+    The zero map of the accumulation, the memmap is in a temporary file
+    in FoldName, which is removed when the map is released.
+    """
+    if accumulation == 'dense':
+        return np.zeros((npix,))
+    fd, path = tempfile.mkstemp(suffix='.npy', dir=FoldName)
+    os.close(fd)
+    pix_vec = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                                        shape=(npix,))
+    try:
+        # The mapping is kept after the file is unlinked on POSIX
+        os.unlink(path)
+    except OSError:
+        pass
+
+    return pix_vec
+
+
+def plan_catelogue(generator, NumPS, max_memory, batch=None,
+                   NumSample=200):
+    """
+    Check that the generation of NumPS sources by generator.save_table
+    fits in the budget, where the table, its columnar copy and the frame
+    written into csv are 3 copies of NumPS rows, and the memory per
+    source of a batch is calibrated on generator.gen_batch. The batch is
+    never changed, since it changes the sources generated at the seed,
+    and MemoryError is raised if it does not fit.
+    """
+    budget = parse_size(max_memory)
+    base = current_rss()
+    table_bytes = 3 * NumPS * (generator.nCols + 1) * 8
+    free = budget * (1 - MARGIN) - base - table_bytes
+    if free < 0:
+        raise MemoryError(
+            "The budget %s is too small for the table of %d sources, "
+            "%s used and %s for the table" % (
+                format_size(budget), NumPS, format_size(base),
+                format_size(table_bytes)))
+    if batch is None or NumPS == 0:
+        return
+    NumItem = min(NumSample, NumPS, batch)
+    per_source = calibrate(generator.gen_batch, NumItem)
+    if min(batch, NumPS) * per_source > free:
+        raise MemoryError(
+            "The budget %s is too small for the batch of %d sources, "
+            "%s per source, use a batch up to %d" % (
+                format_size(budget), batch, format_size(per_source),
+                free // max(per_source, 1)))
+
+
+def plan_workers(job_bytes, max_memory, NumProc):
+    """
+    The number of workers, up to NumProc, whose largest jobs fit in the
+    budget with this process.
+
+    Parameters
+    ----------
+    job_bytes: list of int
+        The estimated memory of the jobs, [B]
+    """
+    budget = parse_size(max_memory) * (1 - MARGIN) - current_rss()
+    largest = sorted(job_bytes, reverse=True)
+    for n in range(min(NumProc, len(largest)), 1, -1):
+        # Each worker is a fork of this process, with its own job
+        if sum(largest[:n]) + n * current_rss() <= budget:
+            return n
+
+    return 1
+
+
+def report(max_memory=None):
+    """
+    The peak RSS of this process and of the largest worker, against the
+    budget, printed and returned.
+    """
+    result = {'peak_rss (B)': peak_rss(),
+              'peak_rss_workers (B)': peak_rss(children=True)}
+    line = "Peak RSS %s, workers %s" % (
+        format_size(result['peak_rss (B)']),
+        format_size(result['peak_rss_workers (B)']))
+    if max_memory is not None:
+        budget = parse_size(max_memory)
+        result['max_memory (B)'] = budget
+        result['within'] = max(result['peak_rss (B)'],
+                               result['peak_rss_workers (B)']) <= budget
+        line += ", budget %s, %s" % (
+            format_size(budget), 'within' if result['within'] else 'EXCEEDED')
+    print(line)
+
+    return result
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psPartition is designed to draw the large maps, e.g.
+nside of 8192 or above, by partitioning the sky into the NESTED pixels
+of a coarse nside_region, i.e. the 12 base pixels or finer. The map
+pixels of a region are contiguous in the NESTED ordering, so each region
+owns a slab of the map.
+
+Each region is drawn by an independent worker, which reads the sources
+of the region and its halo from the sorted catelogues (psIndex), so that
+the extended lobes centered outside but overlapping the region are
+drawn too, and writes the pixels it owns only into its slab file. The
+workers share nothing but the plan and the output folder, so they can
+run on other nodes via a shared filesystem. The merge step places the
+slabs into the map, which has no double counting at the boundaries.
+
+The catelogues should provide 'I_151 (Jy)', so that a source drawn by
+several regions has the same flux, see psSpec.
+
+Functions
+---------
+region_range: the NESTED map pixels owned by a region.
+
+halo_rings: the halo rings needed for the sources of an extent.
+
+make_plan, save_plan, load_plan: the plan of the partitioned drawing.
+
+render_region: draw one region and write its slab.
+
+run_local: draw the regions in a pool of workers.
+
+merge: merge the slabs into the map of a frequency.
+"""
+
+# Modules
+import os
+import sys
+import json
+import getopt
+import numpy as np
+from multiprocessing import Pool
+# Cumstom designed modules
+from . import psDraw
+from . import psBatch
+from . import psIndex
+from . import psSpec
+from . import psTable
+from . import psProfile
+from . import psProgress
+from . import psWriter
+from .psLazy import LazyModule
+# The heavy modules are imported on the first use
+hp = LazyModule('healpy')
+
+
+def region_range(nside, nside_region, region):
+    """
+    The NESTED pixels of the map at nside owned by the region, i.e. the
+    NESTED pixel region at nside_region, are start:stop.
+    """
+    size = (nside // nside_region)**2
+
+    return region * size, (region + 1) * size
+
+
+def index_pixels(nside_index, nside_region, region, halo=1):
+    """
+    The coarse pixels of the index covering the region, with halo rings
+    of the neighbours.
+    """
+    if nside_region <= nside_index:
+        size = (nside_index // nside_region)**2
+        pixels = np.arange(region * size, (region + 1) * size)
+    else:
+        pixels = [region // (nside_region // nside_index)**2]
+
+    return psIndex.region_pixels(nside_index, pixels, halo)
+
+
+def halo_rings(nside_index, extent):
+    """
+    The number of halo rings of the coarse pixels to cover the sources
+    extended up to extent from their centers, [rad], conservatively as
+    a ring is at least half of the pixel resolution wide.
+    """
+    return max(1, int(np.ceil(extent / (hp.nside2resol(nside_index) / 2))))
+
+
+def make_plan(catelogues, nside, Freqs, OutFold, nside_region=1, halo=1,
+              chunk=10000):
+    """
+    The plan of the partitioned drawing.
+
+    Parameters
+    ----------
+    catelogues: list of str
+        The sorted csv catelogues with their index files, see
+        psIndex.write_sorted
+    nside: int and dyadic
+        nside of the maps
+    Freqs: list of float
+        The frequencies
+    OutFold: str
+        The folder of the slabs, shared by the workers
+    nside_region: int and dyadic
+        nside of the regions, 1 for the 12 base pixels
+    halo: int
+        Number of halo rings of the coarse pixels, see halo_rings
+    chunk: int
+        Number of sources drawn at a time
+
+    return
+    ------
+    plan: dict
+    """
+    if nside_region > nside:
+        raise ValueError("nside_region %d is finer than nside %d" %
+                         (nside_region, nside))
+    for name in catelogues:
+        if os.path.exists(name + '.idx.npz') == False:
+            raise ValueError("%s is not indexed, see psIndex.write_sorted" %
+                             name)
+    plan = {'catelogues': list(catelogues), 'nside': nside,
+            'Freqs': [float(Freq) for Freq in Freqs], 'OutFold': OutFold,
+            'nside_region': nside_region, 'halo': halo, 'chunk': chunk,
+            'regions': list(range(12 * nside_region**2))}
+
+    return plan
+
+
+def save_plan(plan, FileName):
+    with open(FileName, 'w') as fp:
+        json.dump(plan, fp, indent=1)
+
+
+def load_plan(FileName):
+    with open(FileName, 'r') as fp:
+        return json.load(fp)
+
+
+def slab_name(plan, region):
+    return os.path.join(plan['OutFold'], 'slab_%d_%d.npy' % (
+        plan['nside_region'], region))
+
+
+def render_region(plan, region):
+    """
+    Draw the region of the plan, and write its slab, i.e. the
+    (NumFreq, stop - start) brightness of the pixels start:stop owned by
+    the region, atomically into the output folder.
+
+    return
+    ------
+    SlabName: str
+    """
+    nside = plan['nside']
+    chunk = plan['chunk']
+    start, stop = region_range(nside, plan['nside_region'], region)
+    engine = psSpec.SpecEngine(plan['Freqs'], chunk=chunk)
+    slab = np.zeros((len(engine.Freqs), stop - start))
+    for name in plan['catelogues']:
+        FoldName, FileName = os.path.split(name)
+        FoldName = FoldName or '.'
+        ClassType = psTable.ClassList.index(FileName.split('_')[0]) + 1
+        index = psIndex.load_index(FileName, FoldName)
+        pixels = index_pixels(index['nside_index'], plan['nside_region'],
+                              region, plan['halo'])
+        with psProfile.stage('read_csv'):
+            PS_data = psTable.as_catelogue(
+                psIndex.read_rows(FileName, FoldName, index, pixels),
+                ClassType)
+        psProfile.count('sources_read', PS_data.shape[0])
+        if 'I_151 (Jy)' not in PS_data:
+            raise ValueError("%s should provide 'I_151 (Jy)'" % name)
+        psProgress.start(PS_data.shape[0], 'region %d %s' % (
+            region, psTable.ClassList[ClassType - 1]))
+        for first, last, Tb in engine.iter_Tb(PS_data, ClassType):
+            pix, idx, comp, nhit = psDraw.calc_footprint(
+                nside, PS_data[first:last], ClassType, nest=True,
+                chunk=chunk)
+            # Only the pixels owned by the region
+            owned = (pix >= start) & (pix < stop)
+            pix, idx, comp, nhit = (pix[owned] - start, idx[owned],
+                                    comp[owned], nhit[owned])
+            with psProfile.stage('render'):
+                upix, inverse = np.unique(pix, return_inverse=True)
+                for i in range(len(engine.Freqs)):
+                    slab[i, upix] += np.bincount(
+                        inverse, weights=Tb[idx, comp, i] * nhit,
+                        minlength=len(upix))
+        psProgress.finish()
+    SlabName = slab_name(plan, region)
+    TmpName = SlabName + '.tmp'
+    with open(TmpName, 'wb') as fp:
+        np.save(fp, slab)
+    os.replace(TmpName, SlabName)
+
+    return SlabName
+
+
+def _render_region_worker(plan, region, recorded=False):
+    """
+    Draw the region in a worker, with the psProfile report returned if
+    recorded.
+    """
+    if recorded:
+        with psProfile.recording() as recorder:
+            SlabName = render_region(plan, region)
+        return SlabName, recorder.report()
+
+    return render_region(plan, region), None
+
+
+def run_local(plan, regions=None, NumProc=1):
+    """
+    Draw the regions, default as all of the plan, in this process or in
+    a pool of NumProc workers. If psProfile is recording, the reports
+    of the workers are merged.
+
+    return
+    ------
+    SlabNames: list of str
+    """
+    if regions is None:
+        regions = plan['regions']
+    if os.path.exists(plan['OutFold']) == False:
+        os.makedirs(plan['OutFold'])
+    if NumProc <= 1 or len(regions) <= 1:
+        return [render_region(plan, region) for region in regions]
+    recorded = psProfile.enabled()
+    tasks = [(plan, region, recorded) for region in regions]
+    SlabNames = []
+    with Pool(min(NumProc, len(regions))) as pool:
+        for SlabName, report in pool.starmap(_render_region_worker, tasks):
+            if report is not None:
+                psProfile.merge(report)
+            SlabNames.append(SlabName)
+
+    return SlabNames
+
+
+def merge(plan, FreqIndex=0, nest=False):
+    """
+    Merge the slabs of the regions into the map of the frequency
+    plan['Freqs'][FreqIndex], each pixel is owned by one region.
+
+    return
+    ------
+    pix_vec: np.ndarray(12*nside^2,)
+        The map in RING ordering, or NESTED if nest
+    """
+    nside = plan['nside']
+    missing = [region for region in plan['regions']
+               if os.path.exists(slab_name(plan, region)) == False]
+    if len(missing) > 0:
+        raise ValueError("The slabs of the regions %s are missing" % missing)
+    pix_vec = np.zeros((12 * nside**2,))
+    with psProfile.stage('merge_slabs'):
+        for region in plan['regions']:
+            start, stop = region_range(nside, plan['nside_region'], region)
+            slab = np.load(slab_name(plan, region), mmap_mode='r')
+            pix_vec[start:stop] = slab[FreqIndex]
+        if not nest:
+            pix_vec = hp.reorder(pix_vec, n2r=True)
+
+    return pix_vec
+
+
+def main(argv):
+    """
+    A main function for use this module at the command window
+
+    example
+    -------
+    Plan, draw with 4 workers and merge:
+    psPartition -i PS_tables/SF_100_spec_sorted.csv -n 8192 -f 150e6
+    -r 2 -o PS_slabs -j 4 -m PS_maps
+    Plan only, draw some regions on other nodes, then merge:
+    psPartition -i ... -n 8192 -f 150e6 -r 2 -o PS_slabs -P plan.json
+    psPartition -w plan.json -g 0,1,2,3
+    psPartition -w plan.json -m PS_maps
+    """
+    usage = ("psPartition -i <sorted PS names (csv)> -n <nside> "
+             "-f <frequency list or start:stop:step> -o <slab folder> "
+             "-r <nside of the regions> --halo <halo rings> "
+             "-e <largest extent of the sources (deg)> "
+             "-P <plan (json)> -w <plan (json) to run> "
+             "-g <regions to draw> -j <number of workers> "
+             "-m <Output folder of the merged maps>")
+    try:
+        opts, args = getopt.getopt(
+            argv, "hi:n:f:o:r:e:P:w:g:j:m:",
+            ["infile=", "nside=", "freq=", "outfold=", "nside-region=",
+             "halo=", "extent=", "plan=", "work=", "regions=", "jobs=",
+             "merge="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    # Default
+    ps_names = []
+    nside = 512
+    freqs = [150]
+    SlabFold = 'PS_slabs'
+    nside_region = 1
+    halo = 1
+    extent = None
+    plan_name = None
+    work_name = None
+    regions = None
+    NumProc = 1
+    MergeFold = None
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-i", "--infile"):
+            ps_names.extend(arg.split(','))
+        elif opt in ("-n", "--nside"):
+            nside = int(arg)
+        elif opt in ("-f", "--freq"):
+            freqs = psBatch.parse_freqs(arg)
+        elif opt in ("-o", "--outfold"):
+            SlabFold = arg
+        elif opt in ("-r", "--nside-region"):
+            nside_region = int(arg)
+        elif opt == "--halo":
+            halo = int(arg)
+        elif opt in ("-e", "--extent"):
+            extent = np.radians(float(arg))
+        elif opt in ("-P", "--plan"):
+            plan_name = arg
+        elif opt in ("-w", "--work"):
+            work_name = arg
+        elif opt in ("-g", "--regions"):
+            regions = [int(item) for item in arg.split(',') if item != '']
+        elif opt in ("-j", "--jobs"):
+            NumProc = int(arg)
+        elif opt in ("-m", "--merge"):
+            MergeFold = arg
+    if work_name is not None:
+        plan = load_plan(work_name)
+    elif len(ps_names) > 0:
+        if extent is not None:
+            for name in ps_names:
+                FoldName, FileName = os.path.split(name)
+                index = psIndex.load_index(FileName, FoldName or '.')
+                halo = max(halo, halo_rings(index['nside_index'], extent))
+        plan = make_plan(ps_names, nside, freqs, SlabFold, nside_region,
+                         halo)
+    else:
+        print(usage)
+        sys.exit(2)
+    if plan_name is not None:
+        save_plan(plan, plan_name)
+        print("Plan of %d regions: %s" % (len(plan['regions']), plan_name))
+        return
+    if work_name is None or regions is not None:
+        SlabNames = run_local(plan, regions, NumProc)
+        print("Saved %d slabs to %s" % (len(SlabNames), plan['OutFold']))
+    if MergeFold is not None:
+        os.makedirs(MergeFold, exist_ok=True)
+        with psWriter.MapWriter() as writer:
+            for i, freq in enumerate(plan['Freqs']):
+                fits_name = os.path.join(MergeFold, 'PS_nside_' +
+                                         str(plan['nside']) + '_' +
+                                         str(freq) + '.fits')
+                writer.submit(fits_name, merge(plan, i))
+        print("Saved %d maps to %s" % (len(plan['Freqs']), MergeFold))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psPipeline is designed to run the whole simulation,
+i.e. the catelogues (psCatelogue), their spectra (psSpec), footprints
+and maps (psDraw) and the fits, from one json config. The output of
+each stage is saved in the store named by the hash of its inputs, its
+parameters and the code of its modules, so a rerun skips the stages
+whose hashes are unchanged, e.g. only the maps and fits of the new
+frequencies are drawn if the frequency list is changed, and only the
+spectra and maps if the seed of the spectra is changed.
+
+The config is like
+
+    {
+        "store": "PS_store",
+        "output": "PS_maps",
+        "nside": 512,
+        "freqs": "120e6:130e6:1e6",
+        "catelogues": [
+            {"class": "SF", "NumPS": 100000, "batch": 10000, "seed": 1},
+            {"csv": "PS_tables/FRI_100_20161009_205800.csv"}
+        ],
+        "spectra": {"seed": 0}
+    }
+
+where the catelogues are generated by their class, number, batch and
+seed, or read from the csv files, and the freqs are a list or
+start:stop:step as psBatch.parse_freqs.
+
+Classes
+-------
+Pipeline: class
+    Plan and run the stages of the config.
+
+Functions
+---------
+code_version: the hash of the code of the modules.
+
+stage_hash: the hash of a stage.
+
+example
+-------
+>>> pipeline = Pipeline(json.load(open('pipeline.json')))
+>>> for record in pipeline.run():
+...     print(record)
+"""
+
+# Modules
+import os
+import sys
+import json
+import time
+import shutil
+import getopt
+import hashlib
+import tempfile
+import numpy as np
+# Cumstom designed modules
+from . import __version__
+from . import psCatelogue
+from . import psDraw
+from . import psBatch
+from . import psSpec
+from . import psTable
+from . import psProfile
+
+# The catelogue generators of the classes
+ClassGen = {'SF': psCatelogue.StarForming, 'SB': psCatelogue.StarBursting,
+            'RQ': psCatelogue.PointSource, 'FRI': psCatelogue.FRI,
+            'FRII': psCatelogue.FRII}
+
+# The modules of the stages, whose code is in the hashes
+StageModules = {'catelogue': ['psCatelogue', 'psTable', 'basic_params'],
+                'spectra': ['psSpec', 'psTable'],
+                'footprint': ['psDraw', 'psComponents'],
+                'render': ['psDraw', 'psSpec'],
+                'fits': ['psDraw']}
+
+_code_hashes = {}
+
+
+def code_version(modules):
+    """
+    The hash of the source code of the modules of the package, and the
+    version of the package.
+    """
+    sha = hashlib.sha256(__version__.encode())
+    for module in modules:
+        path = os.path.join(os.path.dirname(__file__), module + '.py')
+        if path not in _code_hashes:
+            with open(path, 'rb') as fp:
+                _code_hashes[path] = hashlib.sha256(fp.read()).hexdigest()
+        sha.update(_code_hashes[path].encode())
+
+    return sha.hexdigest()
+
+
+def file_hash(FileName):
+    """
+    The hash of the content of the file.
+    """
+    sha = hashlib.sha256()
+    with open(FileName, 'rb') as fp:
+        for block in iter(lambda: fp.read(2**20), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def stage_hash(stage, params, inputs):
+    """
+    The hash of the stage of the parameters and the hashes of the
+    inputs, with the code of the modules of the stage.
+    """
+    key = {'stage': stage, 'params': params, 'inputs': inputs,
+           'code': code_version(StageModules[stage])}
+    text = json.dumps(key, sort_keys=True)
+
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+class Pipeline:
+    """
+    The stages of the config, saved in the store by their hashes.
+
+    Parameters
+    ----------
+    config: dict
+        The config, see the module
+    root: str
+        The folder the paths of the config are relative to
+
+    Attributes
+    ----------
+    records: list of dict
+        The stages run or skipped, with their names, hashes and time
+    """
+
+    def __init__(self, config, root='.'):
+        self.config = config
+        self.root = root
+        self.store = os.path.join(root, config.get('store', 'PS_store'))
+        self.output = os.path.join(root, config.get('output', 'PS_maps'))
+        self.nside = int(config.get('nside', 512))
+        freqs = config.get('freqs', [150e6])
+        if isinstance(freqs, str):
+            freqs = psBatch.parse_freqs(freqs)
+        self.freqs = [float(freq) for freq in freqs]
+        self.records = []
+        self._loaded = {}
+        self.dry_run = False
+
+    def _path(self, stage, name, ext):
+        return os.path.join(self.store, stage, name + ext)
+
+    def _stage(self, stage, name, params, inputs, ext, func, outputs=()):
+        """
+        Run func(path) of the stage unless its output, and the outputs
+        out of the store, exist, and record it. The output is written to
+        a temporary name and renamed, so an interrupted stage is run
+        again.
+        """
+        digest = stage_hash(stage, params, inputs)
+        path = self._path(stage, name + '_' + digest, ext)
+        record = {'stage': stage, 'name': name, 'hash': digest, 'path': path}
+        if os.path.exists(path) and all(os.path.exists(output)
+                                        for output in outputs):
+            record['status'] = 'cached'
+        elif self.dry_run:
+            record['status'] = 'planned'
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp' + ext
+            tic = time.perf_counter()
+            with psProfile.stage('pipeline_' + stage):
+                func(tmp_path)
+            os.replace(tmp_path, path)
+            record['status'] = 'ran'
+            record['wall (s)'] = time.perf_counter() - tic
+        self.records.append(record)
+
+        return digest, path
+
+    def _catelogue(self, path):
+        """
+        (ClassType, PS_data) of the csv in the store, loaded once.
+        """
+        if path not in self._loaded:
+            FoldName, FileName = os.path.split(path)
+            self._loaded[path] = psDraw.read_csv(FileName, FoldName)
+
+        return self._loaded[path]
+
+    def run_catelogue(self, index, entry):
+        """
+        Generate or copy the catelogue of the entry of the config.
+        """
+        if 'csv' in entry:
+            source = os.path.join(self.root, entry['csv'])
+            ClassName = os.path.basename(source).split('_')[0]
+            params = {'class': ClassName}
+            inputs = [file_hash(source)]
+
+            def func(path):
+                shutil.copyfile(source, path)
+        else:
+            ClassName = entry['class']
+            params = {'class': ClassName, 'NumPS': int(entry['NumPS']),
+                      'batch': entry.get('batch'),
+                      'seed': entry.get('seed', index), 'nside': self.nside}
+            inputs = []
+
+            def func(path):
+                np.random.seed(params['seed'])
+                generator = ClassGen[ClassName](self.nside)
+                # save_table names the csv by the time, so it is saved
+                # again by the hash
+                with tempfile.TemporaryDirectory() as tmp:
+                    PS_cat = generator.save_table(params['NumPS'], tmp,
+                                                  ClassName,
+                                                  batch=params['batch'])
+                PS_cat.to_csv(path)
+        if ClassName not in psTable.ClassList:
+            raise ValueError("Unknown class: %s" % ClassName)
+
+        return self._stage('catelogue', ClassName, params, inputs, '.csv',
+                           func)
+
+    def run_spectra(self, ClassName, cat_hash, cat_path):
+        """
+        Draw the spectral indices of the catelogue, saved as the columns
+        in npz, so the catelogue is not saved again.
+        """
+        params = dict(self.config.get('spectra', {}))
+        params.setdefault('seed', 0)
+
+        def func(path):
+            ClassType, PS_data = self._catelogue(cat_path)
+            np.random.seed(params['seed'])
+            PS_spec = psSpec.add_spectra(PS_data, ClassType)
+            columns = {name: PS_spec[name] for name in PS_spec.columns
+                       if name not in PS_data}
+            with open(path, 'wb') as fp:
+                np.savez(fp, **columns)
+
+        return self._stage('spectra', ClassName, params, [cat_hash], '.npz',
+                           func)
+
+    def run_footprint(self, ClassName, cat_hash, cat_path):
+        params = {'nside': self.nside}
+
+        def func(path):
+            ClassType, PS_data = self._catelogue(cat_path)
+            pix, idx, comp, nhit = psDraw.calc_footprint(self.nside, PS_data,
+                                                         ClassType)
+            with open(path, 'wb') as fp:
+                np.savez(fp, pix=pix, idx=idx, comp=comp, nhit=nhit)
+
+        return self._stage('footprint', ClassName, params, [cat_hash],
+                           '.npz', func)
+
+    def _spectra(self, cat_path, spec_path):
+        """
+        (ClassType, PS_data) of the catelogue with the columns of the
+        spectra, loaded once.
+        """
+        if spec_path not in self._loaded:
+            ClassType, PS_data = self._catelogue(cat_path)
+            with np.load(spec_path) as data:
+                columns = {name: data[name] for name in data.files}
+            self._loaded[spec_path] = (ClassType,
+                                       PS_data.with_columns(columns))
+
+        return self._loaded[spec_path]
+
+    def run_render(self, freq, sources):
+        """
+        The map of all the catelogues at the frequency, sources is the
+        list of (catelogue_path, spectra_hash, spectra_path,
+        footprint_hash, footprint_path).
+        """
+        params = {'nside': self.nside, 'freq': freq}
+        inputs = [[spec_hash, foot_hash] for cat_path, spec_hash, spec_path,
+                  foot_hash, foot_path in sources]
+
+        def func(path):
+            pix_vec = np.zeros((12 * self.nside**2,))
+            for cat_path, spec_hash, spec_path, foot_hash, foot_path in \
+                    sources:
+                ClassType, PS_data = self._spectra(cat_path, spec_path)
+                if foot_path not in self._loaded:
+                    with np.load(foot_path) as data:
+                        self._loaded[foot_path] = (data['pix'], data['idx'],
+                                                   data['comp'], data['nhit'])
+                PS_flux_list = psDraw.calc_flux(ClassType, freq, PS_data)
+                psDraw.accumulate_footprint(pix_vec, self._loaded[foot_path],
+                                            PS_flux_list)
+            with open(path, 'wb') as fp:
+                np.save(fp, pix_vec)
+
+        return self._stage('render', 'PS_nside_%d_%s' % (self.nside, freq),
+                           params, inputs, '.npy', func)
+
+    def run_fits(self, freq, map_hash, map_path):
+        """
+        Write the map into the output folder. The store keeps an empty
+        stamp of the hash, so the fits is written again only if the map
+        changed or the fits is missing.
+        """
+        fits_name = os.path.join(self.output, 'PS_nside_' + str(self.nside) +
+                                 '_' + str(freq) + '.fits')
+        params = {'fits': fits_name}
+
+        def func(path):
+            os.makedirs(self.output, exist_ok=True)
+            psDraw.write_map(fits_name, np.load(map_path))
+            open(path, 'w').close()
+
+        return self._stage('fits', 'PS_nside_%d_%s' % (self.nside, freq),
+                           params, [map_hash], '.done', func, [fits_name])
+
+    def run(self, dry_run=False):
+        """
+        Run the stages in order, or only plan them if dry_run.
+
+        return
+        ------
+        records: list of dict
+        """
+        self.records = []
+        self.dry_run = dry_run
+        sources = []
+        for index, entry in enumerate(self.config['catelogues']):
+            cat_hash, cat_path = self.run_catelogue(index, entry)
+            ClassName = os.path.basename(cat_path).split('_')[0]
+            spec_hash, spec_path = self.run_spectra(ClassName, cat_hash,
+                                                    cat_path)
+            foot_hash, foot_path = self.run_footprint(ClassName, cat_hash,
+                                                      cat_path)
+            sources.append((cat_path, spec_hash, spec_path, foot_hash,
+                            foot_path))
+        for freq in self.freqs:
+            map_hash, map_path = self.run_render(freq, sources)
+            self.run_fits(freq, map_hash, map_path)
+        self._loaded.clear()
+
+        return self.records
+
+
+def main(argv):
+    """
+    A main function for use this module at the command window
+
+    example
+    -------
+    psPipeline -c pipeline.json
+    psPipeline -c pipeline.json -n
+    """
+    usage = ("psPipeline -c <config (json)> -n (dry run) "
+             "-t <timing report (json)>")
+    try:
+        opts, args = getopt.getopt(argv, "hc:nt:",
+                                   ["config=", "dry-run", "timing="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    # Default
+    config_name = None
+    dry_run = False
+    timing_name = None
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-c", "--config"):
+            config_name = arg
+        elif opt in ("-n", "--dry-run"):
+            dry_run = True
+        elif opt in ("-t", "--timing"):
+            timing_name = arg
+    if config_name is None:
+        print(usage)
+        sys.exit(2)
+    with open(config_name) as fp:
+        config = json.load(fp)
+    pipeline = Pipeline(config, os.path.dirname(config_name) or '.')
+    if timing_name is None:
+        records = pipeline.run(dry_run)
+    else:
+        with psProfile.recording(FileName=timing_name):
+            records = pipeline.run(dry_run)
+    for record in records:
+        print("%-10s %-8s %-32s %s" % (record['stage'], record['status'],
+                                       record['name'], record['hash']))
+    NumRan = sum(record['status'] != 'cached' for record in records)
+    print("%d of %d stages %s" % (NumRan, len(records),
+                                  'planned' if dry_run else 'ran'))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
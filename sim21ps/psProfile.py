@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psProfile is designed to collect the wall and cpu
+time of the stages, and the counters, of the catelogue generation and
+the drawing of maps, e.g. reading csv, calculating flux, ang2pix and
+writing fits. Nothing is collected unless a Recorder is active, so the
+hooks cost almost nothing when disabled.
+
+Classes
+-------
+Recorder: class
+    Collect the time of the stages and the counters, and report them
+    in a json serializable dict.
+
+Functions
+---------
+recording: context manager activating a Recorder.
+
+stage: context manager timing a stage of the active Recorder.
+
+count: increase a counter of the active Recorder.
+
+merge: merge the report of a worker into the active Recorder.
+
+example
+-------
+>>> with psProfile.recording(FileName='timing.json') as rec:
+...     pix_vec = psDraw.draw_ps(512, 150e6, 'SF_100_20161009_205700.csv')
+>>> rec.report()['stages']['ang2pix']['wall (s)']
+"""
+
+# Modules
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# The active recorder, None when disabled
+_recorder = None
+
+
+class Recorder:
+    """
+    Collect the wall and cpu time of the stages, and the counters.
+
+    Parameters
+    ----------
+    callback: function
+        Called as callback(name, wall, cpu) at the end of each stage,
+        default as None.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stages = {}
+        self.counters = {}
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add_stage(self, name, wall, cpu):
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = {'calls': 0, 'wall (s)': 0.0,
+                                     'cpu (s)': 0.0}
+            entry = self.stages[name]
+            entry['calls'] += 1
+            entry['wall (s)'] += wall
+            entry['cpu (s)'] += cpu
+        if self.callback is not None:
+            self.callback(name, wall, cpu)
+
+    def add_count(self, name, num=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + int(num)
+
+    def merge(self, report):
+        """
+        Merge a report of another Recorder, e.g. of a worker process.
+        """
+        with self.lock:
+            for name, value in report['stages'].items():
+                if name not in self.stages:
+                    self.stages[name] = {'calls': 0, 'wall (s)': 0.0,
+                                         'cpu (s)': 0.0}
+                for key in ('calls', 'wall (s)', 'cpu (s)'):
+                    self.stages[name][key] += value[key]
+            for name, value in report['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        """
+        The json serializable report.
+        """
+        with self.lock:
+            report = {
+                'total_wall (s)': time.perf_counter() - self.start,
+                'stages': {name: dict(value)
+                           for name, value in self.stages.items()},
+                'counters': dict(self.counters),
+            }
+
+        return report
+
+    def save_json(self, FileName):
+        with open(FileName, 'w') as fp:
+            json.dump(self.report(), fp, indent=2)
+
+
+class _Stage:
+    """
+    Time a stage of the recorder.
+    """
+    __slots__ = ('recorder', 'name', 'wall', 'cpu')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.add_stage(self.name,
+                                time.perf_counter() - self.wall,
+                                time.process_time() - self.cpu)
+        return False
+
+
+class _NullStage:
+    """
+    The stage when the recording is disabled.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+def stage(name):
+    """
+    Context manager timing the stage namely name.
+    """
+    if _recorder is None:
+        return _null_stage
+
+    return _Stage(_recorder, name)
+
+
+def count(name, num=1):
+    """
+    Increase the counter namely name by num.
+    """
+    if _recorder is not None:
+        _recorder.add_count(name, num)
+
+
+def enabled():
+    return _recorder is not None
+
+
+def merge(report):
+    """
+    Merge the report of a worker into the active Recorder.
+    """
+    if _recorder is not None:
+        _recorder.merge(report)
+
+
+@contextmanager
+def recording(callback=None, FileName=None):
+    """
+    Activate a Recorder in the block, and save the report into FileName
+    in json at the end, if FileName is provided.
+    """
+    global _recorder
+    previous = _recorder
+    recorder = Recorder(callback)
+    _recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+        if FileName is not None:
+            recorder.save_json(FileName)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psProgress is designed to report the progress of the
+long catelogue generation and map drawing, i.e. the sources and pixels
+per second and the ETA. The reporter is pluggable, and the console one
+prints at most once per interval, so it is cheap enough to be always on.
+
+Classes
+-------
+Progress: class
+    The base reporter, which reports nothing.
+ConsoleProgress: class
+    Print the progress to the console at a bounded rate.
+
+Functions
+---------
+reporting: context manager activating a reporter.
+
+start, update, finish: the hooks called by psCatelogue and psDraw.
+
+example
+-------
+>>> with psProgress.reporting(psProgress.ConsoleProgress(interval=5)):
+...     pix_vec = psDraw.draw_ps(512, 150e6, 'SF_100_20161009_205700.csv')
+"""
+
+# Modules
+import sys
+import time
+from contextlib import contextmanager
+
+# The active reporter, None when disabled
+_reporter = None
+# Depth of the nested tasks, only the outermost one is reported
+_depth = 0
+
+
+class Progress:
+    """
+    The base reporter, the subclasses override start, update and finish.
+    """
+
+    def start(self, total, name=''):
+        pass
+
+    def update(self, sources=0, pixels=0):
+        pass
+
+    def finish(self):
+        pass
+
+
+class ConsoleProgress(Progress):
+    """
+    Print the progress, e.g.
+    '[footprint SF] 40000/100000 (40.0%) 1.2e+04 src/s 3.8e+06 pix/s ETA 0:00:05'
+
+    Parameters
+    ----------
+    stream: file
+        Where to print, default as sys.stderr
+    interval: float
+        The minimum interval between two prints, [s]
+    """
+
+    def __init__(self, stream=None, interval=1.0):
+        self.stream = sys.stderr if stream is None else stream
+        self.interval = interval
+        self.total = 0
+        self.name = ''
+        self.sources = 0
+        self.pixels = 0
+        self.tic = self.last = time.monotonic()
+
+    def start(self, total, name=''):
+        self.total = total
+        self.name = name
+        self.sources = 0
+        self.pixels = 0
+        self.tic = self.last = time.monotonic()
+
+    def update(self, sources=0, pixels=0):
+        self.sources += sources
+        self.pixels += pixels
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.stream.write(self.format(now) + '\n')
+            self.stream.flush()
+
+    def finish(self):
+        self.stream.write(self.format(time.monotonic()) + ' done\n')
+        self.stream.flush()
+
+    def format(self, now):
+        elapsed = max(now - self.tic, 1e-9)
+        src_rate = self.sources / elapsed
+        pix_rate = self.pixels / elapsed
+        if self.total > 0:
+            percent = '(%.1f%%)' % (100 * self.sources / self.total)
+        else:
+            percent = ''
+        if src_rate > 0 and self.total >= self.sources:
+            eta = (self.total - self.sources) / src_rate
+            eta = '%d:%02d:%02d' % (eta // 3600, eta % 3600 // 60, eta % 60)
+        else:
+            eta = '-'
+        line = '[%s] %d/%d %s %.2g src/s %.2g pix/s ETA %s' % (
+            self.name, self.sources, self.total, percent, src_rate,
+            pix_rate, eta)
+
+        return line
+
+
+def start(total, name=''):
+    """
+    Start a task, the tasks started inside another one, e.g. the chunks,
+    are merged into the outermost task.
+    """
+    global _depth
+    if _reporter is not None:
+        if _depth == 0:
+            _reporter.start(total, name)
+        _depth += 1
+
+
+def update(sources=0, pixels=0):
+    if _reporter is not None:
+        _reporter.update(sources, pixels)
+
+
+def finish():
+    global _depth
+    if _reporter is not None:
+        _depth -= 1
+        if _depth == 0:
+            _reporter.finish()
+
+
+@contextmanager
+def reporting(reporter=None):
+    """
+    Activate the reporter in the block, default as a ConsoleProgress.
+    """
+    global _reporter, _depth
+    previous = (_reporter, _depth)
+    _reporter = ConsoleProgress() if reporter is None else reporter
+    _depth = 0
+    try:
+        yield _reporter
+    finally:
+        _reporter, _depth = previous
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psRender is designed to render many catelogues at
+many frequencies in a long-running process without repeated setup. The
+renderer owns the accumulation map of its nside, and keeps the per-nside
+quantities and the footprints of the catelogues, which do not change
+with the frequency, so that only the fluxes are calculated again.
+
+Classes
+-------
+SkyRenderer: class
+    The renderer of a nside, ordering and dtype.
+
+example
+-------
+>>> renderer = SkyRenderer(512)
+>>> for freq in [120e6, 130e6]:
+...     renderer.reset()
+...     renderer.add('SF_100_20161009_205700.csv', freq)
+...     renderer.add('FRI_100_20161009_205800.csv', freq)
+...     psDraw.write_map('ps_%d.fits' % (freq / 1e6), renderer.result())
+"""
+
+# Modules
+import os
+import numpy as np
+# Cumstom designed modules
+from . import psDraw
+from .psLazy import LazyModule
+# The heavy modules are imported on the first use
+hp = LazyModule('healpy')
+
+
+class SkyRenderer:
+    """
+    Render the point sources onto the healpix map of nside.
+
+    Parameters
+    ----------
+    nside: int and dyadic
+        Number of subpixel in a healpix cell
+    ordering: str
+        'RING' or 'NESTED', ordering of the map
+    dtype: np.dtype
+        Type of the map, e.g. np.float32 to halve the memory
+    chunk: int
+        Number of sources processed at a time
+    cache: bool
+        Whether to keep the catelogues and footprints added, which are
+        reused when they are added again, e.g. at another frequency.
+
+    Attributes
+    ----------
+    npix: int
+        Number of pixels, 12*nside^2
+    resol: float
+        Angular resolution of the pixels, [rad]
+    pixarea: float
+        Area of the pixels, [sr]
+    nest: bool
+        Whether the map is in NESTED ordering
+    pix_vec: np.ndarray(npix,)
+        The accumulation map
+    """
+
+    def __init__(self, nside, ordering='RING', dtype=np.float64, chunk=10000,
+                 cache=True):
+        if ordering not in ('RING', 'NESTED'):
+            raise ValueError("Unknown ordering: %s" % ordering)
+        self.nside = nside
+        self.ordering = ordering
+        self.nest = ordering == 'NESTED'
+        self.dtype = np.dtype(dtype)
+        self.chunk = chunk
+        self.cache = cache
+        # Per-nside quantities
+        self.npix = 12 * nside**2
+        self.resol = hp.nside2resol(nside)
+        self.pixarea = hp.nside2pixarea(nside)
+        self.pix_vec = np.zeros((self.npix,), dtype=self.dtype)
+        self._catelogues = {}
+        self._footprints = {}
+
+    def reset(self):
+        """
+        Clear the map in place, without reallocation.
+        """
+        self.pix_vec[:] = 0
+
+    def clear_cache(self):
+        self._catelogues.clear()
+        self._footprints.clear()
+
+    def footprint(self, PS_data, ClassType, key=None):
+        """
+        The footprint of the sources, cached by key if provided.
+        """
+        if key is not None and key in self._footprints:
+            return self._footprints[key]
+        footprint = psDraw.calc_footprint(self.nside, PS_data, ClassType,
+                                          nest=self.nest, chunk=self.chunk)
+        if key is not None and self.cache:
+            self._footprints[key] = footprint
+
+        return footprint
+
+    def accumulate(self, footprint, PS_flux_list):
+        """
+        Add the footprint filled with the fluxes into the map. The large
+        footprints are binned over the whole map, and the small ones
+        over their own pixels only.
+        """
+        pix = footprint[0]
+        if len(pix) > self.npix // 4:
+            self.pix_vec += psDraw.render_footprint(self.nside, footprint,
+                                                    PS_flux_list)
+        else:
+            psDraw.accumulate_footprint(self.pix_vec, footprint,
+                                        PS_flux_list)
+
+    def add_class(self, ClassType, PS_data, Freq, key=None):
+        """
+        Add the sources of ClassType at frequency Freq to the map.
+
+        Parameters
+        ----------
+        ClassType: int
+            Class type of the point soruces
+        PS_data: psTable.Catelogue or pandas.core.frame.DataFrame
+            Data of the point sources
+        Freq: float
+            Frequency
+        key: hashable
+            Identity of the sources, e.g. the name of the catelogue, by
+            which the footprint is cached.
+        """
+        PS_flux_list = psDraw.calc_flux(ClassType, Freq, PS_data)
+        footprint = self.footprint(PS_data, ClassType, key)
+        self.accumulate(footprint, PS_flux_list)
+
+        return self
+
+    def add(self, catelogue, Freq, FoldName=None):
+        """
+        Add the catelogue at frequency Freq to the map.
+
+        Parameters
+        ----------
+        catelogue: str
+            Path of the csv catelogue, or its name in FoldName
+        Freq: float
+            Frequency
+        FoldName: str
+            Name of the folder of the catelogue
+        """
+        if FoldName is None:
+            FoldName, FileName = os.path.split(catelogue)
+            if FoldName == '':
+                FoldName = '.'
+        else:
+            FileName = catelogue
+        key = os.path.join(FoldName, FileName)
+        if key in self._catelogues:
+            ClassType, PS_data = self._catelogues[key]
+        else:
+            ClassType, PS_data = psDraw.read_csv(FileName, FoldName)
+            if self.cache:
+                self._catelogues[key] = (ClassType, PS_data)
+
+        return self.add_class(ClassType, PS_data, Freq, key=key)
+
+    def result(self, copy=True):
+        """
+        The rendered map, a copy unless copy is False, in which case it
+        is overwritten by the following reset and add.
+        """
+        if copy:
+            return self.pix_vec.copy()
+
+        return self.pix_vec
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psServe is designed to serve the maps of the point
+sources from a long-running process on localhost, so the notebooks and
+the pipeline stages asking for the map at a frequency, nside and region
+do not pay for the imports, the reading of the csv catelogues and the
+footprints again. The catelogues, footprints and maps are kept in one
+LRU cache under a memory cap, and the identical requests at the same
+time are computed once.
+
+The maps are requested by HTTP GET on localhost,
+
+    /map?ps=SF_100_spec.csv,FRI_100_spec.csv&freq=120e6,130e6&nside=512
+        &pix=0:1000&nest=0&dtype=float32
+
+where freq is a list or start:stop:step as psBatch.parse_freqs, and pix
+is the range of the pixels, default as the full map. The response is
+the binary array of shape (NumFreq, NumPix) in little endian, with the
+headers X-Shape and X-Dtype. /stats returns the statistics of the cache
+in json.
+
+Classes
+-------
+LRUCache: class
+    The thread-safe LRU cache under a memory cap, computing the missed
+    items once for the concurrent requests.
+
+RenderService: class
+    The catelogues, footprints and maps of the service.
+
+Functions
+---------
+serve: serve the maps by HTTP on localhost.
+
+request_map: request the maps from the service.
+
+example
+-------
+$ python3 -m sim21ps.psServe -d PS_tables -m 4096 -p 8021
+>>> pix_cube = psServe.request_map(['SF_100_spec.csv'], [120e6, 130e6], 512)
+"""
+
+# Modules
+import os
+import sys
+import json
+import getopt
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+from urllib.request import urlopen
+import numpy as np
+# Cumstom designed modules
+from . import psDraw
+from . import psBatch
+from . import psProfile
+
+# Default port of the service
+PORT = 8021
+
+
+def _nbytes(value):
+    """
+    The memory of the numpy arrays in the value, e.g. the tuples of the
+    footprints and the catelogues.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(item) for item in value)
+    if hasattr(value, 'block'):
+        return value.block.nbytes + value.ids.nbytes
+
+    return 0
+
+
+class LRUCache:
+    """
+    The thread-safe LRU cache, the least recently used items are evicted
+    when the memory exceeds max_bytes.
+
+    Parameters
+    ----------
+    max_bytes: int
+        The memory cap of the items
+
+    Attributes
+    ----------
+    stats: dict
+        Numbers of the hits, misses, coalesced requests and evictions
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0,
+                      'evictions': 0}
+        self._items = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, compute):
+        """
+        The item of the key, computed by compute() if missed. The same
+        key requested while it is computed waits for the result instead
+        of computing it again.
+        """
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.stats['hits'] += 1
+                return self._items[key][0]
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = {'done': threading.Event()}
+                owner = True
+                self.stats['misses'] += 1
+            else:
+                owner = False
+                self.stats['coalesced'] += 1
+        if not owner:
+            pending['done'].wait()
+            if 'error' in pending:
+                raise pending['error']
+            return pending['value']
+        try:
+            value = compute()
+        except BaseException as error:
+            pending['error'] = error
+            raise
+        else:
+            pending['value'] = value
+            self._put(key, value)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending['done'].set()
+
+        return value
+
+    def _put(self, key, value):
+        size = _nbytes(value)
+        with self._lock:
+            if size > self.max_bytes:
+                return
+            self._items[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                old_key, (old_value, old_size) = self._items.popitem(
+                    last=False)
+                self.nbytes -= old_size
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+
+class RenderService:
+    """
+    Render the maps of the catelogues in FoldName, with the catelogues,
+    footprints and full maps cached.
+
+    Parameters
+    ----------
+    FoldName: str
+        The folder of the catelogues, out of which they are not read
+    max_bytes: int
+        The memory cap of the cache
+    chunk: int
+        Number of sources processed at a time
+    """
+
+    def __init__(self, FoldName='.', max_bytes=2**30, chunk=10000):
+        self.FoldName = os.path.abspath(FoldName)
+        self.chunk = chunk
+        self.cache = LRUCache(max_bytes)
+
+    def _path(self, name):
+        path = os.path.abspath(os.path.join(self.FoldName, name))
+        if os.path.dirname(path) != self.FoldName or not os.path.isfile(path):
+            raise ValueError("Unknown catelogue: %s" % name)
+
+        return path
+
+    def catelogue(self, name):
+        """
+        (ClassType, PS_data) of the catelogue.
+        """
+        path = self._path(name)
+
+        return self.cache.get(('catelogue', path), lambda: psDraw.read_csv(
+            os.path.basename(path), os.path.dirname(path)))
+
+    def footprint(self, name, nside, nest=False):
+        def compute():
+            ClassType, PS_data = self.catelogue(name)
+            return psDraw.calc_footprint(nside, PS_data, ClassType,
+                                         nest=nest, chunk=self.chunk)
+
+        return self.cache.get(('footprint', self._path(name), nside, nest),
+                              compute)
+
+    def full_map(self, names, Freq, nside, nest=False):
+        """
+        The full map of the catelogues at the frequency.
+        """
+        def compute():
+            pix_vec = np.zeros((12 * nside**2,))
+            for name in names:
+                ClassType, PS_data = self.catelogue(name)
+                PS_flux_list = psDraw.calc_flux(ClassType, Freq, PS_data)
+                psDraw.accumulate_footprint(
+                    pix_vec, self.footprint(name, nside, nest), PS_flux_list)
+            return pix_vec
+
+        key = ('map', tuple(self._path(name) for name in names), Freq,
+               nside, nest)
+
+        return self.cache.get(key, compute)
+
+    def render(self, names, Freqs, nside, nest=False, pix=None,
+               dtype=np.float64):
+        """
+        The maps of the catelogues at the frequencies.
+
+        Parameters
+        ----------
+        names: list of str
+            Names of the catelogues in FoldName
+        Freqs: list of float
+            The frequencies
+        pix: tuple
+            (start, stop) of the pixels, default as the full maps
+
+        return
+        ------
+        pix_cube: np.ndarray(NumFreq, NumPix)
+        """
+        start, stop = (0, 12 * nside**2) if pix is None else pix
+        pix_cube = np.empty((len(Freqs), stop - start), dtype=dtype)
+        with psProfile.stage('serve'):
+            for i, Freq in enumerate(Freqs):
+                pix_cube[i] = self.full_map(names, Freq, nside,
+                                            nest)[start:stop]
+
+        return pix_cube
+
+    def stats(self):
+        return dict(self.cache.stats, items=len(self.cache),
+                    nbytes=self.cache.nbytes, max_bytes=self.cache.max_bytes)
+
+
+def parse_query(query):
+    """
+    Parse the query of /map into the arguments of RenderService.render.
+    """
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    nside = int(params.get('nside', 512))
+    if nside <= 0 or nside & (nside - 1) != 0:
+        raise ValueError("nside %d is not dyadic" % nside)
+    pix = None
+    if 'pix' in params:
+        start, stop = [int(value) for value in params['pix'].split(':')]
+        if not 0 <= start < stop <= 12 * nside**2:
+            raise ValueError("Illegal pixel range: %s" % params['pix'])
+        pix = (start, stop)
+
+    return {'names': params['ps'].split(','),
+            'Freqs': psBatch.parse_freqs(params.get('freq', '150e6')),
+            'nside': nside,
+            'nest': params.get('nest', '0') not in ('0', 'false', 'False'),
+            'pix': pix,
+            'dtype': np.dtype(params.get('dtype', 'float64'))}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    The HTTP handler of the RenderService of the server.
+    """
+
+    def _send(self, code, body, content_type, headers=None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        service = self.server.service
+        if url.path == '/stats':
+            self._send(200, json.dumps(service.stats()).encode(),
+                       'application/json')
+            return
+        if url.path != '/map':
+            self._send(404, b'Not found\n', 'text/plain')
+            return
+        try:
+            args = parse_query(url.query)
+            pix_cube = service.render(**args)
+        except Exception as error:
+            # Any error of the query or the rendering is the bad request
+            self._send(400, (str(error) + '\n').encode(), 'text/plain')
+            return
+        pix_cube = pix_cube.astype(pix_cube.dtype.newbyteorder('<'),
+                                   copy=False)
+        self._send(200, pix_cube.tobytes(), 'application/octet-stream',
+                   {'X-Shape': ','.join(str(n) for n in pix_cube.shape),
+                    'X-Dtype': pix_cube.dtype.str})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(service, port=PORT, verbose=False):
+    """
+    Serve the maps of the service by HTTP on localhost until interrupted.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    server.verbose = verbose
+    print("Serving %s on http://127.0.0.1:%d" % (service.FoldName,
+                                                server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def request_map(names, Freqs, nside, pix=None, nest=False, dtype='float64',
+                port=PORT):
+    """
+    Request the maps from the service on localhost.
+
+    return
+    ------
+    pix_cube: np.ndarray(NumFreq, NumPix)
+    """
+    query = {'ps': ','.join(names),
+             'freq': ','.join(repr(float(Freq)) for Freq in Freqs),
+             'nside': nside, 'nest': int(nest), 'dtype': dtype}
+    if pix is not None:
+        query['pix'] = '%d:%d' % tuple(pix)
+    with urlopen('http://127.0.0.1:%d/map?%s' % (port, urlencode(query))) \
+            as response:
+        shape = [int(n) for n in response.headers['X-Shape'].split(',')]
+        dtype = np.dtype(response.headers['X-Dtype'])
+        body = response.read()
+
+    return np.frombuffer(body, dtype=dtype).reshape(shape)
+
+
+def main(argv):
+    """
+    A main function for use this module at the command window
+
+    example
+    -------
+    psServe -d PS_tables -m 4096 -p 8021
+    """
+    usage = ("psServe -d <folder of the catelogues> -m <memory cap (MB)> "
+             "-p <port> -v (verbose)")
+    try:
+        opts, args = getopt.getopt(argv, "hd:m:p:v",
+                                   ["fold=", "memory=", "port=", "verbose"])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    # Default
+    FoldName = '.'
+    max_bytes = 2**30
+    port = PORT
+    verbose = False
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-d", "--fold"):
+            FoldName = arg
+        elif opt in ("-m", "--memory"):
+            max_bytes = int(float(arg) * 2**20)
+        elif opt in ("-p", "--port"):
+            port = int(arg)
+        elif opt in ("-v", "--verbose"):
+            verbose = True
+    serve(RenderService(FoldName, max_bytes), port, verbose)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
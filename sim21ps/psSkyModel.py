@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psSkyModel is designed to store the sky model of the
+point sources once, instead of the dense maps at many frequencies. The
+model holds the footprints of the source components, i.e. the pixels
+and the number of samples hitting them, and the spectral parameters of
+the components, in a compact npz file, from which the map at any
+frequency, and any nside not finer than the model, is reconstructed on
+demand by one bincount.
+
+The brightness of the component e at the frequency Freq is
+
+    log10 Tb = amp_e + alpha_e * x + beta_e * x^2 + logK(Freq),
+    x = log10(Freq / 151MHz),
+
+where amp_e = log10(I_151 / Area), and logK is the conversion of
+psSpec.SpecEngine, so the maps are the same as psDraw.draw_channels.
+
+Classes
+-------
+SkyModel: class
+    The footprints and spectra of the source components.
+
+example
+-------
+>>> model = SkyModel.from_catelogues(1024, [(1, SF_data), (4, FRI_data)])
+>>> model.save('PS_model_1024.npz')
+>>> model = SkyModel.load('PS_model_1024.npz')
+>>> pix_vec = model.render(150e6, nside=512)
+"""
+
+# Modules
+import os
+import sys
+import getopt
+import numpy as np
+# Cumstom designed modules
+from . import psDraw
+from . import psBatch
+from . import psSpec
+from . import psTable
+from . import psProfile
+from . import psWriter
+from .psLazy import LazyModule
+# The heavy modules are imported on the first use
+hp = LazyModule('healpy')
+
+
+def _small_uint(values):
+    """
+    The smallest unsigned integer type holding the values.
+    """
+    top = int(values.max()) if len(values) > 0 else 0
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if top <= np.iinfo(dtype).max:
+            return dtype
+
+    return np.uint64
+
+
+class SkyModel:
+    """
+    The sparse sky model of the point sources.
+
+    Parameters
+    ----------
+    nside: int and dyadic
+        nside of the footprints
+    nest: bool
+        Whether the pixels are in NESTED ordering
+    pix, emitter, nhit: np.ndarray(NumHit,)
+        The footprints, i.e. the pixels, the components hitting them
+        and the number of the samples
+    amp, alpha, beta: np.ndarray(NumEmitter,)
+        The spectral parameters of the components
+    ClassType, ids: np.ndarray(NumEmitter,)
+        The class type and ID of the source of the components
+    """
+
+    def __init__(self, nside, nest, pix, emitter, nhit, amp, alpha, beta,
+                 ClassType, ids):
+        self.nside = nside
+        self.nest = nest
+        self.pix = pix
+        self.emitter = emitter
+        self.nhit = nhit
+        self.amp = amp
+        self.alpha = alpha
+        self.beta = beta
+        self.ClassType = ClassType
+        self.ids = ids
+
+    @classmethod
+    def from_catelogues(cls, nside, catelogues, nest=False, chunk=10000,
+                        dtype=np.float64):
+        """
+        Build the model of the catelogues.
+
+        Parameters
+        ----------
+        nside: int and dyadic
+            nside of the footprints, the finest of the maps
+        catelogues: list of tuple
+            (ClassType, PS_data), the catelogues should provide
+            'I_151 (Jy)'
+        nest: bool
+            Whether the pixels are in NESTED ordering
+        chunk: int
+            Number of sources processed at a time
+        dtype: np.dtype
+            Type of the spectral parameters, e.g. np.float32 to halve
+            them at a relative error about 1e-6.
+        """
+        lists = {name: [] for name in ('pix', 'emitter', 'nhit', 'amp',
+                                       'alpha', 'beta', 'ClassType', 'ids')}
+        NumEmitter = 0
+        for ClassType, PS_data in catelogues:
+            PS_data = psTable.as_catelogue(PS_data, ClassType)
+            if 'I_151 (Jy)' not in PS_data:
+                raise ValueError("The catelogue should provide 'I_151 (Jy)'")
+            for start in range(0, PS_data.shape[0], chunk):
+                PS_chunk = PS_data[start:start + chunk]
+                pix, idx, comp, nhit = psDraw.calc_footprint(
+                    nside, PS_chunk, ClassType, nest=nest, chunk=chunk)
+                alpha, beta = psSpec.get_params(PS_chunk, ClassType)
+                NumComp = alpha.shape[1]
+                # The components with footprints, numbered in order
+                used, emitter = np.unique(idx.astype(np.int64) * NumComp +
+                                          comp, return_inverse=True)
+                src, c = used // NumComp, used % NumComp
+                amp = np.log10(PS_chunk['I_151 (Jy)'] /
+                               PS_chunk['Area (sr)'])
+                lists['pix'].append(pix)
+                lists['emitter'].append(emitter + NumEmitter)
+                lists['nhit'].append(nhit)
+                lists['amp'].append(amp[src])
+                lists['alpha'].append(alpha[src, c])
+                lists['beta'].append(beta[src, c])
+                lists['ClassType'].append(np.full(len(used), ClassType,
+                                                  dtype=np.int8))
+                lists['ids'].append(PS_chunk.ids[src])
+                NumEmitter += len(used)
+        arrays = {name: np.concatenate(values) if len(values) > 0 else
+                  np.zeros((0,)) for name, values in lists.items()}
+        for name in ('pix', 'emitter', 'nhit'):
+            arrays[name] = arrays[name].astype(_small_uint(arrays[name]))
+        for name in ('amp', 'alpha', 'beta'):
+            arrays[name] = arrays[name].astype(dtype)
+        arrays['ClassType'] = arrays['ClassType'].astype(np.int8)
+        arrays['ids'] = arrays['ids'].astype(np.int64)
+
+        return cls(nside, nest, **arrays)
+
+    @property
+    def NumEmitter(self):
+        return len(self.amp)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in (
+            'pix', 'emitter', 'nhit', 'amp', 'alpha', 'beta', 'ClassType',
+            'ids'))
+
+    def save(self, FileName, compressed=False):
+        """
+        Save the model into the npz file.
+        """
+        savez = np.savez_compressed if compressed else np.savez
+        savez(FileName, nside=self.nside, nest=self.nest, pix=self.pix,
+              emitter=self.emitter, nhit=self.nhit, amp=self.amp,
+              alpha=self.alpha, beta=self.beta, ClassType=self.ClassType,
+              ids=self.ids)
+
+    @classmethod
+    def load(cls, FileName):
+        with np.load(FileName, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+        nside = int(arrays.pop('nside'))
+        nest = bool(arrays.pop('nest'))
+
+        return cls(nside, nest, **arrays)
+
+    def _pixels(self, nside, nest):
+        """
+        The pixels of the footprints at the nside, not finer than the
+        model, in the ordering of nest.
+        """
+        if nside > self.nside or nside & (nside - 1) != 0:
+            raise ValueError("nside %d is not a dyadic nside up to %d" %
+                             (nside, self.nside))
+        pix = self.pix.astype(np.int64)
+        if nside == self.nside and nest == self.nest:
+            return pix
+        # The sub pixels of a NESTED pixel are consecutive
+        if not self.nest:
+            pix = hp.ring2nest(self.nside, pix)
+        pix >>= 2 * int(np.log2(self.nside // nside))
+        if not nest:
+            pix = hp.nest2ring(nside, pix)
+
+        return pix
+
+    def render(self, Freq, nside=None, nest=None, ClassTypes=None):
+        """
+        Reconstruct the map at the frequency.
+
+        Parameters
+        ----------
+        Freq: float
+            Frequency
+        nside: int
+            nside of the map, not finer than the model, default as the
+            nside of the model. The map of a coarser nside is the same
+            as drawn at that nside, since the samples of the sources do
+            not depend on the nside.
+        nest: bool
+            Whether the map is in NESTED ordering, default as the model
+        ClassTypes: list of int
+            The classes to be drawn, default as all
+
+        return
+        ------
+        pix_vec: np.ndarray(12*nside^2,)
+        """
+        nside = self.nside if nside is None else nside
+        nest = self.nest if nest is None else nest
+        engine = psSpec.SpecEngine(Freq)
+        x = engine.x[0]
+        with psProfile.stage('render_model'):
+            log_Tb = self.amp + self.alpha * x + self.beta * (x * x)
+            Tb = 10**(log_Tb + engine.logK[0])
+            if ClassTypes is not None:
+                Tb[~np.isin(self.ClassType, ClassTypes)] = 0
+            pix_vec = np.bincount(self._pixels(nside, nest),
+                                  weights=Tb[self.emitter] * self.nhit,
+                                  minlength=12 * nside**2)
+        psProfile.count('pixels_touched', len(self.pix))
+
+        return pix_vec
+
+    def __repr__(self):
+        return "<SkyModel of nside %d, %d components, %d hits, %d bytes>" % (
+            self.nside, self.NumEmitter, len(self.pix), self.nbytes)
+
+
+def main(argv):
+    """
+    A main function for use this module at the command window
+
+    example
+    -------
+    psSkyModel -i PS_tables/SF_100_spec.csv,PS_tables/FRI_100_spec.csv
+    -n 1024 -m PS_model_1024.npz
+    psSkyModel -m PS_model_1024.npz -n 512 -f 120e6:130e6:1e6 -o PS_maps
+    """
+    usage = ("psSkyModel -i <PS names (csv)> -n <nside> -m <model (npz)> "
+             "-z (compressed)\n"
+             "psSkyModel -m <model (npz)> -n <nside> "
+             "-f <frequency list or start:stop:step> -o <Output folder>")
+    try:
+        opts, args = getopt.getopt(
+            argv, "hi:n:m:zf:o:",
+            ["infile=", "nside=", "model=", "compressed", "freq=",
+             "outfold="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    # Default
+    ps_names = []
+    nside = None
+    model_name = None
+    compressed = False
+    freqs = None
+    OutFold = '.'
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-i", "--infile"):
+            ps_names.extend(arg.split(','))
+        elif opt in ("-n", "--nside"):
+            nside = int(arg)
+        elif opt in ("-m", "--model"):
+            model_name = arg
+        elif opt in ("-z", "--compressed"):
+            compressed = True
+        elif opt in ("-f", "--freq"):
+            freqs = psBatch.parse_freqs(arg)
+        elif opt in ("-o", "--outfold"):
+            OutFold = arg
+    if model_name is None:
+        print(usage)
+        sys.exit(2)
+    if len(ps_names) > 0:
+        catelogues = []
+        for name in ps_names:
+            FoldName, FileName = os.path.split(name)
+            catelogues.append(psDraw.read_csv(FileName, FoldName or '.'))
+        model = SkyModel.from_catelogues(nside or 512, catelogues)
+        model.save(model_name, compressed)
+        print(model)
+    if freqs is not None:
+        model = SkyModel.load(model_name)
+        nside = model.nside if nside is None else nside
+        with psWriter.MapWriter() as writer:
+            for freq in freqs:
+                writer.submit(os.path.join(
+                    OutFold, 'PS_nside_' + str(nside) + '_' + str(freq) +
+                    '.fits'), model.render(freq, nside))
+        print("Saved %d maps to %s" % (len(freqs), OutFold))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psSpec is designed to evaluate the spectra of many
+sources at many frequencies at once. Each component of a source, e.g.
+the core, lobe and hotspot of FRII, carries its own spectral index alpha
+and curvature beta,
+
+    log10 S(Freq) = log10 I_151 + alpha * x + beta * x^2,
+    x = log10(Freq / 151MHz),
+
+which are drawn from the per-class distributions of SpecModels, and the
+(NumPS, NumComp, NumFreq) fluxes are evaluated in log space with the
+log frequencies precomputed, chunk by chunk to bound the memory.
+
+The means of the default distributions are the spectra of psDraw.Flux,
+which are used for the catelogues without the columns, i.e. alpha =
+-0.7 for SF, SB and RQ, -0.75 for the lobes and hotspots, and the curved
+spectrum of the cores, whose
+log10 S = log10 I_151 + 0.7 * (log10 Freq - L) - 0.29 * (log10 Freq^2 - L^2)
+with L = log10(151MHz), i.e. alpha = 0.7 - 0.58 * L and beta = -0.29.
+
+Classes
+-------
+SpecEngine: class
+    The fluxes and brightness of the sources at the frequencies.
+
+Functions
+---------
+get_components: names of the components of the class.
+
+draw_params: draw alpha and beta of the sources.
+
+add_spectra: add the columns of alpha and beta to the catelogue.
+
+get_params: alpha and beta of the sources in the catelogue.
+"""
+
+# Modules
+import os
+import sys
+import getopt
+import numpy as np
+# Cumstom designed modules
+from . import psTable
+
+# The reference frequency and its log10
+FREQ0 = 151e6
+LOG_FREQ0 = np.log10(FREQ0)
+# light speed and Boltzmann constant, as psDraw.Flux.calc_Tb
+c = 2.99792458e8
+kb = 1.38e-23
+
+# The spectral models of the components of the classes, i.e.
+# [(name, (mean, sigma) of alpha, (mean, sigma) of beta), ...]
+_main = ('', (-0.7, 0.1), (0.0, 0.0))
+_core = ('core', (0.7 - 0.58 * LOG_FREQ0, 0.1), (-0.29, 0.0))
+_lobe = ('lobe', (-0.75, 0.1), (0.0, 0.0))
+_hotspot = ('hotspot', (-0.75, 0.1), (0.0, 0.0))
+SpecModels = {1: [_main], 2: [_main], 3: [_main],
+              4: [_core, _lobe], 5: [_core, _lobe, _hotspot]}
+
+
+def get_components(ClassType, models=None):
+    """
+    Names of the components of the class, '' for the single component.
+    """
+    models = SpecModels if models is None else models
+
+    return [model[0] for model in models[ClassType]]
+
+
+def _column_names(name):
+    if name == '':
+        return 'alpha', 'beta'
+
+    return 'alpha_' + name, 'beta_' + name
+
+
+def draw_params(ClassType, NumPS, models=None):
+    """
+    Draw alpha and beta of the components of NumPS sources from the
+    normal distributions of the models, by np.random.
+
+    return
+    ------
+    alpha, beta: np.ndarray(NumPS, NumComp)
+    """
+    models = SpecModels if models is None else models
+    alpha = np.zeros((NumPS, len(models[ClassType])))
+    beta = np.zeros((NumPS, len(models[ClassType])))
+    for i, (name, alpha_dist, beta_dist) in enumerate(models[ClassType]):
+        alpha[:, i] = np.random.normal(alpha_dist[0], alpha_dist[1], NumPS)
+        beta[:, i] = np.random.normal(beta_dist[0], beta_dist[1], NumPS)
+
+    return alpha, beta
+
+
+def add_spectra(PS_data, ClassType, models=None):
+    """
+    Add the columns of alpha and beta drawn by draw_params, e.g.
+    'alpha_core' and 'beta_core' of FRI, or 'alpha' and 'beta' of SF.
+
+    return
+    ------
+    PS_data: psTable.Catelogue
+        A new catelogue with the columns
+    """
+    PS_data = psTable.as_catelogue(PS_data, ClassType)
+    alpha, beta = draw_params(ClassType, PS_data.NumPS, models)
+    data = {}
+    for i, name in enumerate(get_components(ClassType, models)):
+        alpha_name, beta_name = _column_names(name)
+        data[alpha_name] = alpha[:, i]
+        data[beta_name] = beta[:, i]
+
+    return PS_data.with_columns(data)
+
+
+def get_params(PS_data, ClassType, models=None):
+    """
+    alpha and beta of the sources, from the columns of the catelogue if
+    exist, otherwise the means of the models.
+
+    return
+    ------
+    alpha, beta: np.ndarray(NumPS, NumComp)
+    """
+    models = SpecModels if models is None else models
+    NumPS = PS_data.shape[0]
+    alpha = np.zeros((NumPS, len(models[ClassType])))
+    beta = np.zeros((NumPS, len(models[ClassType])))
+    for i, (name, alpha_dist, beta_dist) in enumerate(models[ClassType]):
+        alpha_name, beta_name = _column_names(name)
+        alpha[:, i] = PS_data[alpha_name] if alpha_name in PS_data \
+            else alpha_dist[0]
+        beta[:, i] = PS_data[beta_name] if beta_name in PS_data \
+            else beta_dist[0]
+
+    return alpha, beta
+
+
+class SpecEngine:
+    """
+    Evaluate the spectra of the sources at the frequencies.
+
+    Parameters
+    ----------
+    Freqs: np.ndarray(NumFreq,)
+        The frequencies, [Hz]
+    chunk: int
+        Number of sources evaluated at a time in iter_Tb
+
+    example
+    -------
+    >>> engine = SpecEngine(np.arange(120e6, 130e6, 0.1e6))
+    >>> for start, stop, Tb in engine.iter_Tb(PS_data, 4):
+    ...     pass  # Tb is (stop - start, 2, 100)
+    """
+
+    def __init__(self, Freqs, chunk=10000):
+        self.Freqs = np.atleast_1d(np.asarray(Freqs, dtype=np.float64))
+        self.chunk = chunk
+        # log10(Freq / 151MHz) and its square
+        self.x = np.log10(self.Freqs) - LOG_FREQ0
+        self.x2 = self.x * self.x
+        # log10 of the brightness of 1 Jy over 1 sr, see Flux.calc_Tb
+        self.logK = (np.log10(1e-26 / 2 * c * c / kb) -
+                     2 * np.log10(self.Freqs))
+
+    def log_flux(self, I_151, alpha, beta):
+        """
+        log10 of the fluxes, [Jy], (NumPS, NumComp, NumFreq)
+        """
+        log_I = np.log10(I_151)[:, np.newaxis, np.newaxis]
+
+        return (log_I + alpha[:, :, np.newaxis] * self.x +
+                beta[:, :, np.newaxis] * self.x2)
+
+    def flux(self, I_151, alpha, beta):
+        """
+        The fluxes, [Jy], (NumPS, NumComp, NumFreq)
+        """
+        return 10**self.log_flux(I_151, alpha, beta)
+
+    def Tb(self, PS_area, I_151, alpha, beta):
+        """
+        The average surface brightness, as psDraw.Flux.calc_Tb,
+        (NumPS, NumComp, NumFreq)
+        """
+        log_Tb = self.log_flux(I_151, alpha, beta)
+        log_Tb += self.logK
+        log_Tb -= np.log10(PS_area)[:, np.newaxis, np.newaxis]
+
+        return 10**log_Tb
+
+    def calc_Tb(self, PS_data, ClassType, models=None):
+        """
+        The brightness of the sources of the catelogue with the column
+        'I_151 (Jy)', (NumPS, NumComp, NumFreq)
+        """
+        alpha, beta = get_params(PS_data, ClassType, models)
+
+        return self.Tb(PS_data['Area (sr)'], PS_data['I_151 (Jy)'],
+                       alpha, beta)
+
+    def iter_Tb(self, PS_data, ClassType, models=None):
+        """
+        Iterate the brightness chunk by chunk.
+
+        yield
+        -----
+        start, stop, Tb: Tb of the rows start:stop
+        """
+        PS_data = psTable.as_catelogue(PS_data, ClassType)
+        for start in range(0, PS_data.NumPS, self.chunk):
+            PS_chunk = PS_data[start:start + self.chunk]
+            yield (start, start + PS_chunk.NumPS,
+                   self.calc_Tb(PS_chunk, ClassType, models))
+
+
+def main(argv):
+    """
+    A main function for use this module at the command window
+
+    example
+    -------
+    psSpec -i PS_tables/FRI_100_20161009_205700.csv -o PS_tables/FRI_100_spec.csv
+    """
+    usage = "psSpec -i <PS name (csv)> -o <Output csv name>"
+    try:
+        opts, args = getopt.getopt(argv, "hi:o:", ["infile=", "outfile="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    ps_name = out_name = None
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-i", "--infile"):
+            ps_name = arg
+        elif opt in ("-o", "--outfile"):
+            out_name = arg
+    if ps_name is None or out_name is None:
+        print(usage)
+        sys.exit(2)
+    ClassName = os.path.basename(ps_name).split('_')[0]
+    ClassType = psTable.ClassList.index(ClassName) + 1
+    PS_data = psTable.Catelogue.read_csv(ps_name, ClassType)
+    add_spectra(PS_data, ClassType).to_csv(out_name)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
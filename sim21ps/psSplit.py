@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psSplit is designed to draw the maps of the subsets
+of the sources, e.g. per class, per flux bin or per redshift shell, in
+one pass. The subsets are the output channels, defined by the predicates
+on the columns of the catelogues, and the fluxes and footprint of a
+catelogue are calculated once and scattered into all the channels the
+sources belong to, so N channels do not cost N drawings.
+
+A channel is (name, predicate), where predicate(PS_data, ClassType, S)
+returns whether the sources belong to it, np.ndarray(NumPS,) of bool or
+a bool for the whole catelogue, and S is the flux densities of the
+sources at the drawing frequency, [Jy].
+
+Classes
+-------
+SplitRenderer: class
+    The renderer of the channels, a psRender.SkyRenderer.
+
+Functions
+---------
+class_channels: the channels of the classes.
+
+bin_channels: the channels of the bins of a column or the flux.
+
+parse_channels: parse the channels of the command window.
+
+example
+-------
+>>> channels = (psSplit.class_channels() +
+...             psSplit.bin_channels('z', [0, 1, 2, 4]) +
+...             psSplit.bin_channels(psSplit.FLUX, [1e-4, 1e-3, 1e-2]))
+>>> renderer = psSplit.SplitRenderer(512, channels)
+>>> renderer.add('SF_100_20161009_205700.csv', 150e6)
+>>> pix_vec = renderer.channel('z_0_1')
+"""
+
+# Modules
+import os
+import sys
+import getopt
+import numpy as np
+# Cumstom designed modules
+from . import psDraw
+from . import psBatch
+from . import psRender
+from . import psStats
+from . import psTable
+from . import psWriter
+from . import psProfile
+
+# The name of the flux densities at the drawing frequency in bin_channels
+FLUX = 'S (Jy)'
+
+
+def class_channels(ClassTypes=(1, 2, 3, 4, 5)):
+    """
+    The channels of the classes, named as psTable.ClassList, e.g. 'SF'.
+    """
+    channels = []
+    for ClassType in ClassTypes:
+        def predicate(PS_data, SourceType, S, ClassType=ClassType):
+            return SourceType == ClassType
+        channels.append((psTable.ClassList[ClassType - 1], predicate))
+
+    return channels
+
+
+def bin_channels(column, edges):
+    """
+    The channels of the bins [edges[i], edges[i+1]) of the column, or of
+    the flux densities if column is FLUX, named by the first word of the
+    column and the edges, e.g. 'z_0_1'.
+    """
+    short = column.split(' ')[0]
+    channels = []
+    for low, high in zip(edges[:-1], edges[1:]):
+        def predicate(PS_data, ClassType, S, low=low, high=high):
+            values = S if column == FLUX else PS_data[column]
+            return (values >= low) & (values < high)
+        channels.append(('%s_%g_%g' % (short, low, high), predicate))
+
+    return channels
+
+
+def parse_channels(ChannelStr):
+    """
+    Parse the channels, e.g. 'class', 'z:0,1,2,4' of the column 'z', or
+    'S:1e-4,1e-3' of the flux densities.
+    """
+    if ChannelStr == 'class':
+        return class_channels()
+    column, EdgeStr = ChannelStr.split(':')
+    edges = [float(value) for value in EdgeStr.split(',')]
+    if column == FLUX.split(' ')[0]:
+        column = FLUX
+
+    return bin_channels(column, edges)
+
+
+class SplitRenderer(psRender.SkyRenderer):
+    """
+    Render the point sources onto the maps of the channels, and onto
+    pix_vec with all the sources.
+
+    Parameters
+    ----------
+    nside: int and dyadic
+        Number of subpixel in a healpix cell
+    channels: list of tuple
+        (name, predicate) of the channels
+    ordering, dtype, chunk, cache:
+        As psRender.SkyRenderer
+
+    Attributes
+    ----------
+    names: list of str
+        Names of the channels
+    pix_cube: np.ndarray(NumChannel, npix)
+        The accumulation maps of the channels
+    """
+
+    def __init__(self, nside, channels, ordering='RING', dtype=np.float64,
+                 chunk=10000, cache=True):
+        super().__init__(nside, ordering, dtype, chunk, cache)
+        self.names = [name for name, predicate in channels]
+        if len(set(self.names)) != len(self.names):
+            raise ValueError("The names of the channels are not unique")
+        self.predicates = [predicate for name, predicate in channels]
+        self.pix_cube = np.zeros((len(channels), self.npix), dtype=self.dtype)
+        self._pixels = {}
+
+    def reset(self):
+        super().reset()
+        self.pix_cube[:] = 0
+
+    def clear_cache(self):
+        super().clear_cache()
+        self._pixels.clear()
+
+    def pixels(self, footprint, key=None):
+        """
+        The pixels touched by the footprint, and the index of the samples
+        in them, (upix, inverse), cached by key if provided.
+        """
+        if key is not None and key in self._pixels:
+            return self._pixels[key]
+        upix, inverse = np.unique(footprint[0], return_inverse=True)
+        if key is not None and self.cache:
+            self._pixels[key] = (upix, inverse)
+
+        return upix, inverse
+
+    def masks(self, ClassType, PS_data, Freq, PS_flux_list):
+        """
+        Whether the sources belong to the channels.
+
+        return
+        ------
+        masks: np.ndarray(NumPS, NumChannel) of bool
+        """
+        NumPS = PS_data.shape[0]
+        S = psStats.calc_S(Freq, PS_data['Area (sr)'], PS_flux_list)
+        masks = np.zeros((NumPS, len(self.predicates)), dtype=bool)
+        for c, predicate in enumerate(self.predicates):
+            masks[:, c] = predicate(PS_data, ClassType, S)
+
+        return masks
+
+    def add_class(self, ClassType, PS_data, Freq, key=None):
+        """
+        Add the sources of ClassType at frequency Freq to the maps of
+        the channels they belong to, with the fluxes and footprint
+        calculated once.
+        """
+        PS_data = psTable.as_catelogue(PS_data, ClassType)
+        PS_flux_list = psDraw.calc_flux(ClassType, Freq, PS_data)
+        footprint = self.footprint(PS_data, ClassType, key)
+        masks = self.masks(ClassType, PS_data, Freq, PS_flux_list)
+        pix, idx, comp, nhit = footprint
+        with psProfile.stage('render'):
+            if PS_flux_list.ndim == 1:
+                weights = PS_flux_list[idx] * nhit
+            else:
+                weights = PS_flux_list[idx, comp] * nhit
+            upix, inverse = self.pixels(footprint, key)
+            self.pix_vec[upix] += np.bincount(inverse, weights=weights,
+                                              minlength=len(upix))
+            # Only the samples of the sources in a channel are binned
+            for c in range(len(self.names)):
+                if not masks[:, c].any():
+                    continue
+                inside = masks[idx, c]
+                self.pix_cube[c, upix] += np.bincount(
+                    inverse[inside], weights=weights[inside],
+                    minlength=len(upix))
+        psProfile.count('pixels_touched', len(pix) * (1 + len(self.names)))
+
+        return self
+
+    def channel(self, name, copy=True):
+        """
+        The map of the channel, a copy unless copy is False.
+        """
+        pix_vec = self.pix_cube[self.names.index(name)]
+        if copy:
+            return pix_vec.copy()
+
+        return pix_vec
+
+
+def main(argv):
+    """
+    A main function for use this module at the command window
+
+    example
+    -------
+    psSplit -i PS_tables/SF_100_spec.csv,PS_tables/FRI_100_spec.csv
+    -n 512 -f 150e6 -c class -c z:0,1,2,4 -c S:1e-4,1e-3,1e-2 -o PS_maps
+    """
+    usage = ("psSplit -i <PS names (csv)> -n <nside> "
+             "-f <frequency list or start:stop:step> -o <Output folder> "
+             "-c <channels, 'class', '<column>:<edges>' or 'S:<edges>'>")
+    try:
+        opts, args = getopt.getopt(
+            argv, "hi:n:f:o:c:",
+            ["infile=", "nside=", "freq=", "outfold=", "channels="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    # Default
+    ps_names = []
+    nside = 512
+    freqs = [150e6]
+    OutFold = '.'
+    channels = []
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-i", "--infile"):
+            ps_names.extend(arg.split(','))
+        elif opt in ("-n", "--nside"):
+            nside = int(arg)
+        elif opt in ("-f", "--freq"):
+            freqs = psBatch.parse_freqs(arg)
+        elif opt in ("-o", "--outfold"):
+            OutFold = arg
+        elif opt in ("-c", "--channels"):
+            channels.extend(parse_channels(arg))
+    if len(ps_names) == 0 or len(channels) == 0:
+        print(usage)
+        sys.exit(2)
+    if os.path.exists(OutFold) == False:
+        os.makedirs(OutFold)
+    renderer = SplitRenderer(nside, channels)
+    with psWriter.MapWriter() as writer:
+        for freq in freqs:
+            renderer.reset()
+            for name in ps_names:
+                renderer.add(name, freq)
+            for name in renderer.names:
+                writer.submit(os.path.join(
+                    OutFold, 'PS_nside_' + str(nside) + '_' + str(freq) +
+                    '_' + name + '.fits'), renderer.channel(name, copy=False),
+                    copy=True)
+    print("Saved %d maps to %s" % (len(writer.written), OutFold))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
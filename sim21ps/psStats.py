@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psStats is designed to collect the statistics of the
+drawn maps on the fly, i.e. the histograms of the source fluxes (the
+differential source counts dN/dS), the per-class totals, and the angular
+power spectrum of the map in memory, so that the validation does not
+read the maps again. The results are saved into a json or npz file
+beside the map.
+
+Classes
+-------
+MapStats: class
+    Accumulate the statistics of the sources and maps.
+
+Functions
+---------
+calc_S: the flux densities of the sources from their brightness.
+
+example
+-------
+>>> stats = psStats.MapStats()
+>>> pix_vec = psDraw.draw_ps(512, 150e6, 'SF_100_20161009_205700.csv',
+...                          stats=stats)
+>>> stats.save('SF_nside_512.stats.json')
+"""
+
+# Modules
+import json
+import numpy as np
+# Cumstom designed modules
+from . import psTable
+from .psLazy import LazyModule
+# The heavy modules are imported on the first use
+hp = LazyModule('healpy')
+
+# light speed and Boltzmann constant, as psDraw.Flux.calc_Tb
+c = 2.99792458e8
+kb = 1.38e-23
+
+
+def calc_S(Freq, PS_area, PS_flux_list):
+    """
+    The flux densities of the sources in Jy, the inverse of
+    psDraw.Flux.calc_Tb, summed over the components.
+
+    Parameters
+    ----------
+    Freq: float
+        Frequency
+    PS_area: np.ndarray(NumPS,)
+        Area of the sources, [sr]
+    PS_flux_list: np.ndarray
+        (NumPS,) or (NumPS, NumComp), as psDraw.calc_flux
+    """
+    Tb = PS_flux_list if PS_flux_list.ndim == 1 else \
+        PS_flux_list.sum(axis=1)
+
+    return Tb * PS_area * 2 * Freq * Freq * kb / c / c / 1e-26
+
+
+class MapStats:
+    """
+    The statistics of the drawn sources and maps.
+
+    Parameters
+    ----------
+    bins: np.ndarray
+        Edges of the flux bins, [Jy], default as 60 logarithmic bins
+        from 1e-6 to 1 Jy
+    lmax: int or False
+        The maximum multipole of the power spectrum, default as
+        3*nside-1, and the spectrum is not calculated if False.
+
+    Attributes
+    ----------
+    counts: dict
+        Histograms of the fluxes of the classes, {ClassName: counts}
+    totals: dict
+        Number and total flux of the sources of the classes
+    maps: dict
+        Statistics of the maps, {name: {'sum', 'mean', 'std', ...}}
+    cls: dict
+        Angular power spectra of the maps, {name: cl}
+    """
+
+    def __init__(self, bins=None, lmax=None):
+        if bins is None:
+            bins = np.logspace(-6, 0, 61)
+        self.bins = np.asarray(bins, dtype=np.float64)
+        self.lmax = lmax
+        self.counts = {}
+        self.totals = {}
+        self.maps = {}
+        self.cls = {}
+
+    def add(self, ClassType, Freq, PS_data, PS_flux_list):
+        """
+        Add the fluxes of the sources drawn, e.g. a chunk.
+        """
+        ClassName = psTable.ClassList[ClassType - 1]
+        PS_data = psTable.as_catelogue(PS_data, ClassType)
+        S = calc_S(Freq, PS_data['Area (sr)'], PS_flux_list)
+        counts, edges = np.histogram(S, bins=self.bins)
+        if ClassName not in self.counts:
+            self.counts[ClassName] = np.zeros(len(self.bins) - 1,
+                                              dtype=np.int64)
+            self.totals[ClassName] = {'NumPS': 0, 'flux (Jy)': 0.0,
+                                      'Freq': Freq}
+        self.counts[ClassName] += counts
+        self.totals[ClassName]['NumPS'] += len(S)
+        self.totals[ClassName]['flux (Jy)'] += float(S.sum())
+
+    def add_map(self, pix_vec, name='total', nest=False):
+        """
+        Add the statistics and the power spectrum of the map in memory.
+        """
+        self.maps[name] = {'npix': len(pix_vec),
+                           'sum': float(pix_vec.sum()),
+                           'mean': float(pix_vec.mean()),
+                           'std': float(pix_vec.std()),
+                           'min': float(pix_vec.min()),
+                           'max': float(pix_vec.max()),
+                           'nonzero': int(np.count_nonzero(pix_vec))}
+        if self.lmax is not False:
+            if nest:
+                pix_vec = hp.reorder(pix_vec, n2r=True)
+            self.cls[name] = hp.anafast(pix_vec, lmax=self.lmax)
+
+    def dNdS(self, ClassName=None):
+        """
+        The differential source counts per sr, [Jy^-1 sr^-1], of the
+        class, or all the classes if None.
+        """
+        if ClassName is None:
+            counts = sum(self.counts.values())
+        else:
+            counts = self.counts[ClassName]
+
+        return counts / np.diff(self.bins) / (4 * np.pi)
+
+    def merge(self, other):
+        """
+        Merge the statistics of another MapStats with the same bins.
+        """
+        for ClassName, counts in other.counts.items():
+            if ClassName not in self.counts:
+                self.counts[ClassName] = counts.copy()
+                self.totals[ClassName] = dict(other.totals[ClassName])
+            else:
+                self.counts[ClassName] += counts
+                self.totals[ClassName]['NumPS'] += \
+                    other.totals[ClassName]['NumPS']
+                self.totals[ClassName]['flux (Jy)'] += \
+                    other.totals[ClassName]['flux (Jy)']
+        self.maps.update(other.maps)
+        self.cls.update(other.cls)
+
+    def report(self):
+        """
+        The statistics as a json serializable dict.
+        """
+        report = {'bins (Jy)': self.bins.tolist(),
+                  'counts': {name: counts.tolist()
+                             for name, counts in self.counts.items()},
+                  'totals': self.totals,
+                  'maps': self.maps,
+                  'cls': {name: cl.tolist() for name, cl in self.cls.items()}}
+        if len(self.counts) > 0:
+            report['dNdS (Jy^-1 sr^-1)'] = self.dNdS().tolist()
+
+        return report
+
+    def save(self, FileName):
+        """
+        Save the statistics into json, or npz if FileName ends with
+        '.npz', in which the arrays are named as 'counts_SF', 'cl_total'.
+        """
+        if FileName.endswith('.npz'):
+            arrays = {'bins': self.bins,
+                      'totals': json.dumps(self.totals),
+                      'maps': json.dumps(self.maps)}
+            for name, counts in self.counts.items():
+                arrays['counts_' + name] = counts
+            for name, cl in self.cls.items():
+                arrays['cl_' + name] = cl
+            np.savez(FileName, **arrays)
+        else:
+            with open(FileName, 'w') as fp:
+                json.dump(self.report(), fp, indent=1)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psTable is designed to hold the ps catelogues in
+memory as columns of contiguous numpy arrays, which are shared by
+psCatelogue and psDraw. The columns are views of one (NumCol, NumPS)
+block, so getting a column or slicing the rows copies nothing, and the
+catelogue is converted from and to pandas.DataFrame only when the csv
+files are read and written.
+
+Classes
+-------
+Catelogue: class
+    The columnar catelogue, with the IDs and class type of the sources.
+
+Functions
+---------
+as_catelogue: convert a DataFrame to Catelogue, if it is not one.
+
+example
+-------
+>>> cat = Catelogue.read_csv('PS_tables/SF_100_20161009_205700.csv')
+>>> theta = cat['Theta (deg)']  # np.ndarray, a view
+>>> head = cat[:10]  # Catelogue, views of the first 10 rows
+"""
+
+# Modules
+import numpy as np
+# Cumstom designed modules
+from .psLazy import LazyModule
+# The heavy modules are imported on the first use
+pd = LazyModule('pandas')
+
+# Names of the classes, ClassType is the index + 1
+ClassList = ['SF', 'SB', 'RQ', 'FRI', 'FRII']
+
+
+class Catelogue:
+    """
+    The columnar catelogue of point sources.
+
+    Parameters
+    ----------
+    columns: list of str
+        Names of the columns, e.g. ['z', 'dA (Mpc)', 'Theta (deg)', ...]
+    block: np.ndarray(NumCol, NumPS)
+        Values of the columns, the column i is block[i]
+    ids: np.ndarray(NumPS,)
+        IDs of the sources, default as 0, 1, ..., NumPS - 1
+    ClassType: int
+        Class type of the sources, 1 to 5 as ClassList, or None
+    """
+    __slots__ = ('columns', 'ids', 'ClassType', '_block', '_index')
+
+    def __init__(self, columns, block, ids=None, ClassType=None):
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim != 2 or block.shape[0] != len(columns):
+            raise ValueError("The block should be of (%d, NumPS)" %
+                             len(columns))
+        self.columns = list(columns)
+        self._block = block
+        self._index = {name: i for i, name in enumerate(self.columns)}
+        if ids is None:
+            ids = np.arange(block.shape[1])
+        self.ids = np.asarray(ids, dtype=np.int64)
+        if self.ids.shape != (block.shape[1],):
+            raise ValueError("The ids should be of (%d,)" % block.shape[1])
+        self.ClassType = ClassType
+
+    @classmethod
+    def from_arrays(cls, data, ids=None, ClassType=None):
+        """
+        Build from the dict of columns, {name: np.ndarray(NumPS,)}, the
+        columns are copied into one block.
+        """
+        columns = list(data.keys())
+        NumPS = len(np.atleast_1d(data[columns[0]])) if columns else 0
+        block = np.empty((len(columns), NumPS))
+        for i, name in enumerate(columns):
+            block[i] = data[name]
+
+        return cls(columns, block, ids, ClassType)
+
+    @classmethod
+    def from_frame(cls, frame, ClassType=None):
+        """
+        Build from the DataFrame, whose index is the IDs.
+        """
+        block = np.ascontiguousarray(frame.values.T, dtype=np.float64)
+
+        return cls(list(frame.columns), block, frame.index.values, ClassType)
+
+    def to_frame(self):
+        """
+        Convert to the DataFrame indexed by the IDs, named 'ID'.
+        """
+        frame = pd.DataFrame(self._block.T, columns=self.columns,
+                             index=pd.Index(self.ids, name='ID'))
+
+        return frame
+
+    @classmethod
+    def read_csv(cls, PathName, ClassType=None):
+        return cls.from_frame(pd.read_csv(PathName, index_col=0), ClassType)
+
+    def to_csv(self, PathName):
+        self.to_frame().to_csv(PathName)
+
+    @property
+    def NumPS(self):
+        return self._block.shape[1]
+
+    @property
+    def shape(self):
+        return (self._block.shape[1], self._block.shape[0])
+
+    @property
+    def block(self):
+        return self._block
+
+    def __len__(self):
+        return self._block.shape[1]
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __getitem__(self, key):
+        """
+        The column of name key as a view, or the rows of key as a
+        Catelogue, which are views if key is a slice.
+        """
+        if isinstance(key, str):
+            return self._block[self._index[key]]
+        if isinstance(key, slice):
+            return Catelogue(self.columns, self._block[:, key],
+                             self.ids[key], self.ClassType)
+
+        return self.take(key)
+
+    def take(self, indices):
+        """
+        The rows of the indices or the boolean mask, copied.
+        """
+        indices = np.asarray(indices)
+        return Catelogue(self.columns, self._block[:, indices],
+                         self.ids[indices], self.ClassType)
+
+    def select(self, ids):
+        """
+        The rows of the IDs, in the order of the catelogue.
+        """
+        return self.take(np.isin(self.ids, ids))
+
+    def positions(self, ids):
+        """
+        The row positions of the IDs, which should be in the catelogue.
+        """
+        order = np.argsort(self.ids, kind='stable')
+        pos = order[np.searchsorted(self.ids, ids, sorter=order)]
+        if np.any(self.ids[pos] != ids):
+            raise KeyError("Some IDs are not in the catelogue")
+
+        return pos
+
+    def with_columns(self, data):
+        """
+        A new catelogue with the columns of data, {name: np.ndarray},
+        added or replaced.
+        """
+        columns = list(self.columns)
+        for name in data:
+            if name not in self._index:
+                columns.append(name)
+        block = np.empty((len(columns), self.NumPS))
+        block[:len(self.columns)] = self._block
+        for name, values in data.items():
+            block[columns.index(name)] = values
+
+        return Catelogue(columns, block, self.ids, self.ClassType)
+
+    def values(self, columns=None):
+        """
+        The (NumPS, NumCol) array of the columns, copied.
+        """
+        if columns is None:
+            return self._block.T.copy()
+
+        return np.stack([self[name] for name in columns], axis=1)
+
+    @staticmethod
+    def concat(catelogues):
+        """
+        Concatenate the catelogues with the same columns.
+        """
+        columns = catelogues[0].columns
+        for cat in catelogues[1:]:
+            if cat.columns != columns:
+                raise ValueError("The columns are different")
+        block = np.concatenate([cat.block for cat in catelogues], axis=1)
+        ids = np.concatenate([cat.ids for cat in catelogues])
+
+        return Catelogue(columns, block, ids, catelogues[0].ClassType)
+
+    def __repr__(self):
+        return "<Catelogue of %d sources, ClassType %s, columns %s>" % (
+            self.NumPS, self.ClassType, self.columns)
+
+
+def as_catelogue(PS_data, ClassType=None):
+    """
+    The Catelogue of PS_data, which is converted if it is a DataFrame.
+    """
+    if isinstance(PS_data, Catelogue):
+        return PS_data
+
+    return Catelogue.from_frame(PS_data, ClassType)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016 Zhixian MA <zxma_sjtu@qq.com>
+# MIT license
+
+"""
+This module namely psWriter is designed to overlap the drawing and the
+writing of the maps in the runs of many frequencies or catelogues. The
+drawn maps are submitted to a background writer thread through a queue,
+so the map k is written while the map k+1 is drawn. The number of maps
+submitted but not written yet is capped by max_inflight, i.e. submit
+blocks until the writer catches up, so the memory stays bounded.
+
+The writing of fits is mostly I/O, which releases the GIL, so one
+writer thread is enough to hide it behind the drawing.
+
+Classes
+-------
+MapWriter: class
+    The background writer with the bounded number of in-flight maps.
+
+example
+-------
+>>> with psWriter.MapWriter(max_inflight=2) as writer:
+...     for freq in freqs:
+...         pix_vec = psDraw.draw_ps(512, freq, 'SF_100_20161009_205700.csv')
+...         writer.submit('SF_%s.fits' % freq, pix_vec)
+"""
+
+# Modules
+import queue
+import threading
+# Cumstom designed modules
+from . import psDraw
+from . import psProfile
+
+
+class MapWriter:
+    """
+    Write the maps in a background thread.
+
+    Parameters
+    ----------
+    max_inflight: int
+        The maximum number of maps submitted but not written yet, 0 to
+        write the maps in submit without the thread.
+    write: function
+        write(fits_name, pix_vec), default as psDraw.write_map
+
+    Attributes
+    ----------
+    written: list of str
+        Names of the maps written, in order
+    """
+
+    def __init__(self, max_inflight=2, write=None):
+        self.max_inflight = max_inflight
+        self.write = psDraw.write_map if write is None else write
+        self.written = []
+        self._error = None
+        self._thread = None
+        if max_inflight > 0:
+            self._slots = threading.Semaphore(max_inflight)
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run,
+                                            name='MapWriter', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            fits_name, pix_vec = item
+            try:
+                if self._error is None:
+                    self.write(fits_name, pix_vec)
+                    self.written.append(fits_name)
+            except BaseException as error:
+                self._error = error
+            finally:
+                del item, pix_vec
+                self._slots.release()
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError("Failed to write the maps") from self._error
+
+    def submit(self, fits_name, pix_vec, copy=False):
+        """
+        Submit the map to be written, which blocks while max_inflight
+        maps are waiting. The map should not be changed after, unless
+        copy is True, e.g. the reused map of psRender.SkyRenderer.result.
+        """
+        self._check()
+        if self._thread is None:
+            self.write(fits_name, pix_vec)
+            self.written.append(fits_name)
+            return
+        with psProfile.stage('wait_writer'):
+            self._slots.acquire()
+        self._check()
+        if copy:
+            pix_vec = pix_vec.copy()
+        self._queue.put((fits_name, pix_vec))
+
+    def close(self):
+        """
+        Wait until all the maps are written, and stop the thread.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            with psProfile.stage('wait_writer'):
+                self._thread.join()
+            self._thread = None
+        self._check()
+
+        return self.written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        elif self._thread is not None:
+            # Stop after the maps submitted, and raise the original error
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None